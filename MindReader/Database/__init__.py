@@ -11,7 +11,7 @@ from pathlib import Path
 
 DATABASES = {}  # Scheme: Database-class
 
-INTERNAL_FILES = {'__init__.py'}
+INTERNAL_FILES = {'__init__.py', '__main__.py'}
 
 
 def _collect_databases():
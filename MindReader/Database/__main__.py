@@ -0,0 +1,49 @@
+import logging
+
+import click
+
+from . import Database
+from ..utils import log_error
+
+logger = logging.getLogger('Database')
+
+
+@click.group()
+def cli():
+	pass
+
+
+@cli.command(name='migrate-results')
+@click.argument('database-url')
+@log_error(logger)
+def migrate_results(database_url):
+	"""
+	Converts the results stored as JSON strings in the database at DATABASE-URL to sub-documents.
+	"""
+	migrated = Database(database_url).migrate_results()
+	print(f'Migrated {migrated} snapshots')
+
+
+@cli.command(name='ensure-indexes')
+@click.argument('database-url')
+@log_error(logger)
+def ensure_indexes(database_url):
+	"""
+	Creates the missing indexes of the database at DATABASE-URL, and reports the collections and indexes stats.
+	"""
+	database = Database(database_url)
+	missing = database.ensure_indexes()
+	for collection, stats in database.stats().items():
+		print(f'{collection}: {stats["count"]} documents, {stats["size"]} bytes '
+		      f'({stats["storage_size"]} bytes on storage)')
+		for name, index in stats['indexes'].items():
+			unique = ' unique' if index['unique'] else ''
+			print(f'\t{name}: {index["keys"]}{unique}, {index["size"]} bytes')
+	for collection, keys in missing:
+		print(f'Missing index on {collection}: {keys}')
+	if missing:
+		raise SystemExit(1)
+
+
+if __name__ == '__main__':
+	cli()
@@ -27,6 +27,20 @@ class MongoDatabase:
 	scheme = 'mongo'
 	DEFAULT_PORT = 27017
 	SUPPORTABLE_FIELDS = ['pose', 'color_image', 'depth_image', 'feelings']  # TODO: change this
+	DUPLICATE_KEY = 11000  # Mongo's error code
+	PATH_NOT_VIABLE = 28  # Mongo's error code, for setting a result in a snapshot whose results are still a string
+	# Collection: [(keys, index options)]
+	INDEXES = {
+		'users': [
+			([('user_id', pymongo.ASCENDING)], {'unique': True}),
+		],
+		'snapshots': [
+			([('user_id', pymongo.ASCENDING), ('snapshot_id', pymongo.ASCENDING)], {'unique': True}),
+			# Snapshots pages (Ordered by time, snapshot_id breaks ties)
+			([('user_id', pymongo.ASCENDING), ('timestamp', pymongo.ASCENDING), ('snapshot_id', pymongo.ASCENDING)],
+			 {}),
+		],
+	}
 
 	def __init__(self, host, port=None):
 		if port is None:
@@ -40,33 +54,86 @@ class MongoDatabase:
 			logger.error(e)
 			raise e
 
-		db = client.db
 		self.client = client
-		self.db = db
-		db.users.create_index([('user_id', pymongo.ASCENDING)], unique=True)
+		self.db = client.db
+		missing = self.ensure_indexes()
+		if missing:
+			logger.error(f'The database is missing indexes, lookups will scan the collections - {missing}')
 
 		logger.info(f'Connected to DB {host}:{port}')
 
+	def ensure_indexes(self):
+		"""
+		Creates the declared indexes (INDEXES) which don't exist yet, and verifies all of them are in place.
+		:return: List of (collection, keys) of the indexes which couldn't be created.
+		"""
+		missing = []
+		for collection, indexes in self.INDEXES.items():
+			try:
+				self.db[collection].create_indexes([pymongo.IndexModel(keys, **options) for keys, options in indexes])
+			except pymongo.errors.PyMongoError as e:  # i.e. duplicates prevent a unique index
+				logger.error(f'Failed creating the indexes of {collection} - {e}')
+
+			existing = self.db[collection].index_information().values()
+			for keys, options in indexes:
+				if not any(list(index['key']) == keys and index.get('unique', False) == options.get('unique', False)
+				           for index in existing):
+					missing.append((collection, keys))
+		return missing
+
+	def stats(self):
+		"""
+		Size and index statistics of the collections.
+		:return: Dict of collection name: stats.
+		"""
+		stats = {}
+		for collection in self.INDEXES:
+			collection_stats = self.db.command('collStats', collection)
+			stats[collection] = {
+				'count': collection_stats['count'],
+				'size': collection_stats['size'],
+				'storage_size': collection_stats.get('storageSize'),
+				'indexes': {index: {'keys': info['key'], 'unique': info.get('unique', False),
+				                    'size': collection_stats['indexSizes'].get(index)}
+				            for index, info in self.db[collection].index_information().items()},
+			}
+		return stats
+
 	def save(self, name: str, data: dict):
 		"""
 		:param data: A dict which must have the following structure:
 		{'user_id': ..., 'timestamp': ..., result_name: {'result': ..., 'result_data': (Optional - URL/Path to the file)}}.
 		"""
 		logger.info(f'Got new message to save - from {name}')
-		snapshots = self.db.snapshots
-		iden = self.snapshot_identification(data)
-		snapshot = snapshots.find_one(iden)
-		if snapshot is None:
-			logger.debug('Inserting new snapshot...')
-			data['result'] = json.dumps(data['result'])
-			snapshots.insert_one(data)
-			return
-		logger.info(str(data['result']))
-		result_dict = json.loads(snapshot['result'])
-		result_dict[name] = data['result'][name]
+		self.save_many([(name, data)])
 
-		snapshots.update_one(iden, {'$set': {'result': json.dumps(result_dict)}})
-		logger.debug('Snapshot have been updated')
+	def save_many(self, results):
+		"""
+		Saves a batch of results with a single bulk write.
+		Every result is upserted to it's own sub-document, so concurrent savers don't overwrite each other.
+		Snapshots whose results are still a JSON string (Older savers) are migrated on the way.
+		:param results: Iterable of (name, data) pairs, as given to save.
+		"""
+		results = list(results)
+		requests = [pymongo.UpdateOne(self.snapshot_identification(data),
+		                              {'$set': {f'result.{name}': data['result'][name]}}, upsert=True)
+		            for name, data in results]
+		if not requests:
+			return
+		logger.debug(f'Upserting {len(requests)} results...')
+		try:
+			self.db.snapshots.bulk_write(requests, ordered=False)
+		except pymongo.errors.BulkWriteError as e:
+			errors = e.details['writeErrors']
+			if any(error['code'] not in (self.DUPLICATE_KEY, self.PATH_NOT_VIABLE) for error in errors):
+				raise
+			# Another saver inserted the same new snapshot concurrently, now it exists - so simply update it.
+			# Or the snapshot's results are a string, which are converted first.
+			for error in errors:
+				if error['code'] == self.PATH_NOT_VIABLE:
+					self.migrate_snapshot(self.snapshot_identification(results[error['index']][1]))
+			self.db.snapshots.bulk_write([requests[error['index']] for error in errors], ordered=False)
+		logger.debug('Snapshots have been updated')
 
 	def save_user(self, user: dict):
 		"""
@@ -99,6 +166,54 @@ class MongoDatabase:
 			return user_snapshots
 		return list(map(self.fix_snapshot_result, user_snapshots))
 
+	def get_snapshots_page(self, user_id, limit, after=None, before=None, fields=None):
+		"""
+		A page of the user's snapshots ordered by time, read straight from the index.
+		The page starts right after the snapshot of the cursor after, or ends right before the one of before.
+		(Cursors are made by snapshot_cursor)
+		:param limit: The page size, None for all the snapshots.
+		:param fields: Optional - The snapshot fields to fetch, all of them by default.
+		:return: (snapshots, more) - more tells if there are more snapshots in the paging direction.
+		"""
+		query = {'user_id': str(user_id)}
+		order = pymongo.ASCENDING
+		cursor = after
+		if before is not None:
+			order, cursor = pymongo.DESCENDING, before
+		if cursor is not None:
+			timestamp, snapshot_id = self.parse_cursor(cursor)
+			compare = '$gt' if order == pymongo.ASCENDING else '$lt'
+			query['timestamp'] = {compare + 'e': timestamp}
+			query['$or'] = [{'timestamp': {compare: timestamp}},
+			                {'timestamp': timestamp, 'snapshot_id': {compare: snapshot_id}}]
+
+		projection = None
+		if fields is not None:
+			projection = {'_id': 0, **{field: 1 for field in fields}}
+		found = self.db.snapshots.find(query, projection).sort([('timestamp', order), ('snapshot_id', order)])
+		if limit is not None:
+			found = found.limit(limit + 1)
+		snapshots = list(found)
+		more = limit is not None and len(snapshots) > limit
+		snapshots = snapshots[:limit]
+		if order == pymongo.DESCENDING:
+			snapshots.reverse()
+		if fields is None or 'result' in fields:
+			snapshots = list(map(self.fix_snapshot_result, snapshots))
+		return snapshots, more
+
+	@staticmethod
+	def snapshot_cursor(snapshot):
+		"""
+		Paging cursor of a snapshot, for get_snapshots_page.
+		"""
+		return f'{snapshot["timestamp"]}_{snapshot["snapshot_id"]}'
+
+	@staticmethod
+	def parse_cursor(cursor):
+		timestamp, snapshot_id = cursor.split('_', 1)
+		return int(timestamp), snapshot_id
+
 	@string_ids
 	def get_snapshot(self, user_id, snapshot_id):
 		user = self.get_user(user_id)
@@ -112,19 +227,68 @@ class MongoDatabase:
 
 	@string_ids
 	def get_snapshot_result(self, user_id, snapshot_id, result_name):
-		user, snapshot = self.get_snapshot(user_id, snapshot_id)
-		if snapshot is None or user is None or result_name not in snapshot['result']:
-			return user, snapshot, None
-		return user, snapshot, snapshot['result'][result_name]
+		"""
+		Fetches only the requested result of the snapshot (The snapshot is returned without the other results).
+		Results which are still a JSON string (Older savers) are fetched whole and decoded.
+		"""
+		user = self.get_user(user_id)
+		if user is None:
+			return None, None, None
+		query = {'user_id': user_id, 'snapshot_id': snapshot_id}
+		projection = {'_id': 0, 'user_id': 1, 'snapshot_id': 1, 'timestamp': 1, f'result.{result_name}': 1}
+		snapshot = self.db.snapshots.find_one(query, projection)
+		if snapshot is None:
+			return user, None, None
+		if 'result' not in snapshot:  # Either no such result, or the results are a string
+			legacy = self.db.snapshots.find_one({**query, 'result': {'$type': 'string'}}, {'result': 1})
+			if legacy is not None:
+				snapshot['result'] = {result_name: json.loads(legacy['result']).get(result_name)}
+		result = snapshot.setdefault('result', {}).get(result_name)
+		if result is None:
+			snapshot['result'] = {}
+		return user, snapshot, result
 
 	@string_ids
 	def get_snapshots_amount(self, user_id):
 		return self.db.snapshots.count({'user_id': user_id})
 
+	def migrate_results(self, batch_size=1000):
+		"""
+		Converts results stored by older savers as JSON strings to sub-documents.
+		:return: The amount of migrated snapshots.
+		"""
+		snapshots = self.db.snapshots
+		migrated = 0
+		requests = []
+		for snapshot in snapshots.find({'result': {'$type': 'string'}}, {'result': 1}):
+			requests.append(self.result_migration(snapshot))
+			if len(requests) == batch_size:
+				migrated += snapshots.bulk_write(requests, ordered=False).modified_count
+				requests = []
+		if requests:
+			migrated += snapshots.bulk_write(requests, ordered=False).modified_count
+		logger.info(f'Migrated {migrated} snapshots')
+		return migrated
+
+	def migrate_snapshot(self, query):
+		"""
+		Converts the results of the snapshot to a sub-document, if they are still a JSON string.
+		"""
+		snapshot = self.db.snapshots.find_one({**query, 'result': {'$type': 'string'}}, {'result': 1})
+		if snapshot is not None:
+			self.db.snapshots.bulk_write([self.result_migration(snapshot)])
+
+	@staticmethod
+	def result_migration(snapshot):
+		# Conditioned on the string, in case another saver already converted it
+		return pymongo.UpdateOne({'_id': snapshot['_id'], 'result': snapshot['result']},
+		                         {'$set': {'result': json.loads(snapshot['result'])}})
+
 	@staticmethod
 	def fix_snapshot_result(snapshot):
-		snapshot['result'] = json.loads(snapshot['result'])
-		del snapshot['_id']
+		if isinstance(snapshot.get('result'), str):  # Stored by older savers as JSON, until migrate_results
+			snapshot['result'] = json.loads(snapshot['result'])
+		snapshot.pop('_id', None)
 		return snapshot
 
 	@staticmethod
@@ -1,2 +1,3 @@
-from .http_driver import HTTPDriver
+from .http_driver import HTTPDriver, configure_session, shared_session
 from .object_driver import ObjectDriver
+from .segment_driver import SegmentDriver
@@ -1,7 +1,10 @@
 from io import BytesIO, StringIO
 import logging
+import os
+import threading
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from ..manager import driver
 from ... import utils  # For
@@ -9,6 +12,40 @@ from ... import utils  # For
 logger = logging.getLogger('http_driver')
 utils = utils  # Ignore warning for not using, only importing to run the logging setup
 
+DEFAULT_POOL_SIZE = 10  # Kept connections per host
+DEFAULT_POOL_HOSTS = 10
+_session = None
+_session_pid = None  # A forked process opens it's own connections
+_session_lock = threading.Lock()
+
+
+def configure_session(pool_size=DEFAULT_POOL_SIZE, hosts=DEFAULT_POOL_HOSTS, session=None):
+	"""
+	Replaces the session shared by the HTTP drivers, which keeps the connections alive across files.
+	:param pool_size: Maximal amount of kept connections to each host (Should fit the amount of concurrent users).
+	:param hosts: Amount of hosts to keep connections to.
+	:param session: Optional - Injected session (Or any object with get/post), i.e. for tests.
+	"""
+	global _session, _session_pid
+	if session is None:
+		session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size)
+		session.mount('http://', adapter)
+		session.mount('https://', adapter)
+	with _session_lock:
+		_session, _session_pid = session, os.getpid()
+	return session
+
+
+def shared_session():
+	"""
+	The session shared by the HTTP drivers, created on first use (And in every forked process).
+	"""
+	with _session_lock:
+		if _session is not None and _session_pid == os.getpid():
+			return _session
+	return configure_session()
+
 
 @driver('http')
 class HTTPDriver:
@@ -17,19 +54,21 @@ class HTTPDriver:
 	"""
 	SCHEME = 'http://'
 
-	def __init__(self, url, mode, headers=None, *, requests=requests):
+	def __init__(self, url, mode, headers=None, *, timeout=None, requests=None):
 		"""
 		Initialize Driver for writing and reading from remote HTTP server.
 		:param url: URL to access the server (Should be as  host/URI
 		:param mode: 'r' or 'w' i.e. GET or POST. if 'b' is set data is accessed as binary.
 		:param headers: Optional - Headers to give the request.
-		:param requests: Optional - Injected 'requests' module
+		:param timeout: Optional - Seconds to wait for the server, as requests takes it (i.e. (connect, read)).
+		:param requests: Optional - Injected 'requests' module/session, the shared session is used by default.
 		"""
 		self.url = self.SCHEME + url.split('://', 1)[-1]
 		self.mode = mode
 		self.headers = {} if headers is None else headers
 		self.body = BytesIO() if 'b' in mode else StringIO()
-		self.requests = requests
+		self.timeout = timeout
+		self.requests = requests or shared_session()
 
 		if 'r' not in mode:
 			logger.info('New POST file is open')
@@ -37,7 +76,7 @@ class HTTPDriver:
 
 		else:
 			logger.info('New GET file is open')
-			self.response = self.requests.get(self.url, headers=self.headers)
+			self.response = self.requests.get(self.url, headers=self.headers, timeout=self.timeout)
 			logger.debug(f'URL={self.url}, body size- {len(self.response.text)}')
 
 			if 'b' in mode:
@@ -95,7 +134,8 @@ class HTTPDriver:
 		:param keep_body: Should I keep the body for next flush?
 		"""
 		logger.debug(f'Sending POST to {self.url} with body of size {len(self.body.getvalue())}')
-		self.response = self.requests.post(self.url, data=self.body.getvalue(), headers=self.headers)
+		self.response = self.requests.post(self.url, data=self.body.getvalue(), headers=self.headers,
+		                                   timeout=self.timeout)
 		logger.debug(f'The length of the response is {len(self.response.text)}')
 		if not keep_body:
 			self.body = BytesIO() if 'b' in StringIO() else ''
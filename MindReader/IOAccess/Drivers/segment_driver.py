@@ -0,0 +1,46 @@
+import io
+import logging
+
+from ..manager import driver
+from ..segment_store import SCHEME, parse_locator
+
+logger = logging.getLogger('segment_driver')
+
+
+@driver(SCHEME)
+class SegmentDriver:
+	"""
+	Read only access to a record of a segment file, located as path#offset:length.
+	"""
+
+	def __init__(self, url, mode='rb'):
+		if 'w' in mode or 'a' in mode:
+			raise ValueError('Segments are written only by the segment store')
+		self.path, self.offset, self.length = parse_locator(url)
+		self.fd = io.open(self.path, 'rb')
+		self.fd.seek(self.offset)
+		logger.debug(f'Reading {self.length} bytes at {self.offset} of {self.path}')
+
+	def read(self, size=-1):
+		left = self.offset + self.length - self.fd.tell()
+		size = left if size is None or size < 0 else min(size, left)
+		return self.fd.read(max(size, 0))
+
+	def seek(self, position, whence=io.SEEK_SET):
+		if whence == io.SEEK_END:
+			position += self.length
+		elif whence == io.SEEK_CUR:
+			position += self.tell()
+		return self.fd.seek(self.offset + position) - self.offset
+
+	def tell(self):
+		return self.fd.tell() - self.offset
+
+	def close(self):
+		self.fd.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
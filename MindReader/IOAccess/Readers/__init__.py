@@ -1 +1 @@
-from .readers import read_json, read_protobuf_sample, read_snapshot_protobuf, read_user_protobuf
+from .readers import read_json, read_protobuf_sample, read_mmap_sample, read_snapshot_protobuf, read_user_protobuf
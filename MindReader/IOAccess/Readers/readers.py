@@ -1,24 +1,62 @@
+import gzip
 import io
+import itertools
 import json
+import mmap
 import struct
 
 from google.protobuf.json_format import MessageToDict
 
 from ..manager import reader
-from ...utils.protobuf import Snapshot, User
+from ..sample_index import MESSAGE_HEADER_SIZE, message_datetime
+from ...utils.protobuf import LazyMessage, Snapshot, User
+
+MESSAGE_CHUNK_SIZE = 64 * 1024
 
 
 @reader('sample')
 @reader('sample', 'protobuf', 'application/protobuf')
-def read_protobuf_sample(fd):
+def read_protobuf_sample(fd, *, index=None, start=0, stop=None, since=None, raw=False):
 	"""
 	Reads the Sample, with the injected Driver interface
+	The snapshots can be selected by their positions [start, stop) and by their datetime (since).
+	With the sample's index (SampleIndex) the reader seeks to the first one instead of scanning.
+	If raw is set, the snapshots are given serialized, without decoding them.
 	"""
 	messages = read_messages(fd)
-	with io.BytesIO(next(messages)) as fd:
-		user = read_user_protobuf(fd)
-	snapshots = map(Snapshot.FromString, messages)
-	return user, snapshots
+	with io.BytesIO(next(messages)) as user_fd:
+		user = read_user_protobuf(user_fd)
+	if index is None:
+		messages = select_messages(messages, start, stop, since)
+	else:
+		start, stop = index.positions(start, stop, since)
+		if start < stop:
+			fd.seek(index.offsets[start] - MESSAGE_HEADER_SIZE)  # The next message read is the first selected
+		messages = itertools.islice(messages, stop - start)
+	return user, messages if raw else map(Snapshot.FromString, messages)
+
+
+@reader('sample', 'mmap')
+def read_mmap_sample(fd, *, index=None, start=0, stop=None, since=None, raw=False):
+	"""
+	Reads an uncompressed sample file by mapping it to memory. The snapshots are parsed from slices of the mapping,
+	so they aren't copied, and the pages are shared with any other process reading the same sample.
+	The snapshots are selected like in read_protobuf_sample, if raw is set they are given as the slices.
+	"""
+	if isinstance(fd, gzip.GzipFile):
+		raise ValueError('Only uncompressed samples can be mapped')
+	mapping = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+	messages = read_mapped_messages(mapping)
+	with io.BytesIO(next(messages)) as user_fd:
+		user = read_user_protobuf(user_fd)
+	if index is None:
+		messages = select_messages(messages, start, stop, since)
+	else:
+		start, stop = index.positions(start, stop, since)
+		view = memoryview(mapping)
+		messages = (view[offset:offset + length]
+		            for offset, length in zip(index.offsets[start:stop], index.lengths[start:stop]))
+	return user, messages if raw else map(Snapshot.FromString, messages)
 
 
 @reader('user')
@@ -31,7 +69,12 @@ def read_user_protobuf(fd):
 @reader('snapshot')
 @reader('snapshot', 'protocol_protobuf', 'application/protobuf')
 @reader('snapshot', 'protobuf')  # They are the same for now
-def read_snapshot_protobuf(fd):
+def read_snapshot_protobuf(fd, *, lazy=False):
+	"""
+	:param lazy: If set, the snapshot is given as a LazyMessage, which decodes only the fields being accessed.
+	"""
+	if lazy:
+		return LazyMessage(Snapshot, fd.read())
 	return Snapshot.FromString(fd.read())
 
 
@@ -64,3 +107,55 @@ def read_messages(fd, *, force_open=True):
 	if force_open:
 		fd.close = close
 	close()
+
+
+@reader('message_chunks')
+def read_message_chunks(fd, *, chunk_size=MESSAGE_CHUNK_SIZE):
+	"""
+	Read messages of the format (len | string) as they arrive, each one as an iterator of it's chunks.
+	Whatever the caller didn't read of a message is skipped once the next one is read.
+	fd.read(size) must return size bytes, unless the messages ended.
+	"""
+	while True:
+		raw_len = fd.read(4)
+		if len(raw_len) == 0:
+			return
+		if len(raw_len) < 4:
+			raise ValueError('The messages are truncated')
+		l, = struct.unpack('<L', raw_len)
+		message = _message_chunks(fd, l, chunk_size)
+		yield message
+		for _ in message:
+			pass
+
+
+def _message_chunks(fd, remaining, chunk_size):
+	while remaining:
+		chunk = fd.read(min(remaining, chunk_size))
+		if not chunk:
+			raise ValueError('The messages are truncated')
+		remaining -= len(chunk)
+		yield chunk
+
+
+def read_mapped_messages(buffer):
+	"""
+	Read messages of the format (len | string) from a buffer (i.e. mmap), as memoryview slices of it.
+	"""
+	view = memoryview(buffer)
+	offset = 0
+	while offset < len(view):
+		l, = struct.unpack_from('<L', view, offset)
+		offset += 4
+		yield view[offset:offset + l]
+		offset += l
+
+
+def select_messages(messages, start=0, stop=None, since=None):
+	"""
+	Selects the snapshot messages in positions [start, stop), taken since the given datetime, by scanning them.
+	"""
+	messages = itertools.islice(messages, start, stop)
+	if since is not None:
+		messages = itertools.dropwhile(lambda message: message_datetime(message) < since, messages)
+	return messages
@@ -5,9 +5,11 @@ import struct
 from google.protobuf.json_format import MessageToDict, ParseDict
 from google.protobuf.message import Message
 
-from MindReader.utils.protobuf import User, Snapshot, object_to_protobuf
+from MindReader.utils.protobuf import User, Snapshot, object_to_protobuf, field_numbers, keep_fields
 from ..manager import writer
 
+SNAPSHOT_KEY_FIELDS = {'datetime'}  # Identifies the snapshot, always written
+
 
 ##########################
 # WRITERS
@@ -75,18 +77,23 @@ def write_user_protobuf(fd, user):
 @writer('snapshot', 'protobuf')
 @writer('snapshot', 'protocol_protobuf', 'application/protobuf')
 def write_snapshot_protobuf(fd, snapshot, fields=None):
-	if isinstance(snapshot, Snapshot):  # The easy way out
-		return fd.write(snapshot.SerializeToString())
-
-	new_snapshot = snapshot
-	if not isinstance(snapshot, Snapshot):
+	"""
+	Writes the snapshot, which can also be given serialized (bytes/memoryview).
+	:param fields: Optional - Write only those fields (The datetime is always kept), they are dropped from the
+	wire format, so the others aren't copied through python objects.
+	"""
+	if isinstance(snapshot, (bytes, bytearray, memoryview)):
+		data = snapshot
+	elif isinstance(snapshot, Snapshot):
+		data = snapshot.SerializeToString()
+	else:
 		new_snapshot = Snapshot()
 		object_to_protobuf(snapshot, new_snapshot)
+		data = new_snapshot.SerializeToString()
 
-	for field in new_snapshot.DESCRIPTOR.fields_by_name:
-		if fields is not None and field not in fields:
-			new_snapshot.ClearField(field)
-	return fd.write(new_snapshot.SerializeToString())
+	if fields is not None:
+		data = keep_fields(data, field_numbers(Snapshot, set(fields) | SNAPSHOT_KEY_FIELDS))
+	return fd.write(data)
 
 
 @writer('sample')
@@ -4,7 +4,11 @@ The subpackage support 3 main features:
 Drivers - Abstracts the concept of resource using the classical open API. Each driver must be a file-like object
 Readers - Used to read objects from general locations.
 Writers - Used to write objects to general locations.
+The samples can also be given a sidecar index (sample_index), for random access to their snapshots.
+Raw snapshots can be stored in append-only segments (segment_store), read with the segment:// driver.
 """
 from .manager import WRITERS, READERS, DRIVERS, WRITERS_MIME_TYPE, READERS_MIME_TYPE
 from .manager import driver, writer, reader, open, read, write, read_url, write_url, object_readers, object_writers
+from .sample_index import SampleIndex, build_index, load_index
+from .segment_store import SegmentStore, snapshot_identity, snapshot_directory
 from . import Drivers, Readers, Writers
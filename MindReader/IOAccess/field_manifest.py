@@ -0,0 +1,55 @@
+"""
+Manifest of a raw snapshot file, which holds the byte ranges of each of it's top level fields.
+The file itself stays a whole serialized snapshot, but with the manifest a reader can read only the ranges of the
+fields it needs (i.e. a parser which uses the pose doesn't read the images from the disk).
+The manifest is stored next to the snapshot (<snapshot>.manifest) as JSON: {field name: [[offset, length], ...]}
+"""
+import json
+import os
+
+from .manager import open
+from ..utils.protobuf import Snapshot
+from ..utils.protobuf.wire import field_spans
+
+MANIFEST_SUFFIX = '.manifest'
+
+
+def manifest_path(path):
+	return str(path) + MANIFEST_SUFFIX
+
+
+def write_manifest(path, data, message_type=Snapshot):
+	"""
+	Writes the manifest of the serialized message, which is stored in path.
+	"""
+	names = {field.number: name for name, field in message_type.DESCRIPTOR.fields_by_name.items()}
+	manifest = {}
+	for number, _, start, _, end in field_spans(memoryview(data)):
+		if number in names:
+			manifest.setdefault(names[number], []).append([start, end - start])
+	with open(manifest_path(path), 'w') as fd:
+		json.dump(manifest, fd)
+
+
+def load_manifest(path):
+	"""
+	:return: The manifest of the file in path, or None if it has none.
+	"""
+	if not os.path.exists(manifest_path(path)):
+		return None
+	with open(manifest_path(path)) as fd:
+		return json.load(fd)
+
+
+def read_fields(path, fields, manifest):
+	"""
+	Reads only the given fields from the file.
+	:return: Serialized message which holds the fields.
+	"""
+	ranges = sorted(byte_range for field in fields for byte_range in manifest.get(field, []))
+	chunks = []
+	with open(str(path), 'rb') as fd:
+		for offset, length in ranges:  # In the file's order, so repeated occurrences merge the same
+			fd.seek(offset)
+			chunks.append(fd.read(length))
+	return b''.join(chunks)
@@ -86,7 +86,7 @@ def _data_processor(operation, name, version=None, mimetype=None):
 				context['mime_dict'][name] = {}
 			context['mime_dict'][name][mimetype] = version
 
-		if name not in WRITERS:
+		if name not in context['functions_dict']:
 			context['functions_dict'][name] = {}
 
 		context['functions_dict'][name][version] = obj
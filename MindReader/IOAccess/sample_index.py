@@ -0,0 +1,137 @@
+"""
+Sidecar index of a sample file, which holds the offset, length and datetime of every snapshot message.
+With it a sample can be counted, sought to a timestamp and split between workers, without scanning it.
+The index is stored next to the sample (<sample>.index), offsets are in the uncompressed stream of messages.
+"""
+import bisect
+import logging
+import os
+import struct
+
+from .manager import DRIVERS, open
+from ..utils.protobuf import Snapshot, wire_fields
+
+logger = logging.getLogger('sample_index')
+
+INDEX_SUFFIX = '.index'
+MAGIC = b'MRIX'
+HEADER = struct.Struct('<4sQL')  # magic, size of the sample file, amount of snapshots
+RECORD = struct.Struct('<QLQ')  # offset, length, datetime
+MESSAGE_HEADER_SIZE = 4  # The length prefix of every message
+DATETIME_FIELD = Snapshot.DESCRIPTOR.fields_by_name['datetime'].number
+
+
+class SampleIndex:
+	def __init__(self, offsets, lengths, datetimes):
+		self.offsets = offsets
+		self.lengths = lengths
+		self.datetimes = datetimes
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def positions(self, start=0, stop=None, since=None):
+		"""
+		Resolves a selection of snapshots to the positions of the first and the one after the last.
+		:param start: Position of the first snapshot.
+		:param stop: Optional - Position to stop at.
+		:param since: Optional - Skip the snapshots taken before this datetime (The samples are chronological).
+		"""
+		stop = len(self) if stop is None else min(stop, len(self))
+		if since is not None:
+			start = max(start, bisect.bisect_left(self.datetimes, since))
+		return min(start, stop), stop
+
+	def split(self, parts, start=0, stop=None):
+		"""
+		Splits the snapshots in positions [start, stop) to contiguous ranges of about the same amount of bytes.
+		:return: List of (start, stop) positions, one for each non-empty part.
+		"""
+		stop = len(self) if stop is None else min(stop, len(self))
+		total = sum(self.lengths[start:stop])
+		ranges, size = [], 0
+		for position in range(start, stop):
+			size += self.lengths[position]
+			if size * parts >= total * (len(ranges) + 1) and len(ranges) < parts - 1:
+				ranges.append((start, position + 1))
+				start = position + 1
+		if start < stop:
+			ranges.append((start, stop))
+		return ranges
+
+	def byte_range(self, start, stop):
+		"""
+		:return: The (first, last + 1) bytes of the messages of the snapshots in [start, stop).
+		"""
+		if start >= stop:
+			return 0, 0
+		return self.offsets[start] - MESSAGE_HEADER_SIZE, self.offsets[stop - 1] + self.lengths[stop - 1]
+
+	def write(self, fd, sample_size):
+		fd.write(HEADER.pack(MAGIC, sample_size, len(self)))
+		for record in zip(self.offsets, self.lengths, self.datetimes):
+			fd.write(RECORD.pack(*record))
+
+	@classmethod
+	def read(cls, fd):
+		"""
+		:return: The index, and the size of the sample file it was built for.
+		"""
+		magic, sample_size, amount = HEADER.unpack(fd.read(HEADER.size))
+		if magic != MAGIC:
+			raise ValueError('The file is not a sample index')
+		records = list(RECORD.iter_unpack(fd.read(amount * RECORD.size)))
+		return cls(*map(list, zip(*records))) if records else cls([], [], []), sample_size
+
+
+def index_path(path):
+	return str(path) + INDEX_SUFFIX
+
+
+def build_index(path, scheme=None):
+	"""
+	Scans the sample and writes it's index next to it.
+	:param scheme: Optional - The driver to read the sample with (i.e. gzip), by default from the path.
+	:return: The index.
+	"""
+	offsets, lengths, datetimes = [], [], []
+	with (DRIVERS[scheme](path, 'rb') if scheme else open(path, 'rb')) as fd:
+		position = 0
+		header = fd.read(MESSAGE_HEADER_SIZE)
+		while header:
+			length, = struct.unpack('<L', header)
+			message = fd.read(length)
+			if position:  # The first message is the user
+				offsets.append(position + MESSAGE_HEADER_SIZE)
+				lengths.append(length)
+				datetimes.append(message_datetime(message))
+			position += MESSAGE_HEADER_SIZE + length
+			header = fd.read(MESSAGE_HEADER_SIZE)
+
+	index = SampleIndex(offsets, lengths, datetimes)
+	with open(index_path(path), 'wb') as fd:
+		index.write(fd, os.path.getsize(path))
+	logger.info(f'Indexed {len(index)} snapshots of {path}')
+	return index
+
+
+def load_index(path):
+	"""
+	Loads the index of the sample, if it has an up to date one.
+	:return: The index or None.
+	"""
+	if not os.path.exists(index_path(path)):
+		return None
+	with open(index_path(path), 'rb') as fd:
+		index, sample_size = SampleIndex.read(fd)
+	if sample_size != os.path.getsize(path):
+		logger.warning(f'The index of {path} is out of date, ignoring it')
+		return None
+	return index
+
+
+def message_datetime(message):
+	for number, wire_type, value in wire_fields(message):
+		if number == DATETIME_FIELD:
+			return value
+	return 0
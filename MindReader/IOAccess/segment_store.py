@@ -0,0 +1,148 @@
+"""
+Append-only segment storage of raw snapshots.
+Every user has it's own log files (<data_dir>/<user_id>/<segment number>.<version>), which roll at a size limit.
+Each record is a header (snapshot_id, length) followed by the raw snapshot.
+A stored snapshot is located with segment://<segment file>#<offset>:<length> (The offset of the raw snapshot).
+"""
+import fcntl
+import logging
+import os
+import struct
+import threading
+from pathlib import Path
+
+from .manager import open
+
+logger = logging.getLogger('segment_store')
+
+SCHEME = 'segment'
+RECORD_HEADER = struct.Struct('<QL')  # snapshot_id, length
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class SegmentStore:
+	def __init__(self, data_dir, segment_size=DEFAULT_SEGMENT_SIZE):
+		"""
+		:param data_dir: The directory of the users' segments.
+		:param segment_size: A segment is rolled once it's bigger than this size.
+		"""
+		self.data_dir = Path(data_dir)
+		self.segment_size = segment_size
+		self.segments = {}  # (user_id, version): Current segment number
+		self.lock = threading.Lock()
+
+	def append(self, user_id, snapshot_id, data, version):
+		"""
+		Appends the raw snapshot to the user's current segment.
+		The segment is locked while appending, so processes can share it.
+		:param data: The raw snapshot, a file which holds it, or an iterable of it's chunks. The chunks are written
+		as they come (The record's length is filled at the end), and if they fail, the segment is truncated back.
+		:return: The snapshot's locator.
+		"""
+		if isinstance(data, (bytes, bytearray, memoryview)):
+			chunks, length = [data], len(data)
+		elif hasattr(data, 'fileno'):
+			chunks, length = iter(lambda: data.read(COPY_CHUNK_SIZE), b''), os.fstat(data.fileno()).st_size
+		else:
+			chunks, length = data, None  # Known once written
+		user_dir = self.data_dir / str(user_id)
+		with self.lock:
+			if (user_id, version) not in self.segments:
+				user_dir.mkdir(parents=True, exist_ok=True)
+				self.segments[user_id, version] = last_segment(user_dir, version)
+			number = self.segments[user_id, version]
+
+		while True:
+			path = user_dir / f'{number:08d}.{version}'
+			try:
+				fd = open(str(path), 'ab')
+			except FileNotFoundError:  # The user's directory was removed, after a failed first snapshot
+				user_dir.mkdir(parents=True, exist_ok=True)
+				continue
+			with fd:
+				fcntl.flock(fd, fcntl.LOCK_EX)
+				if os.fstat(fd.fileno()).st_nlink == 0:  # Removed after a failed first snapshot
+					continue
+				offset = fd.seek(0, os.SEEK_END)
+				if offset and offset + RECORD_HEADER.size + (length or 0) > self.segment_size:
+					number += 1  # Roll to a new segment
+					continue
+				length = self.write_record(fd, path, offset, snapshot_id, chunks, length)
+			break
+
+		with self.lock:
+			self.segments[user_id, version] = max(number, self.segments[user_id, version])
+		logger.debug(f'Snapshot {snapshot_id} appended to {path} at {offset}')
+		return locator(path, offset + RECORD_HEADER.size, length)
+
+	@staticmethod
+	def write_record(fd, path, offset, snapshot_id, chunks, length):
+		"""
+		Writes the record at the end of the locked segment.
+		:param length: The snapshot's length, or None to fill it in the header once the chunks were written.
+		:return: The snapshot's length.
+		"""
+		fd.write(RECORD_HEADER.pack(snapshot_id, length or 0))
+		try:
+			written = sum(fd.write(chunk) for chunk in chunks)
+			fd.flush()
+		except BaseException:
+			fd.flush()
+			os.ftruncate(fd.fileno(), offset)
+			if not offset:  # The segment would stay empty
+				os.unlink(path)
+			raise
+		if length is None:  # The segment is appended to, so the header is patched through another handle
+			with open(str(path), 'r+b') as header_fd:
+				header_fd.seek(offset)
+				header_fd.write(RECORD_HEADER.pack(snapshot_id, written))
+		return written
+
+
+def last_segment(user_dir, version):
+	numbers = [int(path.name.split('.', 1)[0]) for path in user_dir.glob(f'*.{version}')]
+	return max(numbers, default=0)
+
+
+def locator(path, offset, length):
+	return f'{SCHEME}://{path}#{offset}:{length}'
+
+
+def parse_locator(url):
+	"""
+	:return: The segment's path, offset and length.
+	"""
+	url = url.split('://', 1)[-1]
+	path, byte_range = url.rsplit('#', 1)
+	offset, length = map(int, byte_range.split(':'))
+	return path, offset, length
+
+
+def is_locator(path):
+	return str(path).startswith(f'{SCHEME}://')
+
+
+def snapshot_identity(path):
+	"""
+	Identifies the snapshot stored in the path, or in the segment locator.
+	:return: (user_id, snapshot_id) as strings.
+	"""
+	if not is_locator(path):
+		path = Path(path)
+		return str(path.parent.parent.name), str(path.parent.name)
+
+	segment_path, offset, _ = parse_locator(path)
+	with open(segment_path, 'rb') as fd:
+		fd.seek(offset - RECORD_HEADER.size)
+		snapshot_id, _ = RECORD_HEADER.unpack(fd.read(RECORD_HEADER.size))
+	return Path(segment_path).parent.name, str(snapshot_id)
+
+
+def snapshot_directory(path):
+	"""
+	The directory of the snapshot's results (The snapshot's own directory, or the user's for segments).
+	"""
+	if is_locator(path):
+		return Path(parse_locator(path)[0]).parent
+	return Path(path).parent
@@ -1,9 +1,13 @@
 """
 Abstraction of usage of message queue.
 To choose one, can either use MESSAGE_QUEUES, or encode the message queue framework in the scheme.
+Extra arguments of MessageQueue are passed to the implementation, i.e. publishing options such as
+confirm_batch (Durable publishing, committed in batches).
 Maintenance:
 Simply add the implementation in a file in the subpackage.
 Add the scheme as an attribute
+Publishing functions should accept channel=None and wait=True, and return a confirmation (Future) when
+publishing is batched.
 """
 
 import importlib
@@ -1,25 +1,322 @@
 import json
 import logging
 import functools
-from pathlib import Path
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
 
 import pika
 
+from ..IOAccess import snapshot_identity
+
 logger = logging.getLogger('MessageQueue')
 
+RECOVERABLE_ERRORS = (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError)
+DECLARED = weakref.WeakKeyDictionary()  # Channel: the queues/exchanges already declared on it
+
+
+def declare_once(channel, declare, **kwargs):
+	"""
+	Declares a queue/exchange only once per channel, saving a round trip for every publish on long lived channels.
+	:param declare: Name of the channel's declaring method (i.e. queue_declare)
+	"""
+	key = (declare, tuple(sorted(kwargs.items())))
+	declared = DECLARED.setdefault(channel, set())
+	if key not in declared:
+		getattr(channel, declare)(**kwargs)
+		declared.add(key)
+
+
+class ChannelPool:
+	"""
+	Bounded pool of long lived channels, each on its own connection (pika's connections aren't thread-safe).
+	A channel is lent to one caller at a time, and dropped from the pool once it breaks.
+	Before lending an idle channel, it's connection processes it's pending I/O, so one closed by the broker
+	(i.e. after missed heartbeats) is found and replaced, instead of silently losing the publish.
+	"""
+
+	def __init__(self, parameters, size):
+		self.parameters = parameters
+		self.size = size
+		self.reconnects = 0
+		self._idle = []  # Stack, the most recently used channel is lent first
+		self._available = threading.Condition()  # Notified once a channel is idle, or can be opened
+		self._opened = 0
+
+	def acquire(self):
+		"""
+		Lends an open channel. Opens a new one if the pool isn't full, otherwise waits for an idle one.
+		"""
+		while True:
+			with self._available:
+				while not self._idle and self._opened >= self.size:
+					self._available.wait()
+				item = self._idle.pop() if self._idle else None
+				if item is None:
+					self._opened += 1
+			if item is None:
+				return self._open()
+
+			connection, channel = item
+			try:  # An idle connection doesn't answer heartbeats, so the broker may have closed it meanwhile
+				connection.process_data_events(time_limit=0)
+			except RECOVERABLE_ERRORS as e:
+				logger.debug(f'Dropping a stale pooled channel - {e}')
+			else:
+				if connection.is_open and channel.is_open:
+					return item
+			self.invalidate(item)
+
+	def release(self, item):
+		with self._available:
+			self._idle.append(item)
+			self._available.notify()
+
+	def invalidate(self, item):
+		"""
+		Drops a broken channel, the next acquire will open a fresh connection instead.
+		"""
+		with self._available:
+			self._opened -= 1
+			self.reconnects += 1
+			self._available.notify()
+		self._close_connection(item[0])
+
+	def close(self):
+		with self._available:
+			idle, self._idle = self._idle, []
+			self._opened -= len(idle)
+			self._available.notify_all()
+		for connection, _ in idle:
+			self._close_connection(connection)
+
+	def _open(self):
+		try:
+			connection = pika.BlockingConnection(self.parameters)
+			return connection, connection.channel()
+		except Exception:
+			with self._available:
+				self._opened -= 1
+				self._available.notify()
+			raise
+
+	@staticmethod
+	def _close_connection(connection):
+		try:
+			if connection.is_open:
+				connection.close()
+		except Exception as e:
+			logger.debug(f'Failed closing connection - {e}')
+
 
-def refresh_channel(f):
+class BatchPublisher:
 	"""
-	Refresh the connection to the MQ.
+	Publishes messages from every thread on one dedicated channel, in batches.
+	Each batch is committed as an AMQP transaction - a single round trip after which the broker
+	has every message of the batch, so the delivery is durable once the message's future is done.
+	A batch is flushed when it reaches batch_size messages, or flush_interval seconds after it's first message.
+	"""
+
+	def __init__(self, pool, batch_size, flush_interval, max_tries, reconnect_delay):
+		self.pool = pool
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.max_tries = max_tries
+		self.reconnect_delay = reconnect_delay
+		self.item = None
+		self._pending = queue.Queue()
+		self._thread = threading.Thread(target=self._run, name='BatchPublisher', daemon=True)
+		self._thread.start()
+
+	def publish(self, publish):
+		"""
+		Queues a message to the next batch.
+		:param publish: Function which publishes the message on a given channel.
+		:return: Future which is done once the message's batch was committed.
+		"""
+		confirmation = Future()
+		self._pending.put((publish, confirmation))
+		return confirmation
+
+	def close(self):
+		self._pending.put(None)
+		self._thread.join()
+
+	def _collect(self):
+		batch = [self._pending.get()]
+		deadline = time.monotonic() + self.flush_interval
+		while batch[-1] is not None and len(batch) < self.batch_size:
+			timeout = deadline - time.monotonic()
+			if timeout <= 0:
+				break
+			try:
+				batch.append(self._pending.get(timeout=timeout))
+			except queue.Empty:
+				break
+		return batch
+
+	def _run(self):
+		while True:
+			batch = self._collect()
+			closing = batch[-1] is None
+			if closing:
+				batch.pop()
+			if batch:
+				self._flush(batch)
+			if closing:
+				if self.item is not None:
+					self.pool.release(self.item)
+				return
+
+	def _flush(self, batch):
+		logger.debug(f'Flushing batch of {len(batch)} messages')
+		for attempt in range(self.max_tries):
+			try:
+				if self.item is None:
+					self.item = self.pool.acquire()
+					self.item[1].tx_select()
+				channel = self.item[1]
+				for publish, _ in batch:
+					publish(channel)
+				channel.tx_commit()
+			except RECOVERABLE_ERRORS as e:
+				logger.warning(f'Lost connection to the message queue, reconnecting - {e}')
+				if self.item is not None:
+					self.pool.invalidate(self.item)
+					self.item = None
+				time.sleep(attempt * self.reconnect_delay)
+				continue
+			except Exception as e:  # Only this batch fails, the thread keeps publishing the next ones
+				logger.error(f'Failed publishing a batch - {e}')
+				if self.item is not None:  # The transaction is left half published
+					self.pool.invalidate(self.item)
+					self.item = None
+				for _, confirmation in batch:
+					confirmation.set_exception(e)
+				return
+			for _, confirmation in batch:
+				confirmation.set_result(None)
+			return
+
+		error = ConnectionError("The message queue isn\'t reachable")
+		for _, confirmation in batch:
+			confirmation.set_exception(error)
+
+
+class SaverBuffer:
+	"""
+	Buffers the messages consumed by the saver, and saves them together once batch_size messages arrived,
+	or flush_interval seconds after the first one. The batch is acked (or returned to the queue) as a whole.
+	A batch which fails again after being returned is saved one message at a time, and the messages which still
+	fail (poison messages) are logged and rejected without requeueing, so they don't return forever.
+	"""
+
+	def __init__(self, saver, batch_size, flush_interval):
+		self.saver = saver
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.reset(None)
+
+	def reset(self, channel):
+		self.channel = channel
+		self.users = []
+		self.results = []
+		self.messages = []  # (delivery tag, user or None, result or None)
+		self.redelivered = False
+		self.last_tag = None
+		self.timer = None
+
+	def add(self, channel, delivery_tag, body, redelivered=False):
+		if 'gender' in body and 'birthday' in body:  # Save user
+			self.users.append(body)
+			self.messages.append((delivery_tag, body, None))
+		else:
+			self.results.append((body['name'], body['save']))
+			self.messages.append((delivery_tag, None, self.results[-1]))
+		self.redelivered = self.redelivered or redelivered
+		self.last_tag = delivery_tag
+
+		if len(self.users) + len(self.results) >= self.batch_size:
+			self.flush()
+		elif self.timer is None:
+			self.timer = channel.connection.call_later(self.flush_interval, self.on_timeout)
+
+	def on_timeout(self):
+		self.timer = None
+		self.flush()
+
+	def flush(self):
+		if self.timer is not None:
+			self.channel.connection.remove_timeout(self.timer)
+		if self.last_tag is None:
+			return
+
+		logger.debug(f'Saving {len(self.users)} users and {len(self.results)} results...')
+		try:
+			for user in self.users:
+				self.saver.save_user(user)
+			if self.results:
+				self.saver.save_many(self.results)
+		except Exception as e:
+			if self.redelivered:
+				logger.error(f'Saving failed again, saving the batch one by one - {e}')
+				self.save_one_by_one()
+			else:
+				logger.error(f'Saving failed, returning the batch to the queue - {e}')
+				self.channel.basic_nack(delivery_tag=self.last_tag, multiple=True, requeue=True)
+		else:
+			self.channel.basic_ack(delivery_tag=self.last_tag, multiple=True)
+		self.reset(self.channel)
+
+	def save_one_by_one(self):
+		for delivery_tag, user, result in self.messages:
+			try:
+				if user is not None:
+					self.saver.save_user(user)
+				else:
+					self.saver.save_many([result])
+			except Exception as e:
+				logger.error(f'Dropping a message which can\'t be saved - {e}')
+				self.channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+			else:
+				self.channel.basic_ack(delivery_tag=delivery_tag)
+
+
+def pooled_channel(f):
+	"""
+	Lends a channel from the pool for the call, unless the caller gives it's own.
+	If the connection broke, the call is retried on a fresh one.
+	In batched mode the message is queued to the batch publisher instead, and the confirmation is returned.
+	If wait is set, the call returns only once the message's batch was committed (TimeoutError after CONFIRM_TIMEOUT).
 	"""
 
 	@functools.wraps(f)
-	def wrapper(self, *args, **kwargs):
-		self.connection = pika.BlockingConnection(pika.ConnectionParameters(self.host, self.port))
-		if self.connection.is_closed:
-			raise ConnectionError("The message queue isn\'t reachable")
-		self.channel = self.connection.channel()
-		return f(self, *args, **kwargs)
+	def wrapper(self, message, channel=None, *, wait=True):
+		if self.batcher is not None:
+			confirmation = self.batcher.publish(functools.partial(f, self, message))
+			if wait:
+				confirmation.result(timeout=self.CONFIRM_TIMEOUT)
+			return confirmation
+
+		if channel is not None:
+			return f(self, message, channel)
+
+		for attempt in range(self.MAX_TRIES):
+			item = None
+			try:
+				item = self.pool.acquire()
+				result = f(self, message, item[1])
+			except RECOVERABLE_ERRORS as e:
+				logger.warning(f'Lost connection to the message queue, reconnecting - {e}')
+				if item is not None:
+					self.pool.invalidate(item)
+				time.sleep(attempt * self.RECONNECT_DELAY)
+				continue
+			self.pool.release(item)
+			return result
+		raise ConnectionError("The message queue isn\'t reachable")
 
 	return wrapper
 
@@ -36,8 +333,8 @@ def body_json(f):
 
 def publish_json(f):
 	@functools.wraps(f)
-	def wrapper(self, message, channel=None):
-		return f(self, json.dumps(message), channel)
+	def wrapper(self, message, *args, **kwargs):
+		return f(self, json.dumps(message), *args, **kwargs)
 
 	return wrapper
 
@@ -45,13 +342,34 @@ def publish_json(f):
 class RabbitMQ:
 	scheme = 'rabbitmq'
 	DEFAULT_PORT = 5672
-
-	def __init__(self, host, port=None):
+	DEFAULT_POOL_SIZE = 8
+	MAX_TRIES = 3
+	RECONNECT_DELAY = 1  # Seconds, grows linearly with each try
+	CONFIRM_TIMEOUT = 60  # Seconds a publisher waits for it's batch to be committed
+	DEFAULT_CONFIRM_INTERVAL = 0.005  # Seconds
+	DEFAULT_SAVER_BATCH = 100
+	DEFAULT_SAVER_INTERVAL = 0.05  # Seconds
+
+	def __init__(self, host, port=None, pool_size=DEFAULT_POOL_SIZE, confirm_batch=None,
+	             confirm_interval=DEFAULT_CONFIRM_INTERVAL):
+		"""
+		:param pool_size: Maximal amount of connections used for publishing.
+		:param confirm_batch: If given, publishing is durable - messages are committed to the broker in batches
+		of up to confirm_batch messages, or whatever was published within confirm_interval seconds.
+		"""
 		if port is None:
 			port = self.DEFAULT_PORT
 		self.host, self.port = host, port
+		self.parameters = pika.ConnectionParameters(host, int(port))
+		self.pool = ChannelPool(self.parameters, pool_size)
+		self.batcher = None
+		if confirm_batch is not None:
+			self.batcher = BatchPublisher(self.pool, confirm_batch, confirm_interval, self.MAX_TRIES,
+			                              self.RECONNECT_DELAY)
+		self.consumer_reconnects = 0
+		self.consumers = []  # Setup functions of the consumers, replayed after reconnecting
 		try:
-			self.connection = pika.BlockingConnection(pika.ConnectionParameters(host, int(port)))
+			self.connection = pika.BlockingConnection(self.parameters)
 			self.channel = self.connection.channel()
 		except Exception as e:
 			self.connection = None
@@ -61,107 +379,244 @@ class RabbitMQ:
 		logger.info('Message Queue connected')
 		logger.debug(f'The message queue is at {host}:{port}')
 
+	@property
+	def reconnects(self):
+		"""
+		Amount of times a broken connection to the broker was replaced (For monitoring).
+		"""
+		return self.pool.reconnects + self.consumer_reconnects
+
 	@publish_json
-	@refresh_channel
+	@pooled_channel
 	def publish_user(self, user, channel=None):
-		if channel is None:
-			channel = self.channel
-			self.channel = None
 		logger.debug('Uploading user to saver queue')
-		channel.queue_declare(queue='saver', durable=True)
+		declare_once(channel, 'queue_declare', queue='saver', durable=True)
 		channel.basic_publish(exchange='', routing_key='saver', body=user,
 		                      properties=pika.BasicProperties(delivery_mode=2))
 		logger.debug('New user on saver queue')
 
-	@refresh_channel
+	@pooled_channel
 	def publish_snapshot(self, snapshot, channel=None):
-		if channel is None:
-			channel = self.channel
-			self.channel = None
 		logger.debug('Publishing new snapshot...')
-		channel.exchange_declare(exchange='raw_snapshot', exchange_type='fanout')
+		declare_once(channel, 'exchange_declare', exchange='raw_snapshot', exchange_type='fanout')
 		channel.basic_publish(exchange='raw_snapshot', body=snapshot, routing_key='',
 		                      properties=pika.BasicProperties(delivery_mode=2))
 		logger.debug('new snapshot published')
 
 	@publish_json
-	@refresh_channel
+	@pooled_channel
 	def publish_result(self, result, channel=None):
-		if channel is None:
-			channel = self.channel
-			self.channel = None
 		logger.debug('Publishing new result...')
-		channel.queue_declare(queue='saver', durable=True)
+		declare_once(channel, 'queue_declare', queue='saver', durable=True)
 		channel.basic_publish(routing_key='saver', exchange='', body=result,
 		                      properties=pika.BasicProperties(delivery_mode=2))
 		logger.debug(f'New result published {result}')
 
-	def run_parser(self, name, parser, start_consuming=True):
+	def run_parser(self, name, parser, start_consuming=True, executor=None, prefetch=None):
 		"""
 		Running parser which feeds on the message queue.
 		Passing the parser every field it needs from the snapshot, and publishes the result.
+		:param executor: Optional - Executor (i.e. process pool) to run the parser in. Every snapshot is acked
+		only after it's parsing has finished.
+		:param prefetch: Optional - Bounds the amount of un-acked snapshots of all the parsers on the channel together
+		(Should fit the executor's workers).
 		"""
 
 		def parser_callback(result_name, handler):
 			def callback(channel, method, properties, body):
 				logger.debug(f'New raw snapshot received for parser {result_name}')
-				raw_snapshot_path = Path(body.decode())
-
-				user_id = str(raw_snapshot_path.parent.parent.name)
-				snapshot_id = str(raw_snapshot_path.parent.name)
+				raw_snapshot_path = body.decode()
 
-				db_result = handler(raw_snapshot_path, result_name)
-				if db_result is None:  # Nothing to publish
-					channel.basic_ack(delivery_tag=method.delivery_tag)
-					return
-				logger.debug('Finished the parsing')
-				db_result.update({'snapshot_id': snapshot_id, 'user_id': user_id})
-				self.publish_result({'save': db_result, 'name': result_name}, channel=channel)
+				def on_parsed(db_result):
+					if db_result is None:  # Nothing to publish
+						channel.basic_ack(delivery_tag=method.delivery_tag)
+						return
+					logger.debug('Finished the parsing')
+					confirmation = self.publish_parsed(raw_snapshot_path, result_name, db_result, channel)
+					self.ack_when_confirmed(channel, method.delivery_tag, confirmation)
 
-				channel.basic_ack(delivery_tag=method.delivery_tag)
+				self.run_handler(channel, method.delivery_tag, executor, on_parsed, handler, raw_snapshot_path,
+				                 result_name)
 
 			return callback
 
 		logger.info(f'Assigning new parser - {name}')
-		self.channel.exchange_declare(exchange='raw_snapshot', exchange_type='fanout')
-		self.channel.queue_declare(queue=name, durable=True)
-		self.channel.queue_bind(queue=name, exchange='raw_snapshot')
-		self.channel.basic_consume(queue=name, on_message_callback=parser_callback(name, parser))
+		self.add_consumer(self.raw_snapshot_consumer(name, parser_callback(name, parser), prefetch))
 
 		if start_consuming:
 			self.consume()
 
-	def run_saver(self, saver, start_consuming=True):
+	def run_combined_parser(self, name, parser, result_names, start_consuming=True, executor=None, prefetch=None):
+		"""
+		Running one consumer for few parsers, so each raw snapshot is read and decoded once for all of them.
+		:param name: The name of the consumed queue.
+		:param parser: Handler which receives the snapshot path and result names, and returns dict of the results.
+		:param executor, prefetch: See run_parser.
+		"""
+
+		def callback(channel, method, properties, body):
+			logger.debug(f'New raw snapshot received for parsers {result_names}')
+			raw_snapshot_path = body.decode()
+
+			def on_parsed(db_results):
+				logger.debug('Finished the parsing')
+				confirmations = [self.publish_parsed(raw_snapshot_path, result_name, db_result, channel)
+				                 for result_name, db_result in (db_results or {}).items()]
+				self.ack_when_confirmed(channel, method.delivery_tag, *confirmations)
+
+			self.run_handler(channel, method.delivery_tag, executor, on_parsed, parser, raw_snapshot_path,
+			                 result_names)
+
+		logger.info(f'Assigning new combined parser - {result_names}')
+		self.add_consumer(self.raw_snapshot_consumer(name, callback, prefetch))
+
+		if start_consuming:
+			self.consume()
+
+	@staticmethod
+	def run_handler(channel, delivery_tag, executor, on_result, handler, *args):
+		"""
+		Runs the handler on the consumer's thread, or in the executor if one is given.
+		Either way on_result is called with the handler's result on the consumer's thread.
+		If the executor fails running the handler, the message is returned to the queue.
+		"""
+		if executor is None:
+			return on_result(handler(*args))
+
+		def on_done(future):
+			if future.exception() is not None:
+				logger.error(f'The worker failed, returning the message to the queue - {future.exception()}')
+				callback = functools.partial(channel.basic_nack, delivery_tag=delivery_tag, requeue=True)
+			else:
+				callback = functools.partial(on_result, future.result())
+			if channel.is_open:  # Otherwise the message is re-delivered anyway
+				channel.connection.add_callback_threadsafe(callback)
+
+		executor.submit(handler, *args).add_done_callback(on_done)
+
+	def publish_parsed(self, raw_snapshot_path, result_name, db_result, channel):
+		"""
+		Publishes a parser's result for the saver, identified by the raw snapshot it was parsed from.
+		"""
+		user_id, snapshot_id = snapshot_identity(raw_snapshot_path)
+		db_result.update({'snapshot_id': snapshot_id, 'user_id': user_id})
+		return self.publish_result({'save': db_result, 'name': result_name}, channel=channel, wait=False)
+
+	@staticmethod
+	def raw_snapshot_consumer(name, callback, prefetch=None):
+		"""
+		Consumer setup of a queue bound to the raw snapshots exchange.
+		"""
+
+		def setup(channel):
+			if prefetch is not None:  # Shared by all the consumers of the channel, which share the executor
+				channel.basic_qos(prefetch_count=prefetch, global_qos=True)
+			channel.exchange_declare(exchange='raw_snapshot', exchange_type='fanout')
+			channel.queue_declare(queue=name, durable=True)
+			channel.queue_bind(queue=name, exchange='raw_snapshot')
+			channel.basic_consume(queue=name, on_message_callback=callback)
+
+		return setup
+
+	def run_saver(self, saver, start_consuming=True, batch_size=None, flush_interval=None):
 		"""
 		Assigns a saver to the Message Queue.
+		The messages are saved in batches (See SaverBuffer), and acked only after their batch was saved.
 		"""
+		buffer = SaverBuffer(saver, batch_size or self.DEFAULT_SAVER_BATCH,
+		                     self.DEFAULT_SAVER_INTERVAL if flush_interval is None else flush_interval)
 
 		@body_json
 		def callback(channel, method, properties, body):
-			if 'gender' and 'birthday' in body:  # Save user
-				logger.debug('Saving user...')
-				saver.save_user(body)
-			else:
-				logger.debug('Saving snapshot....')
-				saver.save(body['name'], body['save'])
-			channel.basic_ack(delivery_tag=method.delivery_tag)
+			buffer.add(channel, method.delivery_tag, body, method.redelivered)
 
-		logger.info('New Saver is assigned')
+		def setup(channel):
+			buffer.reset(channel)  # Un-acked messages of a previous channel are re-delivered anyway
+			channel.queue_declare(queue='saver', durable=True)
+			channel.basic_qos(prefetch_count=buffer.batch_size)
+			channel.basic_consume(queue='saver', on_message_callback=callback, auto_ack=False)
 
-		self.channel.queue_declare(queue='saver', durable=True)
-		self.channel.basic_consume(queue='saver', on_message_callback=callback, auto_ack=False)
+		logger.info('New Saver is assigned')
+		self.add_consumer(setup)
 		if start_consuming:
 			self.consume()
 
+	def ack_when_confirmed(self, channel, delivery_tag, *confirmations):
+		"""
+		Acks a consumed message once the messages published for it are durable, without blocking the consumer.
+		:param confirmations: Futures of the published messages, None for messages which were already sent.
+		"""
+		pending = [confirmation for confirmation in confirmations if confirmation is not None]
+		if not pending:
+			channel.basic_ack(delivery_tag=delivery_tag)
+			return
+		lock = threading.Lock()
+		remaining = len(pending)
+
+		def on_confirmed(_):
+			nonlocal remaining
+			with lock:
+				remaining -= 1
+				if remaining > 0:
+					return
+			errors = [confirmation.exception() for confirmation in pending if confirmation.exception() is not None]
+			if errors:
+				logger.error(f'Publishing failed, returning the message to the queue - {errors[0]}')
+				callback = functools.partial(channel.basic_nack, delivery_tag=delivery_tag, requeue=True)
+			else:
+				callback = functools.partial(channel.basic_ack, delivery_tag=delivery_tag)
+			if channel.is_open:  # Otherwise the message is re-delivered anyway
+				channel.connection.add_callback_threadsafe(callback)
+
+		for confirmation in pending:
+			confirmation.add_done_callback(on_confirmed)
+
+	def add_consumer(self, setup):
+		"""
+		Registers a consumer on the consuming channel.
+		:param setup: Function which receives a channel, and declares and consumes on it.
+		"""
+		self.consumers.append(setup)
+		setup(self.channel)
+
 	def consume(self):
 		logger.info('Starts consuming...')
-		try:
-			self.channel.start_consuming()
-		except KeyboardInterrupt:
-			pass
+		while True:
+			try:
+				self.channel.start_consuming()
+				return
+			except KeyboardInterrupt:
+				return
+			except RECOVERABLE_ERRORS as e:
+				logger.warning(f'Lost connection to the message queue while consuming - {e}')
+				self.reconnect_consumer()
+
+	def reconnect_consumer(self):
+		"""
+		Replaces the consuming connection and replays every registered consumer on it.
+		Un-acked messages of the old connection are re-delivered by the broker.
+		"""
+		for attempt in range(self.MAX_TRIES):
+			time.sleep(attempt * self.RECONNECT_DELAY)
+			try:
+				self.connection = pika.BlockingConnection(self.parameters)
+				self.channel = self.connection.channel()
+				for setup in self.consumers:
+					setup(self.channel)
+			except RECOVERABLE_ERRORS as e:
+				logger.warning(f'Reconnecting failed - {e}')
+				continue
+			self.consumer_reconnects += 1
+			logger.info('Reconnected to the message queue')
+			return
+		raise ConnectionError("The message queue isn\'t reachable")
 
 	def close(self):
-		self.connection.close()
+		if self.batcher is not None:
+			self.batcher.close()
+		self.pool.close()
+		if self.connection is not None and self.connection.is_open:
+			self.connection.close()
 
 	def __str__(self):
 		return f'{self.scheme}://{self.host}:{self.port}'
@@ -6,7 +6,6 @@ and it's have been frustrating to handle some of the concepts here.
 import datetime as dt
 import functools
 import io
-import itertools
 import logging
 import os
 import pathlib
@@ -18,7 +17,7 @@ from flask import Flask, jsonify, request, redirect, render_template, send_file
 from flask_cors import CORS
 import timeago
 
-from .utils import log_error, HTTP_HEADERS
+from .utils import log_error, HTTP_HEADERS, prefork
 from .Database import Database
 from . import IOAccess
 from .defaults import API_DEFAULT_PORT, API_DEFAULT_HOST
@@ -28,6 +27,8 @@ CORS(app)
 logger = logging.getLogger('API')
 
 MAX_POSTS = 30
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
 database_handler = None
 cur_dir = str(pathlib.Path(__file__).parent)
 
@@ -56,17 +57,26 @@ def cli():
 @cli.command(name='run-api-server')
 @click.option('-h', '--host', 'host', default=API_DEFAULT_HOST)
 @click.option('-p', '--port', 'port', default=API_DEFAULT_PORT, type=int)
+@click.option('--workers', type=int, default=None, help=
+'Serve with this amount of pre-forked worker processes, instead of the development server')
+@click.option('--threads', type=int, default=1, help='With --workers, the amount of threads in every worker')
 @click.argument('database')
-def cli_run_api_server(host, port, database):
+def cli_run_api_server(host, port, database, workers=None, threads=1):
 	"""
 	Runs the server to access the DATABASE
 	"""
-	global database_handler
 	logging.getLogger('werkzeug').disabled = True  # Don't want the weird Flask logger
 
-	logger.debug(f'Connecting to DB {database}')
-	database_handler = Database(database)
+	def connect():  # In every worker, the DB client doesn't survive a fork
+		global database_handler
+		logger.debug(f'Connecting to DB {database}')
+		database_handler = Database(database)
+
 	logger.info(f'Start listening on {host}:{port}')
+	if workers is not None:
+		prefork.serve(app, host, port, workers, threads, initializer=connect)
+		return
+	connect()
 	app.run(host=host, port=port)
 
 
@@ -97,15 +107,41 @@ def handle_db_fail(log):
 	return decorator
 
 
-def bound_amount(l, bound=MAX_POSTS):
-	counter = 0
-	if 'counter' in request.args:
-		counter = int(request.args['counter'])
+def page_args(default_limit=MAX_POSTS):
+	"""
+	The paging arguments of the request - limit (Bounded by MAX_PAGE_SIZE) and the after/before cursors.
+	:param default_limit: The limit if none was given, None for no limit.
+	:raise ValueError: If the limit isn't a positive integer, or a cursor is malformed.
+	"""
+	limit = positive_arg('limit', default_limit)
+	if limit is not None:
+		limit = min(limit, MAX_PAGE_SIZE)
 
-	if counter + bound < len(l):
-		return l[counter: counter + bound]
-	else:
-		return l[counter:]
+	args = {'limit': limit, 'after': request.args.get('after'), 'before': request.args.get('before')}
+	for name in ('after', 'before'):
+		if args[name] is not None:
+			try:
+				database_handler.parse_cursor(args[name])
+			except ValueError:
+				raise ValueError(f'Malformed {name} cursor')
+	return args
+
+
+def positive_arg(name, default=None):
+	"""
+	A request argument which must be a positive integer.
+	:raise ValueError: If it isn't.
+	"""
+	value = request.args.get(name)
+	if value is None:
+		return default
+	try:
+		value = int(value)
+	except ValueError:
+		raise ValueError(f'The {name} must be an integer')
+	if value < 1:
+		raise ValueError(f'The {name} must be positive')
+	return value
 
 
 def db_not_found(user, snapshot=1, result=1):
@@ -150,17 +186,21 @@ def get_user(user_id):
 @app.route('/users/<user_id>/snapshots')
 @handle_db_fail(logger)
 def get_snapshots(user_id):
+	"""
+	A page of the user's snapshots (See page_args), ordered by time. Without a limit, all of them.
+	If there are more, the cursor of the next page is given in the X-Next-Cursor header.
+	"""
 	logger.debug(f'Snapshot list user with {user_id=} ')
-	snapshots = database_handler.get_snapshots(user_id)
-
-	def extract_basic_info(snapshot):
-		return {
-			'timestamp': snapshot['timestamp'],
-			'user_id': snapshot['user_id'],
-			'snapshot_id': snapshot['snapshot_id']
-		}
-
-	return db_not_found(snapshots) or jsonify(list(map(extract_basic_info, snapshots)))
+	try:
+		args = page_args(default_limit=None)
+	except ValueError as e:
+		return str(e), 400
+	snapshots, more = database_handler.get_snapshots_page(user_id, **args,
+	                                                      fields=['timestamp', 'user_id', 'snapshot_id'])
+	headers = {}
+	if snapshots and (more or args['before'] is not None):
+		headers[NEXT_CURSOR_HEADER] = database_handler.snapshot_cursor(snapshots[-1])
+	return jsonify(snapshots), 200, headers
 
 
 @app.route('/users/<user_id>/snapshots/<snapshot_id>')
@@ -241,19 +281,23 @@ def user_page():
 	user_id = request.args['user_id']
 	user = database_handler.get_user(user_id)
 
-	snapshots = database_handler.get_snapshots(user_id)
-
-	response = db_not_found(snapshots)
-
+	response = db_not_found(user)
 	if response is not None:
 		return response
-	amount = database_handler.get_snapshots_amount(user_id)
-	page = 1
-
-	if 'page' in request.args:
-		page = int(request.args['page'])
 
-	snapshots = itertools.islice(snapshots, (page - 1) * MAX_POSTS, page * MAX_POSTS)
+	try:
+		args = page_args()
+		page = positive_arg('page', 1)
+	except ValueError as e:
+		return str(e), 400
+	snapshots, more = database_handler.get_snapshots_page(user_id, **args,
+	                                                      fields=['timestamp', 'snapshot_id', 'result'])
+	backwards = args['before'] is not None
+	previous_cursor = next_cursor = None
+	if snapshots and (args['after'] is not None or (backwards and more)):
+		previous_cursor = database_handler.snapshot_cursor(snapshots[0])
+	if snapshots and (more or backwards):
+		next_cursor = database_handler.snapshot_cursor(snapshots[-1])
 
 	def format_snapshot(snapshot):
 		epoch_time = int(snapshot['timestamp']) / 1000
@@ -271,7 +315,7 @@ def user_page():
 	                       username=user['username'],
 	                       user_id=user['user_id'],
 	                       snapshots=result_snapshots,
-	                       page=page, next_page=page * MAX_POSTS < amount)
+	                       page=page, previous_cursor=previous_cursor, next_cursor=next_cursor)
 
 
 @app.route('/snapshot')
@@ -9,6 +9,8 @@ from .defaults import API_DEFAULT_HOST, API_DEFAULT_PORT
 
 logger = logging.getLogger('CLI')
 driver_kwargs = {'mode': 'r'}
+PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
 
 
 @click.group()
@@ -62,7 +64,13 @@ def get_snapshots(ctx, user_id):
 	"""Getting all the snapshots of user with USER-ID"""
 	logger.info('Getting snapshots...')
 	logger.debug(f'{user_id=}')
-	return IOAccess.read_url(f'{ctx.obj["url_base"]}/users/{user_id}/snapshots', 'json', driver_kwargs=driver_kwargs)
+	url = f'{ctx.obj["url_base"]}/users/{user_id}/snapshots?limit={PAGE_SIZE}'
+	snapshots, cursor = [], ''
+	while cursor is not None:  # Follow the pages
+		with IOAccess.open(url + (cursor and f'&after={cursor}'), **driver_kwargs) as fd:
+			snapshots.extend(IOAccess.read(fd, 'json'))
+			cursor = fd.response.headers.get(NEXT_CURSOR_HEADER)
+	return snapshots
 
 
 @cli.command()
@@ -1,16 +1,25 @@
 import itertools
 import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import click
 
 from .defaults import SERVER_DEFAULT_HOST, SERVER_DEFAULT_PORT
-from .IOAccess import object_readers, read_url, DRIVERS
-from .protocol import Connection
+from .IOAccess import object_readers, read_url, build_index, load_index, DRIVERS
+from .IOAccess.Drivers import configure_session
+from .protocol import Connection, encoding
 from .utils import log_error
 
 logger = logging.getLogger('client')
+PROGRESS_INTERVAL = 1  # Seconds between progress reports of the worker processes
+progress_queue = None  # Where a worker process reports it's progress
 available_schemes = list(DRIVERS.keys())
 available_schemes.remove('object')
+available_schemes.remove('segment')
 
 
 @click.group()
@@ -30,50 +39,212 @@ def cli(no_logging):
 'Choose scheme to read the object from, defaulted to read from the FS.')
 @click.option('-n', 'amount', type=int, default=-1, help=
 'If mentioned, bounds the number of sent snapshots')
-def upload_sample_cli(path, host, port, *, sample_format=None, scheme=None, amount=-1):
+@click.option('--since', type=int, default=None, help=
+'If mentioned, skips the snapshots taken before this datetime (Seeks to it, if the sample is indexed)')
+@click.option('-c', '--concurrency', type=int, default=1, help=
+'Amount of snapshots uploaded at the same time')
+@click.option('--compression', type=click.Choice(['gzip', 'deflate']), default=None, help=
+'Compress the uploads, if the server supports it')
+@click.option('--compression-level', type=click.IntRange(1, 9), default=encoding.DEFAULT_LEVEL)
+@click.option('--processes', type=int, default=1, help=
+'Split the sample between this amount of processes, each uploads it\'s part (Builds the sample\'s index if needed)')
+def upload_sample_cli(path, host, port, *, sample_format=None, scheme=None, amount=-1, since=None, concurrency=1,
+                      compression=None, compression_level=encoding.DEFAULT_LEVEL, processes=1):
 	"""
 	Reads the sample from PATH and uploads it to the server listening on HOST:PORT.
 	"""
 
+	def connect(user):
+		return Connection(f'http://{host}:{port}', user, compression, compression_level)
+
+	if concurrency > 1:
+		configure_session(pool_size=concurrency)  # Keep a connection alive for every upload in flight
+	if processes > 1:
+		return publish_in_processes(path, connect, processes, sample_format=sample_format, scheme=scheme,
+		                            amount=amount, since=since, concurrency=concurrency, raw=True)
+
 	def publish_user(user):
-		conn = Connection(f'http://{host}:{port}', user)
-		return conn.upload
+		return connect(user).publisher()
 
-	publish_sample(path, sample_format=sample_format, scheme=scheme, publish_user=publish_user, amount=amount)
+	publish_sample(path, sample_format=sample_format, scheme=scheme, publish_user=publish_user, amount=amount,
+	               since=since, concurrency=concurrency, raw=True)
 
 
 upload_sample = upload_sample_cli.callback
 
 
+@cli.command(name='build-index')
+@click.argument('path')
+@click.option('--scheme', type=click.Choice(available_schemes), multiple=False, default=None, help=
+'Choose scheme to read the sample from, defaulted to read from the FS.')
+@log_error(logger)
+def build_index_cli(path, scheme=None):
+	"""
+	Indexes the snapshots of the sample in PATH, so uploads can seek in it.
+	"""
+	index = build_index(path, scheme)
+	print(f'Indexed {len(index)} snapshots')
+
+
 @log_error(logger)
-def publish_sample(path, publish_user, *, sample_format=None, scheme=None, amount=-1):
+def publish_sample(path, publish_user, *, sample_format=None, scheme=None, amount=-1, since=None, start=0,
+                   concurrency=1, on_published=None, raw=False):
 	"""
 	:param path: Where the sample is.
 	:param publish_user: handles the publishing, the publisher would return a snapshot publisher to publish snapshots.
+	If the snapshot publisher has a batch_size attribute, it's given lists of snapshots.
 	:param sample_format: The format of the file which stores the sample (default=protobuf).
 	:param scheme: Optional - The caller can request to fetch the file from place other than the FS.
 	:param amount: If positive, bounds the amount of snapshots that would be uploaded.
+	:param since: Optional - Skip the snapshots taken before this datetime.
+	:param start: Position of the first snapshot to upload.
+	:param concurrency: If bigger than 1, up to this amount of snapshots are published at the same time,
+	while the next ones are being read. A failed snapshot doesn't stop the others.
+	:param on_published: Optional - Called with the amount of snapshots after every successful publish.
+	:param raw: If set, the snapshots are published serialized as they are in the sample, without decoding them.
+	:return: When publishing concurrently, list of (index, error) of the snapshots (Or batches) which failed.
 	"""
 
 	logger.info('Reading sample')
 	logger.debug(f'Reading from {str(path)} by scheme {scheme}')
-	user, snapshots = read_url(path, 'sample', version=sample_format, scheme=scheme)
-
-	if amount > 0:
-		snapshots = itertools.islice(snapshots, amount)
-		logger.debug(f'Bounding amount of snpashots by {amount}')
+	index = load_index(path) if isinstance(path, str) else None
+	if index is not None:
+		logger.info(f'The sample is indexed, holds {len(index)} snapshots')
+	stop = start + amount if amount > 0 else None
+	user, snapshots = read_url(path, 'sample', version=sample_format, scheme=scheme, index=index, start=start,
+	                           stop=stop, since=since, raw=raw)
 
 	logging.info('Publishing user')
 	publish_snapshot = publish_user(user)  # publishing function
 
+	batch_size = getattr(publish_snapshot, 'batch_size', None)
+	if batch_size is not None:
+		logger.debug(f'Uploading in batches of {batch_size}')
+		snapshots = batches(snapshots, batch_size)
+	if on_published is not None:
+		publish_snapshot = reporting(publish_snapshot, on_published, batch_size is not None)
+
 	logger.info('Starting to upload snapshots...')
+	if concurrency > 1:
+		return publish_concurrently(publish_snapshot, snapshots, concurrency, batch_size is not None)
+
 	counter = 0
 	for snapshot in snapshots:
-		counter += 1
 		publish_snapshot(snapshot)
+		counter += len(snapshot) if batch_size is not None else 1
 
 	logger.info(f'Total of {counter} snapshots had been uploaded')
 
 
+def publish_in_processes(path, connect, processes, *, sample_format=None, scheme=None, amount=-1, since=None,
+                         concurrency=1, raw=False):
+	"""
+	Splits the sample to contiguous ranges by it's index, and uploads each one from a separate process.
+	The user is registered once, and the processes upload with a copy of it's connection.
+	:param connect: Registers the user, returns the Connection.
+	:return: List of (range, error) of the ranges which failed, or their failed snapshots when uploading concurrently.
+	"""
+	index = load_index(path) or build_index(path, scheme)
+	start, stop = index.positions(stop=amount if amount > 0 else None, since=since)
+	ranges = index.split(processes, start, stop)
+	if not ranges:
+		logger.info('No snapshots to upload')
+		return []
+	user, _ = read_url(path, 'sample', version=sample_format, scheme=scheme, index=index, stop=0)
+	connection = connect(user)
+	logger.info(f'Uploading {stop - start} snapshots from {len(ranges)} processes')
+
+	progress = multiprocessing.Queue()
+	failures = []
+	with ProcessPoolExecutor(len(ranges), initializer=init_worker, initargs=(progress,)) as executor:
+		futures = {executor.submit(publish_range, path, connection, part_start, part_stop, sample_format=sample_format,
+		                           scheme=scheme, concurrency=concurrency, raw=raw): (part_start, part_stop)
+		           for part_start, part_stop in ranges}
+		uploaded, reported = 0, time.monotonic()
+		while not all(future.done() for future in futures) or not progress.empty():
+			try:
+				uploaded += progress.get(timeout=PROGRESS_INTERVAL)
+			except queue.Empty:
+				pass
+			if time.monotonic() - reported >= PROGRESS_INTERVAL:
+				logger.info(f'Uploaded {uploaded}/{stop - start} snapshots')
+				reported = time.monotonic()
+
+		for future, part in futures.items():
+			error = future.exception() or future.result()  # Crashed, or the failures of concurrent uploading
+			if error:
+				logger.error(f'Snapshots {part[0]}-{part[1]} failed - {error}')
+				failures.append((part, error))
+
+	logger.info(f'Total of {uploaded} snapshots had been uploaded')
+	return failures
+
+
+def init_worker(progress):
+	global progress_queue
+	progress_queue = progress
+
+
+def publish_range(path, connection, start, stop, **kwargs):
+	"""
+	Uploads the snapshots in positions [start, stop) of the sample, from a worker process.
+	"""
+	return publish_sample(path, lambda user: connection.publisher(), start=start, amount=stop - start,
+	                      on_published=progress_queue.put, **kwargs)
+
+
+def reporting(publish_snapshot, on_published, batched):
+	"""
+	Wraps the publisher to report the amount of published snapshots.
+	"""
+
+	def publish(snapshot):
+		result = publish_snapshot(snapshot)
+		on_published(len(snapshot) if batched else 1)
+		return result
+
+	return publish
+
+
+def batches(iterable, size):
+	"""
+	Splits the iterable into lists of (up to) size items.
+	"""
+	iterator = iter(iterable)
+	while batch := list(itertools.islice(iterator, size)):
+		yield batch
+
+
+def publish_concurrently(publish_snapshot, snapshots, concurrency, batched=False):
+	"""
+	Publishes the snapshots with a bounded window of concurrency publishes in flight.
+	:param batched: If set, the snapshots are given in batches (Lists), which are published as a whole.
+	:return: List of (index, error) of the snapshots (Or batches) which failed.
+	"""
+	window = threading.BoundedSemaphore(concurrency)
+	failures = []
+	failed = []  # The amount of snapshots of every failure
+
+	def publish(index, snapshot):
+		try:
+			publish_snapshot(snapshot)
+		except Exception as e:
+			logger.error(f'Snapshot {index} failed - {e}')
+			failures.append((index, e))
+			failed.append(len(snapshot) if batched else 1)
+		finally:
+			window.release()
+
+	counter = 0
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+		for index, snapshot in enumerate(snapshots):
+			window.acquire()  # Don't read ahead more than the window
+			executor.submit(publish, index, snapshot)
+			counter += len(snapshot) if batched else 1
+
+	logger.info(f'Total of {counter - sum(failed)} snapshots had been uploaded, {sum(failed)} failed')
+	return sorted(failures, key=lambda failure: failure[0])
+
+
 if __name__ == '__main__':
 	cli()
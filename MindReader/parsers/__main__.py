@@ -19,7 +19,13 @@ def cli():
 @cli.command(name='run-parser')
 @click.argument('mq-url')
 @click.option('-n', '--name', 'parsers', multiple=True)
-def run_parser(mq_url, parsers):
+@click.option('--confirm-batch', type=int, default=None, help=
+'If given, results are published durably, committed to the message queue in batches of this size')
+@click.option('--combined', is_flag=True, help=
+'Consume one queue for all the parsers, decoding every snapshot once')
+@click.option('-w', '--workers', type=int, default=None, help=
+'Run the parsers in a pool of this many processes')
+def run_parser(mq_url, parsers, confirm_batch, combined, workers):
 	f"""
 	Run a parser for names (from {available}), to work with message queue at MQ-URL.
 	If no NAME was mentioned all of them will be used (As one instance).
@@ -28,7 +34,7 @@ def run_parser(mq_url, parsers):
 
 	if len(parsers) == 0:
 		parsers = available
-	run_parsers(mq_url, parsers)
+	run_parsers(mq_url, parsers, mq_kwargs={'confirm_batch': confirm_batch}, combined=combined, workers=workers)
 
 
 @cli.command(name='parse')
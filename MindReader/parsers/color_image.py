@@ -1,23 +1,44 @@
 import mimetypes
+import os
+import time
 
 from PIL import Image
 
-FORMAT = 'jpeg'
+# Encoder settings, configurable per deployment through the environment
+FORMAT = os.environ.get('COLOR_IMAGE_FORMAT', 'jpeg')  # i.e. jpeg, webp, png
+QUALITY = int(os.environ.get('COLOR_IMAGE_QUALITY', 75))  # jpeg/webp only
+PROGRESSIVE = os.environ.get('COLOR_IMAGE_PROGRESSIVE', '0') == '1'  # jpeg only
+
+
+def encoder_options(image_format):
+	"""
+	The PIL save options for the format.
+	"""
+	if image_format == 'jpeg':
+		return {'quality': QUALITY, 'progressive': PROGRESSIVE}
+	if image_format == 'webp':
+		return {'quality': QUALITY}
+	return {}
 
 
 def color_image_parser(output, color_image):
 	"""
-	Parse the image to BMP image.
+	Parse the image to an encoded image (FORMAT).
 	The image bytes are stored in different file which is file is given.
 	"""
 	shape = color_image.width, color_image.height
-	image = Image.new('RGB', shape)
-	image.frombytes(color_image.data)
-	image.save(output, format=FORMAT)
+	image = Image.frombytes('RGB', shape, color_image.data)  # A single copy, Pillow can't map RGB buffers
+
+	start, start_position = time.perf_counter(), output.tell()
+	image.save(output, format=FORMAT, **encoder_options(FORMAT))
+	encode_time = time.perf_counter() - start
+
 	return {
-		'Content-Type': mimetypes.types_map[f'.{FORMAT}'],
+		'Content-Type': mimetypes.types_map.get(f'.{FORMAT}', f'image/{FORMAT}'),
 		'height': color_image.height,
-		'width': color_image.width}
+		'width': color_image.width,
+		'encode_time': encode_time,
+		'encoded_size': output.tell() - start_position}
 
 
 color_image_parser.name = 'color_image'
@@ -1,19 +1,66 @@
 import mimetypes
 
+from google.protobuf.internal import api_implementation
 import numpy as np
-import matplotlib.pyplot as plt
+from PIL import Image
 
-FORMAT = 'jpg'
+from ..utils.protobuf import packed_field
+
+FORMAT = 'jpeg'
+# Serializing is a native memory copy only in the C implementations, in pure python it's slower than iterating
+VIEW_WIRE_FORMAT = api_implementation.Type() != 'python'
+
+# Matplotlib's 'hot' colormap - (position, intensity) for each channel
+HOT = {
+	'red': ((0.0, 0.0416), (0.365079, 1.0), (1.0, 1.0)),
+	'green': ((0.0, 0.0), (0.365079, 0.0), (0.746032, 1.0), (1.0, 1.0)),
+	'blue': ((0.0, 0.0), (0.746032, 0.0), (1.0, 1.0)),
+}
+LUT_SIZE = 256
+
+
+def lookup_table(colormap, size=LUT_SIZE):
+	"""
+	Samples a linear segmented colormap to a table of RGB bytes (Just like matplotlib's).
+	"""
+	positions = np.linspace(0, 1, size)
+	channels = [np.interp(positions, *zip(*colormap[color])) for color in ('red', 'green', 'blue')]
+	return (np.stack(channels, axis=1) * 255).astype(np.uint8)
+
+
+HOT_LUT = lookup_table(HOT)
+
+
+def heatmap(values, lut=HOT_LUT):
+	"""
+	Colors the values by the lookup table, after normalizing them between their min and max.
+	:return: Array of RGB bytes in the shape of values.
+	"""
+	low, high = values.min(), values.max()
+	scale = len(lut) / (high - low) if high > low else 0
+	indices = ((values - low) * scale).astype(np.intp)
+	np.minimum(indices, len(lut) - 1, out=indices)
+	return lut[indices]
+
+
+def depth_values(depth_image):
+	"""
+	Depth image data as float array, viewed straight over the wire format when possible.
+	"""
+	raw = packed_field(depth_image, 'data') if VIEW_WIRE_FORMAT else None
+	if raw is None:
+		return np.fromiter(depth_image.data, dtype=np.float32, count=len(depth_image.data))
+	return np.frombuffer(raw, dtype='<f4')
 
 
 def depth_image_parser(output, depth_image):
 	"""
-	Parse the image to matplotlib heatmap.
+	Parse the image to heatmap (In matplotlib's 'hot' colors).
 	"""
 
 	height, width = depth_image.height, depth_image.width
-	heat_map_values = np.array(depth_image.data).reshape(height, width)
-	plt.imsave(output, heat_map_values, cmap='hot', format=FORMAT)
+	heat_map_values = depth_values(depth_image).reshape(height, width)
+	Image.fromarray(heatmap(heat_map_values)).save(output, format=FORMAT)
 	return {
 		'Content-Type': mimetypes.types_map[f'.{FORMAT}'],
 		'height': depth_image.height,
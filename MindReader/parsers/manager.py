@@ -1,16 +1,20 @@
 import importlib
 import inspect
+import io
 import logging
-
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from .. import IOAccess, MessageQueue
+from ..IOAccess.field_manifest import load_manifest, read_fields
 from ..utils import log_error
 
 logger = logging.getLogger('parsers')
 
 INTERNAL_FILES = {'__init__.py', 'manager.py', '__main__.py'}
 PARSERS = {}
+KEY_FIELDS = ['datetime']  # Read for every parser, the results are stamped with it
 
 
 def _collect_parsers():
@@ -55,28 +59,92 @@ def parser(name=None):
 	return decorator
 
 
+def snapshot_fields(result_names=None):
+	"""
+	The snapshot fields the parsers use.
+	:param result_names: Optional - Names of the parsers, by default all of them.
+	:return: Sorted list of the fields.
+	"""
+	result_names = PARSERS.keys() if result_names is None else result_names
+	fields = {field for result_name in result_names for field in PARSERS[result_name].fields}
+	fields.discard('output')
+	return sorted(fields)
+
+
 @log_error(logger)
 def parse(snapshot_path, result_name):
 	"""Parses a message"""
-	snapshot_path = Path(snapshot_path)
-	version = snapshot_path.suffix[1:]
+	if result_name not in PARSERS:
+		logger.error(f'Bad result name: no such parser - {result_name}')
+		return
+	snapshot = read_snapshot(snapshot_path, snapshot_fields([result_name]))
+	if snapshot is None:
+		return
+	return apply_parser(snapshot, snapshot_path, result_name)
+
+
+@log_error(logger)
+def parse_many(snapshot_path, result_names):
+	"""
+	Parses a message with every one of the given parsers, decoding the snapshot only once.
+	:return: Dict of result name: parsed result. Parsers which had nothing to publish are omitted.
+	"""
+	unknown = [result_name for result_name in result_names if result_name not in PARSERS]
+	if unknown:
+		logger.error(f'Bad result names: no such parsers - {unknown}')
+		return
+	start = time.perf_counter()
+	snapshot = read_snapshot(snapshot_path, snapshot_fields(result_names))
+	if snapshot is None:
+		return
+	logger.info(f'Snapshot read in {time.perf_counter() - start:.4f}s')
+
+	results = {}
+	for result_name in result_names:
+		start = time.perf_counter()
+		result = log_error(logger)(apply_parser)(snapshot, snapshot_path, result_name)
+		logger.info(f'Parser {result_name} finished in {time.perf_counter() - start:.4f}s')
+		if result is not None:
+			results[result_name] = result
+	return results
 
+
+def read_snapshot(snapshot_path, fields=None):
+	"""
+	Reads the snapshot from the path (Or segment locator), the path suffix represents the snapshot encoding.
+	The snapshot is lazy, only the fields the parsers ask for are decoded.
+	:param fields: Optional - The fields which are used. If the snapshot has a field manifest, only they are read.
+	:return: The snapshot, or None if the encoding isn't supported.
+	"""
+	version = Path(str(snapshot_path).split('#', 1)[0]).suffix[1:]
 	if version not in IOAccess.object_readers('snapshot'):
 		logger.error(f'The snapshot encoding {version} is not supported')
 		return
-	if result_name not in PARSERS:
-		logger.error(f'Bad result name: no such parser - {result_name}')
-		return
+	logger.debug(f'The requested snapshot is at: {snapshot_path}')
 
+	manifest = load_manifest(snapshot_path) if fields is not None else None
+	if manifest is not None:
+		with io.BytesIO(read_fields(snapshot_path, KEY_FIELDS + list(fields), manifest)) as fd:
+			return IOAccess.read(fd, 'snapshot', version=version, lazy=True)
+
+	with IOAccess.open(str(snapshot_path), mode='rb') as fd:
+		return IOAccess.read(fd, 'snapshot', version=version, lazy=True)
+
+
+def apply_parser(snapshot, snapshot_path, result_name):
+	"""
+	Runs a single parser on an already decoded snapshot.
+	:param snapshot_path: Where the snapshot was read from, binary outputs are saved next to it.
+	(For segments in the user's directory, named by the snapshot id)
+	"""
 	selected_parser = PARSERS[result_name]
 	fields = selected_parser.fields
 	logger.info(f'Parser {result_name} got new work')
-	logger.debug(f'The requested snapshot is at: {snapshot_path}')
-
-	with IOAccess.open(str(snapshot_path), mode='rb') as fd:
-		snapshot = IOAccess.read(fd, 'snapshot', version=version)
 
-	output_path = str(snapshot_path.parent / f'{result_name}.binary')
+	output_name = f'{result_name}.binary'
+	if IOAccess.segment_store.is_locator(snapshot_path):
+		output_name = f'{IOAccess.snapshot_identity(snapshot_path)[1]}.{output_name}'
+	output_path = str(IOAccess.snapshot_directory(snapshot_path) / output_name)
 
 	try:
 		args = {field: getattr(snapshot, field) for field in fields if field != 'output'}
@@ -106,16 +174,31 @@ def parse(snapshot_path, result_name):
 
 
 @log_error(logger)
-def run_parsers(mq, parsers, is_url=True, start_consuming=True):
+def run_parsers(mq, parsers, is_url=True, start_consuming=True, mq_kwargs=None, combined=False, workers=None):
 	"""
 	Runs the parsers to the mq.
 	If is_url is False then mq is assumed to be MessageQueue object.
+	:param mq_kwargs: Optional - Options for the MessageQueue created from the url.
+	:param combined: If set, the parsers share one queue, and each snapshot is decoded once for all of them.
+	:param workers: If given, the parsing is done by a pool of this many processes.
 	"""
 	if is_url:
-		mq = MessageQueue.MessageQueue(mq)
+		mq = MessageQueue.MessageQueue(mq, **(mq_kwargs or {}))
+
+	executor = None
+	if workers is not None:
+		logger.info(f'Parsing with {workers} worker processes')
+		executor = ProcessPoolExecutor(max_workers=workers)
+	consumer_kwargs = {'start_consuming': False, 'executor': executor, 'prefetch': workers}
 
-	for name in parsers:
-		mq.run_parser(name, parse, start_consuming=False)
+	if combined:
+		parsers = sorted(parsers)
+		mq.run_combined_parser(f'parsers:{",".join(parsers)}', parse_many, parsers, **consumer_kwargs)
+	else:
+		for name in parsers:
+			mq.run_parser(name, parse, **consumer_kwargs)
 
 	if start_consuming:
 		mq.consume()
+		if executor is not None:
+			executor.shutdown()
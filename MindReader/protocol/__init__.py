@@ -1,2 +1,4 @@
 from .connection import Connection
 from .listener import Listener
+from .async_listener import AsyncListener
+from . import encoding
@@ -0,0 +1,222 @@
+"""
+Asyncio listener, which implements the upload protocol of listener (/register, /snapshot and /fields).
+A connection costs a coroutine instead of a thread, so a single process holds thousands of uploading clients.
+The event loop only moves bytes: decoding and writing the snapshots run in a thread pool, and the publishing
+is awaited as a future (Batched confirmations), so it never blocks the other connections.
+Every connection buffers at most the headers and one body, both bounded.
+"""
+import asyncio
+import concurrent.futures
+import http
+import json
+import logging
+import zlib
+
+from ..IOAccess import READERS_MIME_TYPE
+from ..utils.protobuf import MalformedMessage
+from . import encoding, listener
+
+logger = logging.getLogger('async_listener')
+
+MAX_HEADER_SIZE = 64 * 1024
+MAX_BODY_SIZE = encoding.MAX_BODY_SIZE
+KEEP_ALIVE_TIMEOUT = 30  # Seconds an idle connection is kept
+BODY_TIMEOUT = 60  # Seconds a client has to send the body, once it's headers arrived
+DEFAULT_THREADS = 8
+
+
+class HTTPError(Exception):
+	def __init__(self, status, message):
+		super().__init__(message)
+		self.status = status
+
+
+class AsyncListener:
+	def __init__(self, handle_user=None, store_snapshot=None, publish_snapshot=None, threads=DEFAULT_THREADS,
+	             max_body=MAX_BODY_SIZE):
+		"""
+		:param handle_user: Called with every registered user, like in listener. Runs in the thread pool.
+		:param store_snapshot: Called with (user_id, snapshot) in the thread pool, returns where it was stored.
+		:param publish_snapshot: Called with where the snapshot was stored, may return a future of the confirmation.
+		:param threads: Size of the thread pool.
+		:param max_body: Bodies bigger than this (bytes) are rejected, before and after decoding.
+		"""
+		self.handle_user = handle_user or (lambda user: None)
+		self.store_snapshot = store_snapshot or (lambda user_id, snapshot: None)
+		self.publish_snapshot = publish_snapshot or (lambda stored: None)
+		self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+		self.max_body = max_body
+		self.routes = {('GET', '/fields'): self.server_config,
+		               ('POST', '/register'): self.register,
+		               ('POST', '/snapshot'): self.upload_snapshot}
+
+	def run(self, host, port):
+		"""
+		Serves on host:port until SIGINT.
+		"""
+		try:
+			asyncio.run(self.serve_forever(host, port))
+		except KeyboardInterrupt:
+			logger.info('SIGINT sent exiting...')
+		finally:
+			self.executor.shutdown()
+
+	async def serve_forever(self, host, port):
+		server = await self.start(host, port)
+		async with server:
+			await server.serve_forever()
+
+	async def start(self, host, port):
+		"""
+		:return: The listening asyncio server.
+		"""
+		server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_SIZE)
+		logger.info(f'Listening on {host}:{port}')
+		return server
+
+	async def handle_connection(self, reader, writer):
+		try:
+			keep_alive = True
+			while keep_alive:
+				try:
+					head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+				except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+					return
+				except asyncio.LimitOverrunError:
+					await self.respond(writer, 431, 'The request headers are too large.', keep_alive=False)
+					return
+
+				try:
+					method, path, version, headers = parse_head(head)
+					keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+					body = await self.read_body(reader, method, headers)
+				except HTTPError as e:
+					await self.respond(writer, e.status, str(e), keep_alive=False)
+					return
+
+				handler = self.routes.get((method, path.split('?', 1)[0]))
+				if handler is None:
+					await self.respond(writer, 404, 'Not found.', keep_alive=keep_alive)
+					continue
+				try:
+					status, answer, extra_headers = await handler(headers, body)
+				except Exception as e:
+					logger.error(f'Failed handling {method} {path} - {e}')
+					status, answer, extra_headers = 500, 'Internal server error.', {}
+				await self.respond(writer, status, answer, extra_headers, keep_alive)
+		except ConnectionError:
+			logger.debug('The client disconnected')
+		finally:
+			writer.close()
+
+	async def read_body(self, reader, method, headers):
+		if 'chunked' in headers.get('transfer-encoding', '').lower():
+			raise HTTPError(411, 'The request body must have a Content-Length.')
+		try:
+			length = int(headers.get('content-length') or 0)
+		except ValueError:
+			raise HTTPError(400, 'Malformed Content-Length.')
+		if length > self.max_body:
+			raise HTTPError(413, f'The body is limited to {self.max_body} bytes.')
+		try:
+			return await asyncio.wait_for(reader.readexactly(length), BODY_TIMEOUT) if length else b''
+		except asyncio.IncompleteReadError:
+			raise HTTPError(400, 'The body is truncated.')
+		except asyncio.TimeoutError:
+			raise HTTPError(408, f'The body wasn\'t sent within {BODY_TIMEOUT} seconds.')
+
+	async def respond(self, writer, status, answer, headers=None, keep_alive=True):
+		if isinstance(answer, str):
+			answer, mimetype = answer.encode(), 'text/plain; charset=utf-8'
+		else:
+			answer, mimetype = json.dumps(answer).encode(), 'application/json'
+		lines = [f'HTTP/1.1 {status} {http.HTTPStatus(status).phrase}', f'Content-Type: {mimetype}',
+		         f'Content-Length: {len(answer)}', f'Connection: {"keep-alive" if keep_alive else "close"}']
+		lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+		writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + answer)
+		await writer.drain()
+
+	async def in_thread(self, function, *args):
+		return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+	###################
+	# ROUTES
+	###################
+	async def server_config(self, headers, body):
+		"""
+		The fields the clients should send, batches aren't accepted (No /snapshots).
+		"""
+		return 200, {'fields': listener.requested_fields, 'max_batch': 1}, {}
+
+	async def register(self, headers, body):
+		mimetype = content_type(headers)
+		logger.debug(f'User received in format {mimetype}')
+		result = await self.in_thread(self.handle_user, {'data': body.decode(), 'type': mimetype})
+		if result is not None:
+			logger.debug('The user is invalid, rejecting registration...')
+			return error_answer(result) + ({},)
+		return 200, listener.requested_fields, {'Accept-Encoding': ', '.join(encoding.DECODERS)}
+
+	async def upload_snapshot(self, headers, body):
+		"""
+		Stores the snapshot in the thread pool, then awaits it's publishing.
+		"""
+		logger.debug(f'New snapshot arrived with length of {len(body)}')
+		if 'userid' not in headers:
+			return 400, 'The request must mention the user\'s id in the UserId header.', {}
+		mimetype = content_type(headers)
+		if mimetype not in READERS_MIME_TYPE['snapshot']:
+			return 400, 'The given type is unsupportable', {}
+
+		key = headers.get(listener.IDEMPOTENCY_HEADER.lower())
+		if key is not None and key in listener.recent_uploads:
+			logger.debug('The snapshot was already stored, ignoring the retry')
+			return 200, 'OK', {}
+
+		try:
+			stored = await self.in_thread(self.decode_and_store, headers, body, mimetype)
+		except encoding.BodyTooLarge as e:
+			logger.debug(f'The snapshot is too large - {e}')
+			return 413, str(e), {}
+		except MalformedMessage as e:
+			logger.debug(f'The snapshot is malformed - {e}')
+			return 400, str(e), {}
+		except ValueError as e:
+			logger.debug(f'Couldn\'t decode the snapshot - {e}')
+			return 415, str(e), {}
+
+		confirmation = await self.in_thread(self.publish_snapshot, stored)
+		if isinstance(confirmation, concurrent.futures.Future):
+			await asyncio.wrap_future(confirmation)
+		if key is not None:
+			listener.remember_upload(key)
+		logger.debug('Snapshot successfully uploaded')
+		return 200, 'OK', {}
+
+	def decode_and_store(self, headers, body, mimetype):
+		try:
+			body = encoding.decode(body, headers.get('content-encoding'), self.max_body)
+		except (OSError, EOFError, zlib.error) as e:  # Corrupted body
+			raise ValueError(f'Couldn\'t decode the body - {e}')
+		return self.store_snapshot(headers['userid'], {'data': body, 'type': mimetype})
+
+
+def parse_head(head):
+	"""
+	:return: The request's method, path, HTTP version and headers (Lower case names).
+	"""
+	try:
+		request_line, *lines = head.decode('latin-1').rstrip('\r\n').split('\r\n')
+		method, path, version = request_line.split(' ')
+		headers = dict(line.split(':', 1) for line in lines)
+	except ValueError:
+		raise HTTPError(400, 'Malformed request.')
+	return method, path, version, {name.strip().lower(): value.strip() for name, value in headers.items()}
+
+
+def content_type(headers):
+	return headers.get('content-type', '').split(';', 1)[0].strip()
+
+
+def error_answer(result):
+	return (result[1], result[0]) if isinstance(result, tuple) else (400, result)
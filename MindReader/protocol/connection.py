@@ -1,6 +1,10 @@
+import io
 import logging
+import time
+import uuid
 
 from .. import IOAccess
+from . import encoding
 
 logger = logging.getLogger('connection')
 
@@ -9,15 +13,30 @@ class Connection:
 	PROTOCOL_SCHEME = 'http'
 	GET_CONFIG = '/fields'
 	UPLOAD_SNAPSHOT = '/snapshot'
+	UPLOAD_SNAPSHOTS = '/snapshots'
 	REGISTER = '/register'
 	# User must contain those fields, can also be configurable if future changes demands it
 	USER_MUST_FIELDS = ['user_id', 'username']
 	MAX_TRIES = 3
+	RETRY_DELAY = 0.5  # Seconds before the second try, doubled before every next one
+	IDEMPOTENCY_HEADER = 'Idempotency-Key'
+	BATCH_SIZE = 16  # Snapshots per /snapshots request, bounded by the server's limit
+	TIMEOUT = (5, 60)  # Seconds to connect, and to wait for the server's answer (A stuck request is retried)
 
-	def __init__(self, domain, user):
+	def __init__(self, domain, user, compression=None, level=encoding.DEFAULT_LEVEL):
+		"""
+		:param domain: The server's address.
+		:param user: User dict, registered upon connection.
+		:param compression: Optional - Content encoding (gzip/deflate) for the uploads, used if the server supports it.
+		:param level: Compression level, 1 (Fastest) to 9 (Smallest).
+		"""
 		self.domain = domain.split('://', 1)[-1]  # Remove http prefix if exist
 		self.url_basis = self.PROTOCOL_SCHEME + '://' + self.domain
 		self.fields = None
+		self.batch_size = None  # Set if the server accepts batches
+		self.compression = compression
+		self.level = level
+		self.encoding = encoding.IDENTITY
 		if any(field not in user for field in self.USER_MUST_FIELDS):
 			logger.error('User had a missing field')
 			raise ValueError('Invalid user')
@@ -25,6 +44,7 @@ class Connection:
 
 		self.register_user(user)
 		self.user = user
+		self.negotiate()
 
 	def register_user(self, user):
 		"""
@@ -36,7 +56,7 @@ class Connection:
 
 		try:
 			response = IOAccess.write_url(self.url_basis + self.REGISTER, 'user', user, version='json',
-			                              driver_kwargs={'mode': 'w', 'headers': headers})
+			                              driver_kwargs={'mode': 'w', 'headers': headers, 'timeout': self.TIMEOUT})
 			if response.status_code != 200:
 				raise ValueError(f'The server returned {response.status_code} - {response.text}')
 		except Exception as e:
@@ -47,21 +67,110 @@ class Connection:
 		logger.info('User registered')
 		logger.debug(f'The accepted fields by the server are {self.fields}')
 
+		accepted = [name.strip() for name in response.headers.get('Accept-Encoding', '').split(',')]
+		if self.compression in accepted:
+			self.encoding = self.compression
+		elif self.compression is not None:
+			logger.warning(f'The server doesn\'t accept {self.compression} bodies, uploading uncompressed')
+
+	def negotiate(self):
+		"""
+		Get the server's configuration, to find out if it accepts batches of snapshots.
+		"""
+		try:
+			with IOAccess.open(self.url_basis + self.GET_CONFIG, mode='r', timeout=self.TIMEOUT) as fd:
+				if fd.status_code != 200:
+					raise ValueError(f'The server returned {fd.status_code}')
+				config = IOAccess.read(fd, 'json')
+		except (OSError, ValueError) as e:
+			logger.info(f'The server doesn\'t publish it\'s configuration, uploading one by one - {e}')
+			return
+
+		if config.get('max_batch', 1) > 1:
+			self.batch_size = min(self.BATCH_SIZE, config['max_batch'])
+		logger.debug(f'The server accepts batches of {self.batch_size} snapshots')
+
+	def publisher(self):
+		"""
+		The snapshot publisher fitting the server. If it accepts batches, the publisher
+		receives lists of snapshots (up to it's batch_size attribute).
+		"""
+		if self.batch_size is None:
+			return self.upload
+
+		def upload_many(snapshots):
+			return self.upload_many(snapshots)
+
+		upload_many.batch_size = self.batch_size
+		return upload_many
+
 	def upload(self, snapshot):
 		"""
 		Uploads a single snapshot using HTTP REST API.
-		:param snapshot: Snapshot object which holds in it's attributes the different fields.
+		Failed attempts are retried (up to MAX_TRIES) with the same idempotency key, so the server stores it once.
+		:param snapshot: Snapshot object which holds in it's attributes the different fields, or a serialized one.
+		Only the fields the server requested are sent, they are picked from the wire format.
 		"""
 		logger.debug('Uploading a snapshot')
 		# Since there is no alternative format for now this is fine, in the future this can be easily converted to
 		# a configurable attribute
-		headers = {'UserId': str(self.user['user_id']), 'Content-Type': 'application/protobuf'}
-		driver_kwargs = {'headers': headers, 'mode': 'wb'}
-		response = IOAccess.write_url(self.url_basis + self.UPLOAD_SNAPSHOT, 'snapshot', snapshot,
-		                              driver_kwargs=driver_kwargs, version='protocol_protobuf', fields=self.fields)
+		self.post(self.UPLOAD_SNAPSHOT, 'snapshot', snapshot, version='protocol_protobuf', fields=self.fields)
+		logger.debug('Snapshot was successfully uploaded')
 
-		if response.status_code == 200:
-			logger.debug('Snapshot was successfully uploaded')
-			return
-		logger.error(f'The server returned {response.status_code} - {response.text}')
+	def upload_many(self, snapshots):
+		"""
+		Uploads a batch of snapshots in a single request, as messages (len | snapshot).
+		Retries are stored once per snapshot, like in upload.
+		:param snapshots: List of snapshots.
+		"""
+		logger.debug(f'Uploading a batch of {len(snapshots)} snapshots')
+		bodies = []
+		for snapshot in snapshots:
+			with io.BytesIO() as fd:
+				IOAccess.write(fd, 'snapshot', snapshot, version='protocol_protobuf', fields=self.fields)
+				bodies.append(fd.getvalue())
+
+		statuses = self.post(self.UPLOAD_SNAPSHOTS, 'messages', bodies).json()
+		failed = [status for status in statuses if status['status'] != 200]
+		if failed:
+			logger.error(f'The server rejected {len(failed)} snapshots - {failed[0]["error"]}')
+			raise ConnectionError(f'Couldn\'t upload {len(failed)} of the snapshots')
+		logger.debug('Batch was successfully uploaded')
+
+	def post(self, uri, name, *args, **kwargs):
+		"""
+		Writes the object to the server, the request is retried (up to MAX_TRIES, backing off) with the same
+		idempotency key.
+		The body is compressed in the negotiated encoding.
+		:return: The server's response.
+		"""
+		headers = {'UserId': str(self.user['user_id']), 'Content-Type': 'application/protobuf',
+		           self.IDEMPOTENCY_HEADER: uuid.uuid4().hex}
+		with io.BytesIO() as fd:
+			IOAccess.write(fd, name, *args, **kwargs)
+			body = fd.getvalue()
+		if self.encoding != encoding.IDENTITY:
+			body = encoding.encode(body, self.encoding, self.level)
+			headers['Content-Encoding'] = self.encoding
+
+		driver_kwargs = {'headers': headers, 'mode': 'wb', 'timeout': self.TIMEOUT}
+		error = None
+		for attempt in range(1, self.MAX_TRIES + 1):
+			if attempt > 1:
+				time.sleep(self.RETRY_DELAY * 2 ** (attempt - 2))
+			try:
+				response = IOAccess.write_url(self.url_basis + uri, 'post', body, driver_kwargs=driver_kwargs)
+			except OSError as e:  # Including the requests errors
+				error = e
+				logger.warning(f'Uploading failed on attempt {attempt} - {e}')
+				continue
+
+			if response.status_code == 200:
+				return response
+			error = f'The server returned {response.status_code} - {response.text}'
+			if response.status_code < 500:
+				break  # The snapshot was rejected, trying again won't help
+			logger.warning(f'Uploading failed on attempt {attempt} - {error}')
+
+		logger.error(error)
 		raise ConnectionError('Couldn\'t upload snapshot')
@@ -0,0 +1,147 @@
+"""
+Content encodings of the request bodies, shared by the connection and the listener.
+"""
+import gzip
+import zlib
+
+IDENTITY = 'identity'
+DEFAULT_LEVEL = 6
+CHUNK_SIZE = 64 * 1024
+MAX_BODY_SIZE = 32 * 1024 * 1024  # Decoded bytes of a body held in memory, so a compressed one can't blow it up
+MAX_STREAMED_BODY_SIZE = 1024 * 1024 * 1024  # Decoded bytes of a body streamed to the disk
+
+ENCODERS = {
+	'gzip': lambda body, level: gzip.compress(body, compresslevel=level),
+	'deflate': zlib.compress,
+	IDENTITY: lambda body, level: body,
+}
+
+DECODERS = {
+	'gzip': gzip.decompress,
+	'deflate': zlib.decompress,
+	IDENTITY: bytes,
+}
+STREAM_WBITS = {'gzip': 31, 'deflate': 15}  # zlib's window bits of the formats
+
+
+class DecodingError(ValueError):
+	"""
+	The body is corrupted.
+	"""
+
+
+class BodyTooLarge(ValueError):
+	"""
+	The decoded body is bigger than it's limit.
+	"""
+
+
+def encode(body, encoding, level=DEFAULT_LEVEL):
+	"""
+	Compress the body in the given content encoding.
+	:param level: Compression level, 1 (Fastest) to 9 (Smallest).
+	"""
+	return ENCODERS[encoding](body, level)
+
+
+def decode(body, encoding=None, limit=None):
+	"""
+	Decompress the body by it's Content-Encoding.
+	:param limit: Optional - The maximal size of the decoded body (bytes), which is never decompressed past it.
+	:raise ValueError: For unsupported encodings, BodyTooLarge if the decoded body passes the limit.
+	"""
+	encoding = supported(encoding)
+	if limit is None:
+		return DECODERS[encoding](body)
+	if encoding == IDENTITY:
+		data = bytes(body)
+	else:
+		decompressor = zlib.decompressobj(STREAM_WBITS[encoding])
+		try:
+			data = decompressor.decompress(body, limit + 1)
+		except zlib.error as e:
+			raise DecodingError(f'Couldn\'t decode the body - {e}')
+		if len(data) <= limit and not decompressor.eof:
+			raise DecodingError('The body is truncated')
+	if len(data) > limit:
+		raise BodyTooLarge(f'The decoded body is limited to {limit} bytes.')
+	return data
+
+
+def decode_stream(fd, encoding=None, chunk_size=CHUNK_SIZE, limit=None):
+	"""
+	Decompress the body while reading it from fd, in chunks of up to chunk_size (Before and after decoding).
+	:param limit: Optional - The maximal size of the decoded body (bytes), BodyTooLarge is raised past it.
+	:return: Iterator of the decoded chunks, raises DecodingError if the body is corrupted.
+	:raise ValueError: For unsupported encodings (Right away).
+	"""
+	encoding = supported(encoding)
+	chunks = iter(lambda: fd.read(chunk_size), b'')
+	if encoding != IDENTITY:
+		chunks = _decompress(chunks, zlib.decompressobj(STREAM_WBITS[encoding]), chunk_size)
+	return chunks if limit is None else _limited(chunks, limit)
+
+
+def _decompress(chunks, decompressor, chunk_size):
+	try:
+		for chunk in chunks:
+			while chunk:
+				yield decompressor.decompress(chunk, chunk_size)
+				chunk = decompressor.unconsumed_tail
+		if not decompressor.eof:
+			raise DecodingError('The body is truncated')
+	except zlib.error as e:
+		raise DecodingError(f'Couldn\'t decode the body - {e}')
+
+
+def _limited(chunks, limit):
+	size = 0
+	for chunk in chunks:
+		size += len(chunk)
+		if size > limit:
+			raise BodyTooLarge(f'The decoded body is limited to {limit} bytes.')
+		yield chunk
+
+
+class ChunksReader:
+	"""
+	File-like reading of chunks (i.e. of decode_stream): read(size) returns size bytes, unless the chunks ended.
+	If the chunks fail, every later read raises the same error.
+	"""
+
+	def __init__(self, chunks):
+		self.chunks = iter(chunks)
+		self.buffer = b''
+		self.error = None
+
+	def read(self, size):
+		parts = []
+		while size:
+			if not self.buffer:
+				self.buffer = self.next_chunk()
+				if self.buffer is None:  # The chunks ended
+					self.buffer = b''
+					break
+			part, self.buffer = self.buffer[:size], self.buffer[size:]
+			parts.append(part)
+			size -= len(part)
+		return b''.join(parts)
+
+	def next_chunk(self):
+		if self.error is not None:
+			raise self.error
+		try:
+			chunk = b''
+			while chunk == b'':  # Decompressing may yield empty chunks
+				chunk = next(self.chunks, None)
+			return chunk
+		except Exception as e:
+			self.error = e
+			raise
+
+
+def supported(encoding):
+	encoding = (encoding or IDENTITY).strip().lower()
+	if encoding not in DECODERS:
+		raise ValueError(f'Unsupported content encoding {encoding}')
+	return encoding
@@ -1,13 +1,30 @@
+import collections
+import io
 import logging
+import threading
+import zlib
 
 from flask import Flask, request, jsonify
 
+from .. import IOAccess
 from ..IOAccess import READERS_MIME_TYPE
-from ..parsers import PARSERS
-from ..utils import log_error
+from . import encoding
+from ..parsers import snapshot_fields
+from ..utils import log_error, prefork
+from ..utils.protobuf import MalformedMessage
 
 app = Flask(__name__)
 
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+RECENT_UPLOADS_LIMIT = 10000
+MAX_BATCH_SIZE = 256  # Snapshots in one /snapshots request
+MAX_BODY_SIZE = encoding.MAX_BODY_SIZE  # Decoded bytes of a body read to memory
+MAX_STREAMED_BODY_SIZE = encoding.MAX_STREAMED_BODY_SIZE  # Decoded bytes of a body streamed to the handler
+requested_fields = snapshot_fields()  # The snapshot fields the clients should send
+stream_bodies = False  # Whether snapshots are handled as the chunks of the body, instead of the whole data
+recent_uploads = collections.OrderedDict()  # Idempotency keys of the last stored snapshots
+recent_uploads_lock = threading.Lock()
+
 
 ###################
 # DEFAULT
@@ -20,6 +37,10 @@ def handle_user(user):
 	pass
 
 
+def handle_snapshots(user_id, snapshots):
+	return [handle_snapshot(user_id, snapshot) for snapshot in snapshots]
+
+
 logger = logging.getLogger('listener')
 
 
@@ -47,27 +68,136 @@ def user_types():
 def upload_snapshot():
 	"""
 	Receive the client's snapshot in body and use the handle function to publish_snapshot it else-where.
+	When streaming, the handler gets the decoded chunks of the body as they are read ('chunks'), instead of 'data'.
 	Fatal: Must register the user before calling this function.
 	"""
 
-	headers, body = request.headers, request.get_data()
-	logger.debug(f'New snapshot arrived in encoding {request.mimetype} with length of {len(request.data)}')
+	headers = request.headers
+	logger.debug(f'New snapshot arrived in encoding {request.mimetype} with length of {request.content_length}')
 
 	if 'UserId' not in headers:
 		logger.debug('No user id has been given, rejecting...')
 		return 'The request must mention the user\'s id in the UserId header.', 400
 
+	key = headers.get(IDEMPOTENCY_HEADER)
+	if key is not None and key in recent_uploads:
+		logger.debug('The snapshot was already stored, ignoring the retry')
+		return 'OK', 200
+
+	try:
+		if stream_bodies:
+			body = {'chunks': encoding.decode_stream(request.stream, headers.get('Content-Encoding'),
+			                                         limit=MAX_STREAMED_BODY_SIZE)}
+		else:
+			body = {'data': request_body()}
+	except encoding.BodyTooLarge as e:
+		logger.debug(f'The snapshot is too large - {e}')
+		return str(e), 413
+	except ValueError as e:
+		logger.debug(f'Couldn\'t decode the snapshot - {e}')
+		return str(e), 415
+
 	logger.debug('Sending snapshot to handler')
 
-	result = handle_snapshot(headers["UserId"], {'data': body, 'type': request.mimetype})
+	try:
+		result = handle_snapshot(headers["UserId"], {**body, 'type': request.mimetype})
+	except encoding.DecodingError as e:  # The streamed body turned out corrupted
+		logger.debug(f'Couldn\'t decode the snapshot - {e}')
+		return str(e), 415
+	except encoding.BodyTooLarge as e:  # Found while streaming
+		logger.debug(f'The snapshot is too large - {e}')
+		return str(e), 413
+	except MalformedMessage as e:
+		logger.debug(f'The snapshot is malformed - {e}')
+		return str(e), 400
 
 	if result is None:
 		logger.debug('Snapshot successfully uploaded')
+		if key is not None:
+			remember_upload(key)
 		return 'OK', 200
 	logger.debug('The snapshot is invalid')
 	return result
 
 
+@app.route('/snapshots', methods=['POST'])
+@log_error(logger)
+def upload_snapshots():
+	"""
+	Receive a batch of the client's snapshots, as messages (len | snapshot) in the body.
+	The batch is handled at once, and the answer is the status of each snapshot (JSON list of {status, error}).
+	The handler gets an iterator of the snapshots, which reads the body as it advances. When streaming, every
+	snapshot is given as the chunks of it's message ('chunks'), so the batch is never held in memory.
+	Every snapshot gets the idempotency key <key>:<index>, so retrying a batch stores only the missing ones.
+	Fatal: Must register the user before calling this function.
+	"""
+	headers = request.headers
+	if 'UserId' not in headers:
+		logger.debug('No user id has been given, rejecting...')
+		return 'The request must mention the user\'s id in the UserId header.', 400
+
+	try:
+		if stream_bodies:
+			chunks = encoding.decode_stream(request.stream, headers.get('Content-Encoding'),
+			                                limit=MAX_STREAMED_BODY_SIZE)
+			bodies = IOAccess.read(encoding.ChunksReader(chunks), 'message_chunks')
+		else:
+			with io.BytesIO(request_body()) as fd:
+				bodies = list(IOAccess.read(fd, 'messages'))
+	except encoding.BodyTooLarge as e:
+		logger.debug(f'The batch is too large - {e}')
+		return str(e), 413
+	except ValueError as e:
+		logger.debug(f'Couldn\'t decode the batch - {e}')
+		return str(e), 415
+	logger.debug(f'New batch of snapshots arrived in encoding {request.mimetype}')
+
+	key = headers.get(IDEMPOTENCY_HEADER)
+	keys, pending = [], []  # Filled as the snapshots are read
+
+	def snapshots():
+		for index, body in enumerate(bodies):
+			if index == MAX_BATCH_SIZE:
+				raise encoding.BodyTooLarge(f'A batch can hold up to {MAX_BATCH_SIZE} snapshots.')
+			keys.append(key and f'{key}:{index}')
+			if keys[index] is None or keys[index] not in recent_uploads:
+				pending.append(index)
+				yield {'chunks' if stream_bodies else 'data': body, 'type': request.mimetype}
+
+	try:
+		results = handle_snapshots(headers['UserId'], snapshots())
+	except encoding.BodyTooLarge as e:
+		logger.debug(f'The batch is too large - {e}')
+		return str(e), 413
+	except encoding.DecodingError as e:  # The streamed body turned out corrupted
+		logger.debug(f'Couldn\'t decode the batch - {e}')
+		return str(e), 415
+	except ValueError as e:  # The messages are truncated
+		logger.debug(f'The batch is malformed - {e}')
+		return str(e), 400
+
+	statuses = [{'status': 200} for _ in keys]
+	for index, result in zip(pending, results):
+		if result is None:
+			if keys[index] is not None:
+				remember_upload(keys[index])
+			continue
+		error, status = result if isinstance(result, tuple) else (result, 400)
+		statuses[index] = {'status': status, 'error': error}
+
+	logger.debug(f'Batch handled, {len(pending)} new snapshots')
+	return jsonify(statuses), 200
+
+
+@app.route('/fields')
+@log_error(logger)
+def server_config():
+	"""
+	Return the server's configuration: the fields it handles and the batch size /snapshots accepts.
+	"""
+	return jsonify({'fields': requested_fields, 'max_batch': MAX_BATCH_SIZE})
+
+
 @app.route('/register', methods=['POST'])
 @log_error(logger)
 def register():
@@ -85,29 +215,70 @@ def register():
 
 	if result is None:
 		logger.debug('User registered sending fields')
-		return jsonify(list(PARSERS.keys()) ), 200
+		# The body encodings the server can decode
+		return jsonify(requested_fields), 200, {'Accept-Encoding': ', '.join(encoding.DECODERS)}
 
 	logger.debug('The user is invalid, rejecting registration...')
 	return result
 
 
-def config_publishers(user_publisher=None, snapshot_publisher=None):
-	global handle_user, handle_snapshot
+def request_body():
+	"""
+	The request's body, decoded by it's Content-Encoding (Up to MAX_BODY_SIZE bytes).
+	:raise ValueError: If the encoding isn't supported or the body is corrupted, BodyTooLarge if it's too large.
+	"""
+	try:
+		return encoding.decode(request.get_data(), request.headers.get('Content-Encoding'), MAX_BODY_SIZE)
+	except (OSError, EOFError, zlib.error) as e:  # Corrupted body
+		raise ValueError(f'Couldn\'t decode the body - {e}')
+
+
+def remember_upload(key):
+	with recent_uploads_lock:
+		recent_uploads[key] = None
+		if len(recent_uploads) > RECENT_UPLOADS_LIMIT:
+			recent_uploads.popitem(last=False)
+
+
+def config_fields(fields):
+	global requested_fields
+	logger.debug(f'The clients should send the fields {fields}')
+	requested_fields = fields
+
+
+def config_streaming(stream=True):
+	global stream_bodies
+	logger.debug(f'Snapshot bodies are streamed to the handler: {stream}')
+	stream_bodies = stream
+
+
+def config_publishers(user_publisher=None, snapshot_publisher=None, snapshots_publisher=None):
+	global handle_user, handle_snapshot, handle_snapshots
 	logger.debug('Configuring user, snapshot handlers')
 	handle_user = user_publisher or handle_user
 	handle_snapshot = snapshot_publisher or handle_snapshot
+	handle_snapshots = snapshots_publisher or handle_snapshots
 
 
-def Listener(host, port):
+def Listener(host, port, workers=None, threads=1, initializer=None):
 	"""
 	Starts a listener, which accepts snapshots and users.
 	:param host: IP to bind the server to.
 	:param port: Port to bind to
+	:param workers: Optional - Serve with this amount of pre-forked worker processes, instead of the development server.
+	:param threads: The amount of threads in each worker.
+	:param initializer: Optional - Called in every worker before it serves (Or before serving, without workers).
+	Recent idempotency keys are kept by each worker, so a retry is deduplicated only if it reaches the same worker.
 	"""
 
 	logger.info(f'Listening on {host}:{port}')
 	logging.getLogger('werkzeug').setLevel(logging.CRITICAL)
 	try:
+		if workers is not None:
+			prefork.serve(app, host, port, workers, threads, initializer)
+			return
+		if initializer is not None:
+			initializer()
 		app.run(host, port)
 	except KeyboardInterrupt:
 		logger.info('SIGINT sent exiting...')
@@ -33,6 +33,13 @@ class Saver:
 		"""
 		self.database.save(name, data)
 
+	def save_many(self, results):
+		"""
+		Saves few published results together.
+		:param results: Iterable of (name, data) pairs, as given to save.
+		"""
+		self.database.save_many(results)
+
 	def save_user(self, user):
 		"""
 		Saves the user to the database.
@@ -62,15 +69,16 @@ def save(result_name, path, database_url):
 @cli.command('run-saver')
 @click.argument('mq-url')
 @click.argument('database-url')
+@click.option('--batch-size', type=int, default=None, help='Maximal amount of messages saved together')
 @log_error(logger)
-def run_saver(mq_url, database_url):
+def run_saver(mq_url, database_url, batch_size):
 	"""
 	Runs a parser which feeds from the message queue and save it to the db.
 	"""
 	logging.info('Running saver')
 	saver = Saver(database_url)
 	mq = MessageQueue.MessageQueue(mq_url)
-	mq.run_saver(saver)
+	mq.run_saver(saver, batch_size=batch_size)
 
 
 if __name__ == '__main__':
@@ -1,19 +1,27 @@
 import io
 import logging
+import mmap
 import os
+import tempfile
 import time
 from pathlib import Path
 
 import click
 
 from .utils import log_error
-from .protocol import listener
+from .protocol import listener, async_listener
 from . import utils
 from . import IOAccess, MessageQueue
+from .IOAccess.field_manifest import write_manifest
+from .IOAccess.Writers.writers import SNAPSHOT_KEY_FIELDS
+from .utils.protobuf import Snapshot, field_numbers, stream_keep_fields
+from .parsers import PARSERS, snapshot_fields
 from .defaults import SERVER_DEFAULT_HOST, SERVER_DEFAULT_PORT, DATA_DIR
 
 logger = logging.getLogger('server')
 
+TEMPORARY_SUFFIX = '.part'  # Snapshots which are still written
+
 
 ###############################
 # CLI functions
@@ -31,26 +39,72 @@ def cli():
 @click.option('-h', '--host', default=SERVER_DEFAULT_HOST, help='Host to bind')
 @click.option('-p', '--port', default=SERVER_DEFAULT_PORT, type=int)
 @click.option('--data-dir', help='Where to store snapshot for further analysis', default=DATA_DIR)
+@click.option('--confirm-batch', type=int, default=None, help=
+'If given, snapshots are published durably, committed to the message queue in batches of this size')
+@click.option('-n', '--parser', 'parser_names', multiple=True, type=click.Choice(list(PARSERS)), help=
+'The parsers deployed behind the server (Default all), only the snapshot fields they use are uploaded and stored')
+@click.option('--field-manifest', is_flag=True, help=
+'Store the byte ranges of every field next to the snapshots, so each parser reads only the fields it uses '
+'(Directories storage only)')
+@click.option('--storage', type=click.Choice(['directories', 'segments']), default='directories', help=
+'How to store raw snapshots: a directory for each one, or appended to per user segment files')
+@click.option('--segment-size', type=int, default=IOAccess.segment_store.DEFAULT_SEGMENT_SIZE, help=
+'With segments storage, the size (bytes) at which a segment is rolled')
+@click.option('--snapshot-ids', type=click.Choice(list(utils.snapshot_id_generator.GENERATORS)), default='block',
+              help='How snapshot IDs are generated: leased in blocks, or time ordered (snowflake)')
+@click.option('--workers', type=int, default=None, help=
+'Serve with this amount of pre-forked worker processes, instead of the development server')
+@click.option('--threads', type=int, default=1, help=
+'With --workers, the amount of threads in every worker. With --asyncio, the threads writing the snapshots')
+@click.option('--asyncio', 'use_asyncio', is_flag=True, help=
+'Serve the uploads with the asyncio listener, a single process for many concurrent clients')
 @log_error(logger)
-def cli_run_server(mq_url, host, port, data_dir):
+def cli_run_server(mq_url, host, port, data_dir, confirm_batch=None, parser_names=(), field_manifest=False,
+                   storage='directories', segment_size=IOAccess.segment_store.DEFAULT_SEGMENT_SIZE,
+                   snapshot_ids='block', workers=None, threads=1, use_asyncio=False):
 	"""
 	Listens for snapshot uploads via HTTP:POST requests.
 	publishes them to the message queue on MQ-URL.
 	"""
+	if field_manifest and storage == 'segments':
+		raise ValueError('--field-manifest is supported only with --storage directories')
 	logger.info('Starting server from CLI')
 	logger.debug(f'Everything should be stored to {data_dir} directory')
 	data_dir = Path(data_dir)
-	mq = MessageQueue.MessageQueue(mq_url)
+	utils.configure_ids(snapshot_ids)
+	mq = None
+	fields = snapshot_fields(parser_names) if parser_names else None
+	segments = IOAccess.SegmentStore(data_dir, segment_size) if storage == 'segments' else None
 
 	def user_publisher(*args):
 		return handle_user(*args, mq)
 
 	def snapshot_publisher(*args):
-		return handle_snapshot(*args, data_dir, mq)
+		return handle_snapshot(*args, data_dir, mq, fields=fields, manifest=field_manifest, segments=segments)
+
+	def snapshots_publisher(*args):
+		return handle_snapshots(*args, data_dir, mq, fields=fields, manifest=field_manifest, segments=segments)
+
+	def connect():  # In every worker, the connections don't survive a fork
+		nonlocal mq
+		mq = MessageQueue.MessageQueue(mq_url, confirm_batch=confirm_batch)
+
+	if use_asyncio:
+		def store(user_id, snapshot):
+			return store_snapshot(user_id, snapshot, data_dir, fields, field_manifest, segments)
 
-	run_server_publisher(host, port, user_publisher, snapshot_publisher)
+		def publish(snapshot_raw_path):
+			return mq.publish_snapshot(str(snapshot_raw_path), wait=False)
 
-	mq.close()
+		connect()
+		run_async_server(host, port, user_publisher, store, publish, fields=fields,
+		                 threads=max(threads, async_listener.DEFAULT_THREADS))
+	else:
+		run_server_publisher(host, port, user_publisher, snapshot_publisher, snapshots_publisher, fields=fields,
+		                     workers=workers, threads=threads, initializer=connect, stream=True)
+
+	if mq is not None:
+		mq.close()
 
 
 run_server = cli_run_server.callback
@@ -61,35 +115,121 @@ run_server = cli_run_server.callback
 ##########################
 
 @log_error(logger)
-def run_server_publisher(host, port, publish_user=None, publish_snapshot=None):
+def run_server_publisher(host, port, publish_user=None, publish_snapshot=None, publish_snapshots=None, fields=None,
+                         workers=None, threads=1, initializer=None, stream=False):
 	"""
 	Run a server which listens on host:port.
 	The server receives every user and snapshots, and publishes them with given handlers.
 	:param publish_user: What to do with each given user. Default is NOP.
 	:param publish_snapshot: What to do with each given snapshot. Default is printing
-	Both publishers can return answer for the server to answer or None for 200, OK
+	:param publish_snapshots: What to do with a batch of snapshots. Default is publish_snapshot on each one.
+	The publishers can return answer for the server to answer or None for 200, OK (A list of them for a batch)
+	:param fields: Optional - The snapshot fields the clients should send, by default the ones all the parsers use.
+	:param workers: Optional - Serve with pre-forked worker processes, each with the given amount of threads.
+	:param initializer: Optional - Called in every worker before it serves, i.e. to connect the publishers.
+	:param stream: If set, publish_snapshot gets the chunks of the body as they arrive ('chunks'), instead of 'data'.
 	"""
-	listener.config_publishers(publish_user, publish_snapshot)
+	listener.config_publishers(publish_user, publish_snapshot, publish_snapshots)
+	listener.config_streaming(stream)
+	if fields is not None:
+		listener.config_fields(fields)
 	try:
-		listener.Listener(host, port)
+		listener.Listener(host, port, workers, threads, initializer)
 	except KeyboardInterrupt:
 		logging.info('Got SIGINT Exiting...')
 
 
+@log_error(logger)
+def run_async_server(host, port, publish_user=None, store=None, publish=None, fields=None,
+                     threads=async_listener.DEFAULT_THREADS):
+	"""
+	Run the asyncio listener on host:port.
+	:param publish_user: What to do with each given user, like in run_server_publisher.
+	:param store: Stores each snapshot (user_id, snapshot), returns where. Runs in a pool of the given threads.
+	:param publish: Publishes the stored snapshot, returns it's confirmation (A future) or None.
+	:param fields: Optional - The snapshot fields the clients should send, by default the ones all the parsers use.
+	"""
+	if fields is not None:
+		listener.config_fields(fields)
+	async_listener.AsyncListener(publish_user, store, publish, threads=threads).run(host, port)
+
+
 #######################
 # PUBLISH FUNCTIONS
 #######################
 
-def handle_snapshot(user_id, snapshot, data_dir, mq):
-	raw_snapshot, snapshot_type = snapshot['data'], snapshot['type']
+def handle_snapshot(user_id, snapshot, data_dir, mq, fields=None, manifest=False, segments=None):
+	snapshot_type = snapshot['type']
 	if snapshot_type not in IOAccess.READERS_MIME_TYPE['snapshot']:
 		return 'The given type is unsupportable', 400
 
-	version = IOAccess.READERS_MIME_TYPE['snapshot'][snapshot_type]
+	snapshot_raw_path = store_snapshot(user_id, snapshot, data_dir, fields, manifest, segments)
+	mq.publish_snapshot(str(snapshot_raw_path))
+
+	logger.info('Sever published the snapshot successfully')
+
+
+def handle_snapshots(user_id, snapshots, data_dir, mq, fields=None, manifest=False, segments=None):
+	"""
+	Stores a batch of snapshots, then publishes all of them at once and waits for their confirmations.
+	A snapshot which can't be stored (i.e. malformed) is rejected alone, the rest of the batch is still handled.
+	A snapshot whose publishing isn't confirmed gets 503, so only it is sent again.
+	:return: List of answers, None for every stored and published snapshot.
+	"""
+	results, confirmations = [], []  # (Index in the batch, confirmation)
+	for snapshot in snapshots:
+		if snapshot['type'] not in IOAccess.READERS_MIME_TYPE['snapshot']:
+			results.append(('The given type is unsupportable', 400))
+			continue
+		try:
+			snapshot_raw_path = store_snapshot(user_id, snapshot, data_dir, fields, manifest, segments)
+		except Exception as e:
+			logger.warning(f'Couldn\'t store a snapshot of the batch - {e}')
+			results.append((f'Couldn\'t store the snapshot - {e}', 400))
+			continue
+		confirmations.append((len(results), mq.publish_snapshot(str(snapshot_raw_path), wait=False)))
+		results.append(None)
+
+	for index, confirmation in confirmations:
+		if confirmation is None:  # Published right away
+			continue
+		try:
+			confirmation.result(timeout=mq.CONFIRM_TIMEOUT)
+		except Exception as e:
+			logger.warning(f'Couldn\'t publish a snapshot of the batch - {e}')
+			results[index] = (f'Couldn\'t publish the snapshot - {e}', 503)
+	logger.info(f'Sever published {results.count(None)} snapshots successfully')
+	return results
+
+
+def store_snapshot(user_id, snapshot, data_dir, fields=None, manifest=False, segments=None):
+	"""
+	Saves the raw snapshot under a new snapshot id.
+	The snapshot is streamed (Its data, or the chunks of the body as they arrive) to a temporary file in the
+	target directory, which is then renamed, so the memory doesn't depend on the snapshot's size.
+	:param fields: Optional - Store only those fields, the rest are dropped from the raw snapshot (Unparsed).
+	:param manifest: If set, the byte ranges of the fields are stored next to the snapshot (Not with segments).
+	:param segments: Optional - SegmentStore to append the snapshot to, instead of a directory of it's own.
+	The chunks are streamed straight into the segment, which stays locked until the body ends.
+	:return: The path of the raw snapshot (Or it's segment locator).
+	"""
+	chunks = snapshot['chunks'] if 'chunks' in snapshot else [snapshot['data']]
+	version = IOAccess.READERS_MIME_TYPE['snapshot'][snapshot['type']]
 
-	logger.info(f'Server publishes a new snapshot of type {version}')
+	logger.info(f'Server stores a new snapshot of type {version}')
 
-	snapshot_raw_path = data_dir / user_id / str(utils.next_snapshot_id()) / f'snapshot.raw.{version}'
+	if fields is not None:  # Picked from the protobuf wire format, while streaming
+		chunks = stream_keep_fields(chunks, field_numbers(Snapshot, set(fields) | SNAPSHOT_KEY_FIELDS))
+
+	snapshot_id = utils.next_snapshot_id()
+	if segments is not None:
+		try:
+			return segments.append(user_id, snapshot_id, chunks, version)  # Streamed into the segment
+		except BaseException:
+			remove_empty(segments.data_dir / user_id)
+			raise
+
+	snapshot_raw_path = data_dir / user_id / str(snapshot_id) / f'snapshot.raw.{version}'
 
 	logger.info('Creating new directory to the snapshot')
 	logger.debug(f'Directory path is {data_dir}')
@@ -99,11 +239,48 @@ def handle_snapshot(user_id, snapshot, data_dir, mq):
 	logger.info(f'The snapshot is being saved to file')
 	logger.debug(f'Snapshot file path is {snapshot_raw_path}')
 
-	with open(snapshot_raw_path, 'wb') as fd:
-		fd.write(raw_snapshot)
-	mq.publish_snapshot(str(snapshot_raw_path))
+	try:
+		temporary_path = spool(chunks, snapshot_raw_path.parent)
+	except BaseException:
+		remove_empty(snapshot_raw_path.parent, snapshot_raw_path.parent.parent)  # Nothing was stored
+		raise
+	os.replace(temporary_path, snapshot_raw_path)
+
+	if manifest:  # From the written file, mapped
+		with open(snapshot_raw_path, 'rb') as fd:
+			if os.fstat(fd.fileno()).st_size:
+				with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+					write_manifest(snapshot_raw_path, data)
+			else:
+				write_manifest(snapshot_raw_path, b'')
+	return snapshot_raw_path
+
+
+def remove_empty(*directories):
+	"""
+	Removes the directories, in order, as long as they are empty.
+	"""
+	for directory in directories:
+		try:
+			directory.rmdir()
+		except OSError:  # Holds other snapshots
+			return
 
-	logger.info('Sever published the snapshot successfully')
+
+def spool(chunks, directory):
+	"""
+	Writes the chunks to a new temporary file in the directory. The file is removed if writing fails.
+	:return: The temporary file's path.
+	"""
+	fd, path = tempfile.mkstemp(dir=directory, prefix='.', suffix=TEMPORARY_SUFFIX)
+	try:
+		with os.fdopen(fd, 'wb') as file:
+			for chunk in chunks:
+				file.write(chunk)
+	except BaseException:
+		os.unlink(path)
+		raise
+	return path
 
 
 def handle_user(user, mq):
@@ -1,4 +1,4 @@
 from .log_options import log_error
 from .http_headers import HTTP_HEADERS
 from .protobuf import object_to_protobuf
-from .snapshot_id_generator import next_snapshot_id
+from .snapshot_id_generator import next_snapshot_id, configure_ids
@@ -0,0 +1,252 @@
+"""
+Pre-fork WSGI server, made of the standard library only (wsgiref).
+The listening socket is bound once, then every worker process accepts from it with a pool of threads,
+so the kernel spreads the connections between the workers.
+Handles which can't survive a fork (i.e. message queue and DB connections) are opened by the initializer,
+inside every worker.
+A worker which exits is replaced, after a growing delay while the workers keep failing right away, and the server
+gives up after MAX_FAILURES failures in a row.
+The connections are kept alive (HTTP/1.1), by a thread each: an idle one is closed after KEEP_ALIVE_TIMEOUT
+seconds, and a busy one after MAX_KEEP_ALIVE_REQUESTS requests, so the queued connections get their turn.
+A response without a Content-Length, or a request whose body wasn't read, closes the connection.
+Nothing is shared between the workers, so per process state (i.e. caches) is kept by each worker alone.
+"""
+import io
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from wsgiref.simple_server import ServerHandler, WSGIServer, WSGIRequestHandler
+
+logger = logging.getLogger('prefork')
+
+BACKLOG = 1024
+RESPAWN_DELAY = 0.1  # Seconds before replacing a failing worker, doubled with every failure in a row
+MAX_RESPAWN_DELAY = 10
+STABLE_UPTIME = 5  # Seconds after which an exiting worker isn't counted as failing right away
+MAX_FAILURES = 10
+KEEP_ALIVE_TIMEOUT = 5  # Seconds an idle connection is kept
+MAX_KEEP_ALIVE_REQUESTS = 100  # Requests served on a connection before it's closed
+MAX_DRAIN = 64 * 1024  # Bytes of an unread request body which are skipped to keep the connection
+MAX_REQUEST_LINE = 65536
+
+
+class RequestHandler(WSGIRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	timeout = KEEP_ALIVE_TIMEOUT
+
+	def handle(self):
+		"""
+		Serves the requests of the connection, until it's closed.
+		"""
+		for served in range(1, MAX_KEEP_ALIVE_REQUESTS + 1):
+			try:
+				self.raw_requestline = self.rfile.readline(MAX_REQUEST_LINE + 1)
+			except socket.timeout:  # Idle
+				return
+			if not self.raw_requestline:
+				return
+			if len(self.raw_requestline) > MAX_REQUEST_LINE:
+				self.requestline = self.request_version = self.command = ''
+				self.send_error(414)
+				return
+			if not self.parse_request():  # An error was sent
+				return
+			self.close_connection = self.close_connection or served == MAX_KEEP_ALIVE_REQUESTS
+			self.handle_request()
+			if self.close_connection:
+				return
+
+	def handle_request(self):
+		if 'Transfer-Encoding' in self.headers:  # Not framed by a length, the connection can't be reused
+			self.close_connection = True
+			body = self.rfile
+		else:
+			body = RequestBody(self.rfile, int(self.headers.get('Content-Length') or 0))
+		handler = KeepAliveHandler(body, self.wfile, self.get_stderr(), self.get_environ(), multithread=True)
+		handler.request_handler = self
+		handler.run(self.server.get_app())
+		if not self.close_connection and not body.drain():
+			self.close_connection = True
+
+	def log_message(self, format, *args):
+		logger.debug(f'{self.address_string()} - {format % args}')
+
+
+class KeepAliveHandler(ServerHandler):
+	http_version = '1.1'
+
+	def cleanup_headers(self):
+		super().cleanup_headers()
+		request_handler = self.request_handler
+		if 'Content-Length' not in self.headers or getattr(self.stdin, 'remaining', 0) > MAX_DRAIN:
+			request_handler.close_connection = True
+		if request_handler.close_connection:
+			self.headers['Connection'] = 'close'
+
+
+class RequestBody(io.RawIOBase):
+	"""
+	The body of a request (wsgi.input), read up to it's Content-Length.
+	"""
+
+	def __init__(self, rfile, length):
+		self.rfile = rfile
+		self.remaining = length
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		data = self.rfile.read(min(len(buffer), self.remaining))
+		buffer[:len(data)] = data
+		self.remaining -= len(data)
+		return len(data)
+
+	def drain(self):
+		"""
+		Skips the rest of the body (Up to MAX_DRAIN bytes), so the next request can be read.
+		:return: Whether the whole body was read.
+		"""
+		if self.remaining > MAX_DRAIN:
+			return False
+		while self.remaining and self.read(self.remaining):
+			pass
+		return not self.remaining
+
+
+class PreforkServer:
+	def __init__(self, app, host, port, workers=1, threads=1, initializer=None):
+		"""
+		:param app: The WSGI application.
+		:param workers: The amount of worker processes.
+		:param threads: The amount of threads handling requests in every worker.
+		:param initializer: Optional - Called in every worker before it serves.
+		"""
+		self.app = app
+		self.workers = workers
+		self.threads = threads
+		self.initializer = initializer
+		self.children = {}  # pid: Start time
+		self.stopping = False
+		self.failures = 0  # Workers in a row which exited right after starting
+
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.socket.bind((host, port))
+		self.socket.listen(BACKLOG)
+		self.address = self.socket.getsockname()
+
+	def serve_forever(self):
+		"""
+		Forks the workers and keeps them alive, until SIGINT/SIGTERM.
+		"""
+		signal.signal(signal.SIGTERM, self.stop)
+		logger.info(f'Serving on {self.address[0]}:{self.address[1]} with {self.workers} workers, '
+		            f'{self.threads} threads each')
+		try:
+			for _ in range(self.workers):
+				self.spawn()
+			while self.children:
+				try:
+					pid, status = os.wait()
+				except ChildProcessError:  # Already reaped by stop
+					break
+				started = self.children.pop(pid, None)
+				if not self.stopping:
+					logger.warning(f'Worker {pid} exited with {status}, replacing it')
+					self.respawn(started)
+		except KeyboardInterrupt:
+			self.stop()
+		finally:
+			self.socket.close()
+
+	def respawn(self, started):
+		"""
+		Replaces a worker which exited, backing off while the workers exit right after starting.
+		:param started: The time the worker started at.
+		"""
+		if started is not None and time.monotonic() - started >= STABLE_UPTIME:
+			self.failures = 0
+		else:
+			self.failures += 1
+		if self.failures >= MAX_FAILURES:
+			logger.error(f'{self.failures} workers in a row failed right away, giving up')
+			self.stop()
+			raise RuntimeError('The workers keep failing')
+		if self.failures:
+			time.sleep(min(RESPAWN_DELAY * 2 ** (self.failures - 1), MAX_RESPAWN_DELAY))
+		if not self.stopping:  # Unless stopped while waiting
+			self.spawn()
+
+	def stop(self, *args):
+		self.stopping = True
+		for pid in self.children:
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+		for pid in list(self.children):
+			try:
+				os.waitpid(pid, 0)
+			except ChildProcessError:
+				pass
+			self.children.pop(pid)
+
+	def spawn(self):
+		pid = os.fork()
+		if pid:
+			self.children[pid] = time.monotonic()
+			return
+		code = 0
+		try:
+			signal.signal(signal.SIGTERM, signal.SIG_DFL)
+			signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent stops the workers
+			self.work()
+		except Exception:
+			logger.exception('Worker failed')
+			code = 1
+		finally:
+			os._exit(code)
+
+	def work(self):
+		"""
+		Serves requests from the shared socket with a pool of threads, forever.
+		"""
+		if self.initializer is not None:
+			self.initializer()
+		server = WSGIServer(self.address, RequestHandler, bind_and_activate=False)
+		server.socket.close()
+		server.socket = self.socket
+		server.server_name, server.server_port = socket.getfqdn(self.address[0]), self.address[1]
+		server.setup_environ()
+		server.set_app(self.app)
+
+		pool = [threading.Thread(target=accept_requests, args=(server,), daemon=True) for _ in range(self.threads)]
+		for thread in pool:
+			thread.start()
+		for thread in pool:
+			thread.join()
+
+
+def accept_requests(server):
+	while True:
+		try:
+			request, client_address = server.get_request()
+		except OSError:  # The socket was closed
+			return
+		try:
+			server.finish_request(request, client_address)
+		except Exception:
+			server.handle_error(request, client_address)
+		finally:
+			server.shutdown_request(request)
+
+
+def serve(app, host, port, workers=1, threads=1, initializer=None):
+	"""
+	Serves the WSGI application with pre-forked workers.
+	"""
+	PreforkServer(app, host, port, workers, threads, initializer).serve_forever()
@@ -1,2 +1,4 @@
 from .cortex_pb2 import User, Snapshot, ColorImage, DepthImage, Feelings, Pose
-from .helpers import object_to_protobuf
+from .helpers import object_to_protobuf, packed_field
+from .wire import field_numbers, wire_fields, keep_fields, stream_keep_fields, drop_fields, extract_fields, LazyMessage
+from .wire import MalformedMessage
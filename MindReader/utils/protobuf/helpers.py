@@ -1,6 +1,7 @@
 """
 Generic protobuf helper functions.
 """
+from .wire import wire_fields
 
 
 def object_to_protobuf(obj, protobuf_obj):
@@ -19,3 +20,26 @@ def object_to_protobuf(obj, protobuf_obj):
 				object_to_protobuf(field_data, target_field)
 		except AttributeError:
 			continue
+
+
+def packed_field(message, field_name):
+	"""
+	Takes the raw payload of a packed repeated numeric field straight from the message's wire format.
+	This lets the caller view the values as an array (i.e. numpy.frombuffer), instead of converting each value
+	to a python object.
+	:return: memoryview of the packed values (little endian), or None if the field isn't encoded packed.
+	"""
+	field_number = message.DESCRIPTOR.fields_by_name[field_name].number
+	chunks = []
+	try:
+		for number, wire_type, value in wire_fields(message.SerializeToString()):
+			if number == field_number:
+				if wire_type != 2:
+					return None
+				chunks.append(value)
+	except ValueError:  # Groups are deprecated, not worth supporting
+		return None
+
+	if len(chunks) == 1:
+		return chunks[0]
+	return memoryview(b''.join(chunks))
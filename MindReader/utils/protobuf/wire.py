@@ -0,0 +1,197 @@
+"""
+Access to the top level fields of serialized messages, straight from the wire format.
+The fields are located by scanning the keys, without decoding the message, so dropping or extracting
+fields never copies the others (i.e. the images of a snapshot) through python objects.
+"""
+
+MAX_FIELD_HEADER = 20  # A key and a length, varints of up to 10 bytes each
+
+
+class MalformedMessage(ValueError):
+	"""
+	The serialized message is truncated or corrupted.
+	"""
+
+
+def field_numbers(message_type, names):
+	"""
+	:param message_type: Protobuf message class.
+	:param names: Names of fields of the message, names which aren't it's fields are ignored.
+	:return: Set of the numbers (tags) of the fields.
+	"""
+	fields = message_type.DESCRIPTOR.fields_by_name
+	return {fields[name].number for name in names if name in fields}
+
+
+def field_spans(data):
+	"""
+	Iterates over the top level fields of a serialized message.
+	:return: Iterator of (field number, wire type, start of the field, start of the value, end of the field).
+	"""
+	position = 0
+	while position < len(data):
+		start = position
+		try:
+			key, position = _read_varint(data, position)
+			number, wire_type = key >> 3, key & 7
+			if wire_type == 0:
+				end = _read_varint(data, position)[1]
+			elif wire_type == 1:
+				end = position + 8
+			elif wire_type == 2:
+				size, position = _read_varint(data, position)
+				end = position + size
+			elif wire_type == 5:
+				end = position + 4
+			else:
+				raise MalformedMessage(f'Unsupported wire type {wire_type}')
+		except IndexError:  # A varint runs past the end
+			raise MalformedMessage('Truncated message')
+		if end > len(data):
+			raise MalformedMessage('Truncated message')
+		yield number, wire_type, start, position, end
+		position = end
+
+
+def wire_fields(data):
+	"""
+	Iterates over the top level fields of a serialized message, without parsing it.
+	:return: Iterator of (field number, wire type, value). Varints are given as int, the rest as memoryview slices.
+	"""
+	data = memoryview(data)
+	for number, wire_type, _, position, end in field_spans(data):
+		if wire_type == 0:
+			yield number, wire_type, _read_varint(data, position)[0]
+		else:
+			yield number, wire_type, data[position:end]
+
+
+def keep_fields(data, numbers):
+	"""
+	:return: The serialized message, with only the given top level fields.
+	"""
+	data = memoryview(data)
+	return b''.join(data[start:end] for number, _, start, _, end in field_spans(data) if number in numbers)
+
+
+def drop_fields(data, numbers):
+	"""
+	:return: The serialized message, without the given top level fields.
+	"""
+	data = memoryview(data)
+	return b''.join(data[start:end] for number, _, start, _, end in field_spans(data) if number not in numbers)
+
+
+def stream_keep_fields(chunks, numbers):
+	"""
+	Like keep_fields, for a serialized message which arrives in chunks.
+	The kept fields are passed on as they arrive and the rest are skipped, only a field's key and length are buffered.
+	:return: Iterator of the kept bytes (memoryview slices of the chunks).
+	"""
+	pending = b''  # The start of a field, which isn't complete in the chunks yet
+	remaining, keep = 0, False  # Bytes left of the current field's value
+	for chunk in chunks:
+		chunk = memoryview(chunk)
+		position = 0
+		while position < len(chunk):
+			if remaining:
+				end = min(position + remaining, len(chunk))
+				if keep:
+					yield chunk[position:end]
+				remaining -= end - position
+				position = end
+				continue
+
+			added = chunk[position:position + MAX_FIELD_HEADER]
+			pending += added
+			header = _field_header(pending)
+			if header is None:
+				position += len(added)
+				continue
+			number, header_size, remaining = header
+			keep = number in numbers
+			if keep:
+				yield memoryview(pending[:header_size])
+			position += header_size - (len(pending) - len(added))
+			pending = b''
+	if pending or remaining:
+		raise MalformedMessage('Truncated message')
+
+
+def extract_fields(data, numbers):
+	"""
+	Extracts the encoded values of the given top level fields, i.e. the serialized sub-messages.
+	:return: Dict of field number: list of it's values (memoryview slices, or int for varints).
+	"""
+	values = {}
+	for number, wire_type, value in wire_fields(data):
+		if number in numbers:
+			values.setdefault(number, []).append(value)
+	return values
+
+
+class LazyMessage:
+	"""
+	Read only view of a serialized message, which decodes a top level field only upon access.
+	The message is scanned once for the fields' offsets, each accessed field is decoded from it's own bytes.
+	"""
+
+	def __init__(self, message_type, data):
+		self._message_type = message_type
+		self._data = memoryview(data)
+		self._spans = {}
+		for number, _, start, _, end in field_spans(self._data):
+			self._spans.setdefault(number, []).append((start, end))
+
+	def __getattr__(self, name):
+		field = self._message_type.DESCRIPTOR.fields_by_name.get(name)
+		if field is None:
+			raise AttributeError(f'{self._message_type.__name__} has no field {name}')
+		message = self._message_type()
+		for start, end in self._spans.get(field.number, []):  # Occurrences are merged, like in a full decode
+			message.MergeFromString(self._data[start:end])
+		value = getattr(message, name)
+		setattr(self, name, value)  # Decoded once
+		return value
+
+	def decode(self):
+		"""
+		:return: The fully decoded message.
+		"""
+		return self._message_type.FromString(self._data)
+
+
+def _field_header(data):
+	"""
+	:return: The field number, the size of it's key (And length), and the size of it's value.
+	None if the data is too short for the header.
+	"""
+	try:
+		key, position = _read_varint(data, 0)
+		wire_type = key & 7
+		if wire_type == 0:
+			position, size = _read_varint(data, position)[1], 0
+		elif wire_type == 1:
+			size = 8
+		elif wire_type == 2:
+			size, position = _read_varint(data, position)
+		elif wire_type == 5:
+			size = 4
+		else:
+			raise MalformedMessage(f'Unsupported wire type {wire_type}')
+	except IndexError:
+		if len(data) >= MAX_FIELD_HEADER:
+			raise MalformedMessage('Malformed message')
+		return None
+	return key >> 3, position, size
+
+
+def _read_varint(data, position):
+	result = shift = 0
+	while True:
+		byte = data[position]
+		position += 1
+		result |= (byte & 0x7f) << shift
+		if not byte & 0x80:
+			return result, position
+		shift += 7
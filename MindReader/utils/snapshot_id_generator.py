@@ -5,31 +5,145 @@ This is a nice abstraction, since the generator can be:
 2. work with few threads
 3. work with few servers
 Without changing the api, only by changing the next_snapshot_id function
-"""
 
-from pathlib import Path
+Two generators are available (configure_ids):
+- block: IDs are leased from the counter file in blocks, under a lock, so processes sharing it never collide.
+Only the block boundaries are persisted, so a restart skips the rest of the leased block.
+- snowflake: time ordered IDs (milliseconds | worker | sequence), which sort by arrival.
+The worker number is leased by locking it's slot file in the workers directory, so it's unique between the live
+processes, and it's free again once the process holding it exits.
+"""
+import fcntl
+import logging
+import os
 import struct
+import threading
+import time
+from pathlib import Path
 
-from ..IOAccess import open
+logger = logging.getLogger('snapshot_id_generator')
 
 COUNTER_FILE = Path(__file__).parent / 'counter'
+WORKERS_DIR = Path(__file__).parent / 'workers'
+BLOCK_SIZE = 1000
+COUNTER = struct.Struct('<Q')  # The first ID which wasn't leased
+LEGACY_COUNTER = struct.Struct('<L')  # The last ID given (By the former generator)
+
+EPOCH = 1577836800000  # 2020-01-01 in milliseconds
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+
+class BlockAllocator:
+	def __init__(self, path=COUNTER_FILE, block_size=BLOCK_SIZE):
+		"""
+		:param path: The counter file, shared by all the allocators.
+		:param block_size: The amount of IDs leased at a time.
+		"""
+		self.path = str(path)
+		self.block_size = block_size
+		self.lock = threading.Lock()
+		self.next_id = self.block_end = 0
+		self.pid = None
+
+	def __call__(self):
+		with self.lock:
+			if self.pid != os.getpid():  # A forked process must not use the block of it's parent
+				self.next_id = self.block_end = 0
+				self.pid = os.getpid()
+			if self.next_id >= self.block_end:
+				self.next_id, self.block_end = self.lease()
+			self.next_id += 1
+			return self.next_id - 1
+
+	def lease(self):
+		"""
+		Leases the next block of IDs from the counter file.
+		:return: The first ID of the block, and the one after the last.
+		"""
+		fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			fcntl.flock(fd, fcntl.LOCK_EX)
+			data = os.pread(fd, COUNTER.size, 0)
+			if len(data) == COUNTER.size:
+				start, = COUNTER.unpack(data)
+			elif len(data) == LEGACY_COUNTER.size:
+				start = LEGACY_COUNTER.unpack(data)[0] + 1
+			else:
+				start = 0
+			os.pwrite(fd, COUNTER.pack(start + self.block_size), 0)
+		finally:
+			os.close(fd)  # Releases the lock
+		logger.debug(f'Leased IDs {start}-{start + self.block_size - 1}')
+		return start, start + self.block_size
+
+
+class SnowflakeGenerator:
+	def __init__(self, worker=None, workers_dir=WORKERS_DIR, epoch=EPOCH):
+		"""
+		:param worker: Optional - The number of the worker, by default leased from workers_dir.
+		:param epoch: The milliseconds from which the time is counted.
+		"""
+		self.worker = worker
+		self.workers_dir = workers_dir
+		self.lease = None  # The locked slot file of the worker number
+		self.epoch = epoch
+		self.lock = threading.Lock()
+		self.last = self.sequence = 0
+		self.pid = None
+
+	def __call__(self):
+		with self.lock:
+			if self.pid != os.getpid():
+				if self.pid is not None or self.worker is None:  # Forked processes need their own worker number
+					if self.lease is not None:  # The parent's, which it still holds
+						os.close(self.lease)
+					self.worker, self.lease = lease_worker(self.workers_dir)
+				self.pid = os.getpid()
+			now = max(int(time.time() * 1000) - self.epoch, self.last)  # Never backwards
+			if now == self.last:
+				self.sequence = (self.sequence + 1) % (1 << SEQUENCE_BITS)
+				if not self.sequence:  # The millisecond is exhausted
+					while now <= self.last:
+						now = int(time.time() * 1000) - self.epoch
+			else:
+				self.sequence = 0
+			self.last = now
+			return (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker << SEQUENCE_BITS) | self.sequence
+
+
+def lease_worker(directory):
+	"""
+	Leases the first free worker number, by locking it's slot file in the directory.
+	:return: The worker number, and the file descriptor which holds the lock (Until it's closed).
+	"""
+	os.makedirs(directory, exist_ok=True)
+	for worker in range(1 << WORKER_BITS):
+		fd = os.open(os.path.join(directory, str(worker)), os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:  # Held by a live process
+			os.close(fd)
+			continue
+		logger.debug(f'Leased worker number {worker}')
+		return worker, fd
+	raise RuntimeError(f'All the {1 << WORKER_BITS} worker numbers are leased')
+
 
+GENERATORS = {'block': BlockAllocator, 'snowflake': SnowflakeGenerator}
+_generator = BlockAllocator()
 
-def durable_id_generator():
-	counter = 0
-	target_path = str(COUNTER_FILE)
-	if not COUNTER_FILE.exists():
-		with open(target_path, 'wb') as fd:
-			fd.write(struct.pack('<L', counter))
-		yield counter
 
-	while True:
-		with open(target_path, 'rb') as fd:
-			counter, = struct.unpack('<L', fd.read(4))
-		counter += 1
-		with open(target_path, 'wb') as fd:
-			fd.write(struct.pack('<L', counter))
-		yield counter
+def configure_ids(mode='block', **kwargs):
+	"""
+	Selects how next_snapshot_id generates the IDs.
+	:param mode: block or snowflake.
+	:param kwargs: Passed to the generator (i.e. block_size)
+	"""
+	global _generator
+	_generator = GENERATORS[mode](**kwargs)
+	logger.info(f'Snapshot IDs are generated with {mode} mode')
 
 
-next_snapshot_id = durable_id_generator().__next__
+def next_snapshot_id():
+	return _generator()
@@ -0,0 +1,51 @@
+"""
+Measures the compression of the snapshot uploads: bytes on the wire and CPU cost per snapshot,
+for every content encoding and level.
+
+    $ python benchmarks/compression.py SAMPLE-PATH [-n 10] [-l 1 -l 6 -l 9]
+"""
+import itertools
+import time
+
+import click
+
+from MindReader import IOAccess
+from MindReader.protocol import encoding
+
+
+def measure(bodies, name, level):
+	"""
+	:return: The encoded size, and the CPU time of encoding and of decoding, per snapshot.
+	"""
+	start = time.process_time()
+	encoded = [encoding.encode(body, name, level) for body in bodies]
+	encode_time = time.process_time() - start
+
+	start = time.process_time()
+	for body in encoded:
+		encoding.decode(body, name)
+	decode_time = time.process_time() - start
+
+	amount = len(bodies)
+	return sum(map(len, encoded)) / amount, encode_time / amount, decode_time / amount
+
+
+@click.command()
+@click.argument('path')
+@click.option('-n', 'amount', type=int, default=10, help='Amount of snapshots to measure')
+@click.option('--scheme', default='gzip', help='Scheme to read the sample from (The samples are gzipped)')
+@click.option('-l', '--level', 'levels', type=click.IntRange(1, 9), multiple=True, default=[1, 6, 9])
+def main(path, amount, scheme, levels):
+	user, snapshots = IOAccess.read_url(path, 'sample', scheme=scheme)
+	bodies = [snapshot.SerializeToString() for snapshot in itertools.islice(snapshots, amount)]
+	raw_size = sum(map(len, bodies)) / len(bodies)
+
+	print(f'{len(bodies)} snapshots, {raw_size / 1024:.1f}KB per snapshot uncompressed')
+	for name, level in itertools.product(['deflate', 'gzip'], levels):
+		size, encode_time, decode_time = measure(bodies, name, level)
+		print(f'{name} level {level}: {size / 1024:.1f}KB ({size / raw_size:.1%}), '
+		      f'client {encode_time * 1000:.2f}ms, server {decode_time * 1000:.2f}ms per snapshot')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,74 @@
+"""
+Compares the depth image heatmap renderer to the matplotlib one it replaced.
+Prints the time per image of both, and how different their outputs are.
+
+    $ python benchmarks/heatmap.py [--height 172] [--width 224] [--repeat 20]
+"""
+import io
+import random
+import time
+
+import click
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+from PIL import Image
+
+from MindReader.parsers.depth_image import depth_image_parser, depth_values, FORMAT
+from MindReader.utils.protobuf import DepthImage
+
+matplotlib.use('Agg')
+
+
+def matplotlib_depth_image_parser(output, depth_image):
+	"""
+	The replaced implementation.
+	"""
+	heat_map_values = np.array(depth_image.data).reshape(depth_image.height, depth_image.width)
+	plt.imsave(output, heat_map_values, cmap='hot', format=FORMAT)
+
+
+def measure_conversion(convert, depth_image, repeat):
+	start = time.perf_counter()
+	for _ in range(repeat):
+		convert(depth_image)
+	return (time.perf_counter() - start) / repeat
+
+
+def measure(parser, depth_image, repeat):
+	start = time.perf_counter()
+	for _ in range(repeat):
+		with io.BytesIO() as output:
+			parser(output, depth_image)
+			result = output.getvalue()
+	return (time.perf_counter() - start) / repeat, result
+
+
+@click.command()
+@click.option('--height', type=int, default=172)
+@click.option('--width', type=int, default=224)
+@click.option('--repeat', type=int, default=20)
+def main(height, width, repeat):
+	depth_image = DepthImage(height=height, width=width)
+	depth_image.data.extend(20 * random.random() for _ in range(height * width))
+
+	old_time, old_output = measure(matplotlib_depth_image_parser, depth_image, repeat)
+	new_time, new_output = measure(depth_image_parser, depth_image, repeat)
+
+	old_pixels = np.asarray(Image.open(io.BytesIO(old_output)), dtype=np.int16)
+	new_pixels = np.asarray(Image.open(io.BytesIO(new_output)), dtype=np.int16)
+	difference = np.abs(old_pixels - new_pixels)
+
+	print(f'{height}x{width} depth image, {repeat} repeats')
+	print(f'matplotlib: {old_time * 1000:.2f}ms per image, {len(old_output)} bytes')
+	print(f'lookup table: {new_time * 1000:.2f}ms per image, {len(new_output)} bytes')
+	print(f'speedup: x{old_time / new_time:.1f}')
+	old_conversion = measure_conversion(lambda image: np.array(image.data), depth_image, repeat)
+	new_conversion = measure_conversion(depth_values, depth_image, repeat)
+	print(f'of which converting the data: {old_conversion * 1000:.2f}ms (matplotlib), '
+	      f'{new_conversion * 1000:.2f}ms (lookup table)')
+	print(f'pixel difference: mean {difference.mean():.3f}, max {difference.max()}')
+
+
+if __name__ == '__main__':
+	main()
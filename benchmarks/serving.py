@@ -0,0 +1,81 @@
+"""
+Measures the upload throughput of the listener: the development server, against pre-forked workers.
+Every upload is handled by a publisher which waits --latency milliseconds (i.e. the message queue confirmation).
+
+    $ python benchmarks/serving.py [-c 32] [-n 2000] [--size 100000] [--latency 5] [-w 4 -t 8]
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
+
+import click
+import requests
+
+from MindReader.protocol import listener
+
+HOST = '127.0.0.1'
+PORT = 8123
+
+
+def serve(workers, threads, latency):
+	def publish_snapshot(user_id, snapshot):
+		time.sleep(latency / 1000)
+
+	listener.config_publishers(snapshot_publisher=publish_snapshot)
+	listener.Listener(HOST, PORT, workers, threads)
+
+
+def measure(amount, concurrency, body):
+	"""
+	:return: Uploads per second.
+	"""
+	url = f'http://{HOST}:{PORT}/snapshot'
+	headers = {'UserId': '1', 'Content-Type': 'application/protobuf'}
+	local = threading.local()
+
+	def upload(_):
+		if not hasattr(local, 'session'):
+			local.session = requests.Session()
+		response = local.session.post(url, data=body, headers=headers)
+		response.raise_for_status()
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=concurrency) as executor:
+		list(executor.map(upload, range(amount)))
+	return amount / (time.perf_counter() - start)
+
+
+def wait_for_server():
+	for _ in range(50):
+		try:
+			requests.get(f'http://{HOST}:{PORT}/fields')
+			return
+		except requests.ConnectionError:
+			time.sleep(0.1)
+	raise RuntimeError('The server did not start')
+
+
+@click.command()
+@click.option('-c', '--concurrency', type=int, default=32, help='Amount of concurrent uploads')
+@click.option('-n', 'amount', type=int, default=2000, help='Amount of uploads for every mode')
+@click.option('--size', type=int, default=100000, help='Snapshot size (bytes)')
+@click.option('--latency', type=float, default=5, help='Milliseconds the publisher takes for each snapshot')
+@click.option('-w', '--workers', type=int, default=os.cpu_count())
+@click.option('-t', '--threads', type=int, default=8)
+def main(concurrency, amount, size, latency, workers, threads):
+	body = os.urandom(size)
+	for name, mode in [('development server', (None, 1)), (f'{workers} workers x {threads} threads', (workers, threads))]:
+		server = Process(target=serve, args=(*mode, latency))
+		server.start()
+		try:
+			wait_for_server()
+			print(f'{name}: {measure(amount, concurrency, body):.0f} uploads/s')
+		finally:
+			server.terminate()
+			server.join()
+
+
+if __name__ == '__main__':
+	main()
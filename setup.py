@@ -12,4 +12,7 @@ setup(
 	python_requires='>=3.6',
 	install_requires=required,
 	tests_require=['pytest'],
+	entry_points={
+		'console_scripts': ['mindreader-db=MindReader.Database.__main__:cli'],
+	},
 )
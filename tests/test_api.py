@@ -0,0 +1,50 @@
+import pytest
+
+from MindReader import api
+from MindReader.Database.database_mongo import MongoDatabase
+
+
+class FakeDatabase:
+	parse_cursor = staticmethod(MongoDatabase.parse_cursor)
+	snapshot_cursor = staticmethod(MongoDatabase.snapshot_cursor)
+
+	def __init__(self, amount):
+		self.snapshots = [{'timestamp': i, 'user_id': '1', 'snapshot_id': str(i)} for i in range(amount)]
+
+	def get_user(self, user_id):
+		return {'user_id': user_id, 'username': 'user'}
+
+	def get_snapshots_page(self, user_id, limit, after=None, before=None, fields=None):
+		start = 0 if after is None else int(self.parse_cursor(after)[1]) + 1
+		page = self.snapshots[start:] if limit is None else self.snapshots[start:start + limit]
+		return page, start + len(page) < len(self.snapshots)
+
+
+@pytest.fixture
+def client(monkeypatch):
+	monkeypatch.setattr(api, 'database_handler', FakeDatabase(api.MAX_POSTS + 5))
+	with api.app.test_client() as client:
+		yield client
+
+
+def test_snapshots_without_limit_returns_all(client):
+	response = client.get('/users/1/snapshots')
+	assert len(response.json) == api.MAX_POSTS + 5
+	assert api.NEXT_CURSOR_HEADER not in response.headers
+
+
+def test_snapshots_pages(client):
+	response = client.get('/users/1/snapshots?limit=20')
+	assert len(response.json) == 20
+	response = client.get(f'/users/1/snapshots?limit=20&after={response.headers[api.NEXT_CURSOR_HEADER]}')
+	assert [snapshot['snapshot_id'] for snapshot in response.json] == [str(i) for i in range(20, api.MAX_POSTS + 5)]
+
+
+@pytest.mark.parametrize('query', ['limit=many', 'limit=0', 'limit=-3', 'after=garbage', 'before=x_1'])
+def test_bad_page_args(client, query):
+	assert client.get(f'/users/1/snapshots?{query}').status_code == 400
+
+
+@pytest.mark.parametrize('query', ['page=abc', 'page=0', 'limit=x'])
+def test_bad_user_page_args(client, query):
+	assert client.get(f'/user?user_id=1&{query}').status_code == 400
@@ -1,8 +1,10 @@
 import io
 import itertools
+import os
 import struct
 
-from MindReader.client import publish_sample
+from MindReader import IOAccess
+from MindReader.client import publish_sample, publish_in_processes
 
 USER = None
 
@@ -35,3 +37,90 @@ def test_publish_sample(sample_factory):
 
 def string_to_message(st):
 	return struct.pack('<L', len(st)) + st
+
+
+def test_publish_sample_concurrently(sample_factory):
+	user, snapshots = sample_factory(20)
+	snapshots = list(snapshots)
+	data = string_to_message(user.SerializeToString())
+	for snapshot in snapshots:
+		data += string_to_message(snapshot.SerializeToString())
+	published = []
+
+	def publish_user(new_user):
+		def publish_snapshot(snapshot):
+			if snapshot == snapshots[3]:
+				raise ConnectionError('Couldn\'t upload snapshot')
+			published.append(snapshot.SerializeToString())
+
+		return publish_snapshot
+
+	with io.BytesIO() as fd:
+		fd.write(data)
+		fd.seek(0)
+		failures = publish_sample(fd, publish_user=publish_user, scheme='object', concurrency=4)
+
+	assert [index for index, _ in failures] == [3]
+	assert sorted(published) == sorted(snapshot.SerializeToString() for i, snapshot in enumerate(snapshots) if i != 3)
+
+
+def test_publish_batches_concurrently(sample_factory, caplog):
+	user, snapshots = sample_factory(20)
+	snapshots = list(snapshots)
+	data = string_to_message(user.SerializeToString())
+	for snapshot in snapshots:
+		data += string_to_message(snapshot.SerializeToString())
+
+	def publish_user(new_user):
+		def publish_snapshot(batch):
+			if snapshots[0] in batch:
+				raise ConnectionError('Couldn\'t upload batch')
+
+		publish_snapshot.batch_size = 8
+		return publish_snapshot
+
+	with io.BytesIO(data) as fd, caplog.at_level('INFO', logger='client'):
+		failures = publish_sample(fd, publish_user=publish_user, scheme='object', concurrency=2)
+
+	assert [index for index, _ in failures] == [0]
+	assert 'Total of 12 snapshots had been uploaded, 8 failed' in caplog.text
+
+
+class FileConnection:
+	"""
+	Picklable connection, which appends the snapshots to a file per process.
+	"""
+
+	def __init__(self, directory):
+		self.directory = directory
+
+	def publisher(self):
+		def publish_snapshot(snapshot):
+			with open(self.directory / str(os.getpid()), 'ab') as fd:
+				fd.write(string_to_message(snapshot.SerializeToString()))
+
+		return publish_snapshot
+
+
+def test_publish_in_processes(sample_factory, tmp_path):
+	user, snapshots = sample_factory(30)
+	snapshots = list(snapshots)
+	path = tmp_path / 'sample'
+	with open(path, 'wb') as fd:
+		IOAccess.write(fd, 'sample', user, snapshots)
+	uploads = tmp_path / 'uploads'
+	uploads.mkdir()
+	registered = []
+
+	def connect(new_user):
+		registered.append(new_user)
+		return FileConnection(uploads)
+
+	failures = publish_in_processes(str(path), connect, 3, sample_format='mmap')
+
+	assert failures == [] and len(registered) == 1
+	published = []
+	for upload in uploads.iterdir():
+		with open(upload, 'rb') as fd:
+			published.extend(IOAccess.read(fd, 'messages'))
+	assert sorted(published) == sorted(snapshot.SerializeToString() for snapshot in snapshots)
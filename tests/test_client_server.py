@@ -1,14 +1,22 @@
 """
 Testing the transfer of sample from a user to server
 """
+import asyncio
+import concurrent.futures
 import io
 import itertools
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
 from threading import Thread
 import signal
+import socket
 import os
+from pathlib import Path
 
+import pytest
+import requests
 from google.protobuf.json_format import MessageToDict
 
 from MindReader import IOAccess
@@ -45,3 +53,349 @@ def test_client_server(server, sample_factory):
 	                                       use_integers_for_enums=True)
 	for snapshot1, snapshot2 in zip(compare_snapshots, published_snapshots):
 		assert snapshot1.SerializeToString() == snapshot2
+
+
+def test_upload_snapshots_batch(monkeypatch):
+	from MindReader.protocol import listener
+	stored = []
+
+	def publish_snapshots(user_id, snapshots):
+		snapshots = list(snapshots)  # Read as it's iterated
+		stored.extend(snapshot['data'] for snapshot in snapshots)
+		return [None if snapshot['data'] != b'bad' else ('Invalid snapshot', 400) for snapshot in snapshots]
+
+	monkeypatch.setattr(listener, 'handle_snapshots', publish_snapshots)
+	with io.BytesIO() as body:
+		IOAccess.write(body, 'messages', [b'first', b'bad', b'second'])
+		body = body.getvalue()
+	headers = {'UserId': '1', 'Content-Type': 'application/protobuf', 'Idempotency-Key': 'batch'}
+
+	with listener.app.test_client() as client:
+		assert client.get('/fields').json['max_batch'] == listener.MAX_BATCH_SIZE
+		response = client.post('/snapshots', data=body, headers=headers)
+		assert [status['status'] for status in response.json] == [200, 400, 200]
+		response = client.post('/snapshots', data=body, headers=headers)  # Retry stores only the rejected one
+		assert [status['status'] for status in response.json] == [200, 400, 200]
+	assert stored == [b'first', b'bad', b'second', b'bad']
+
+
+def test_upload_compressed_snapshot(monkeypatch):
+	from MindReader.protocol import listener, encoding
+	stored = []
+	monkeypatch.setattr(listener, 'handle_snapshot', lambda user_id, snapshot: stored.append(snapshot['data']))
+	monkeypatch.setattr(listener, 'handle_user', lambda user: None)
+	headers = {'UserId': '1', 'Content-Type': 'application/protobuf'}
+
+	with listener.app.test_client() as client:
+		response = client.post('/register', data='{}', content_type='application/json')
+		assert 'gzip' in response.headers['Accept-Encoding']
+		for name in ('gzip', 'deflate'):
+			response = client.post('/snapshot', data=encoding.encode(b'snapshot', name),
+			                       headers={**headers, 'Content-Encoding': name})
+			assert response.status_code == 200
+		response = client.post('/snapshot', data=b'snapshot', headers={**headers, 'Content-Encoding': 'br'})
+		assert response.status_code == 415
+	assert stored == [b'snapshot', b'snapshot']
+
+
+def test_upload_compression_bomb(monkeypatch):
+	from MindReader.protocol import listener, encoding
+	stored = []
+	monkeypatch.setattr(listener, 'MAX_BODY_SIZE', 1000)
+	monkeypatch.setattr(listener, 'MAX_STREAMED_BODY_SIZE', 1000)
+	monkeypatch.setattr(listener, 'handle_snapshot', lambda user_id, snapshot: stored.append(b''.join(
+		snapshot['chunks']) if 'chunks' in snapshot else snapshot['data']))
+	headers = {'UserId': '1', 'Content-Type': 'application/protobuf', 'Content-Encoding': 'gzip'}
+	bomb = encoding.encode(b'\xff' * 100000, 'gzip')  # As a batch, a message of 4GB
+
+	with listener.app.test_client() as client:
+		for stream in (False, True):
+			monkeypatch.setattr(listener, 'stream_bodies', stream)
+			assert client.post('/snapshot', data=bomb, headers=headers).status_code == 413
+			assert client.post('/snapshots', data=bomb, headers=headers).status_code == 413
+	assert stored == []
+
+
+def test_prefork_server():
+	from MindReader.utils import prefork
+	workers = []
+
+	def initializer():
+		workers.append(os.getpid())
+
+	def app(environ, start_response):
+		start_response('200 OK', [('Content-Type', 'text/plain')])
+		return [str(workers).encode()]
+
+	server = prefork.PreforkServer(app, '127.0.0.1', 0, workers=2, threads=2, initializer=initializer)
+	process = Process(target=server.serve_forever)
+	process.start()
+	server.socket.close()  # The workers keep their own
+	try:
+		with ThreadPoolExecutor(max_workers=8) as executor:
+			answers = list(executor.map(lambda _: requests.get(f'http://127.0.0.1:{server.address[1]}/').text,
+			                            range(32)))
+	finally:
+		process.terminate()
+		process.join(timeout=5)
+	assert process.exitcode == 0
+	assert all(answer.startswith('[') and answer != '[]' for answer in answers)  # Initialized in every worker
+	assert str([os.getpid()]) not in answers
+
+
+def test_prefork_keep_alive():
+	import http.client
+	from MindReader.utils import prefork
+
+	def app(environ, start_response):
+		body = environ['wsgi.input'].read() if environ['PATH_INFO'] == '/echo' else b'ignored'
+		start_response('200 OK', [('Content-Type', 'text/plain')])
+		return [body]
+
+	server = prefork.PreforkServer(app, '127.0.0.1', 0, workers=1, threads=1)
+	process = Process(target=server.serve_forever)
+	process.start()
+	server.socket.close()
+	try:
+		connection = http.client.HTTPConnection('127.0.0.1', server.address[1], timeout=5)
+		answers, sockets = [], set()
+		for path in ['/echo', '/skip', '/echo']:  # The body of /skip is never read by the app
+			connection.request('POST', path, body=path.encode())
+			sockets.add(connection.sock)
+			response = connection.getresponse()
+			answers.append((response.version, response.read()))
+		connection.close()
+	finally:
+		process.terminate()
+		process.join(timeout=5)
+	assert answers == [(11, b'/echo'), (11, b'ignored'), (11, b'/echo')]
+	assert len(sockets) == 1  # All on one connection
+
+
+def test_prefork_gives_up_on_failing_workers(monkeypatch):
+	from MindReader.utils import prefork
+	monkeypatch.setattr(prefork, 'RESPAWN_DELAY', 0.01)
+	monkeypatch.setattr(prefork, 'MAX_FAILURES', 3)
+
+	def initializer():
+		raise RuntimeError('No database')
+
+	server = prefork.PreforkServer(None, '127.0.0.1', 0, workers=2, initializer=initializer)
+	process = Process(target=server.serve_forever)
+	process.start()
+	server.socket.close()
+	process.join(timeout=5)
+	assert process.exitcode == 1  # Gave up instead of forking forever
+
+
+def test_segments_reject_field_manifest(monkeypatch, tmp_path, caplog):
+	from click.testing import CliRunner
+	from MindReader import server
+	started = []
+	monkeypatch.setattr(server, 'run_server_publisher', lambda *args, **kwargs: started.append(args))
+
+	result = CliRunner().invoke(server.cli, ['run-server', 'rabbitmq://localhost:5672', '--data-dir', str(tmp_path),
+	                                         '--storage', 'segments', '--field-manifest'])
+	assert result.exit_code == 0
+	assert not started
+	assert '--field-manifest is supported only with --storage directories' in caplog.text
+
+
+async def close_server(server):
+	server.close()
+	connections = asyncio.all_tasks() - {asyncio.current_task()}
+	for connection in connections:
+		connection.cancel()
+	await asyncio.gather(*connections, return_exceptions=True)
+
+
+def test_async_listener():
+	from MindReader.protocol import AsyncListener, Connection, encoding
+	users, stored, published = [], [], []
+
+	def store_snapshot(user_id, snapshot):
+		stored.append((user_id, snapshot['data']))
+		return f'{user_id}/{len(stored)}'
+
+	def publish_snapshot(path):
+		confirmation = concurrent.futures.Future()
+		confirmation.set_result(None)
+		published.append(path)
+		return confirmation
+
+	async_listener = AsyncListener(users.append, store_snapshot, publish_snapshot, max_body=64)
+	loop = asyncio.new_event_loop()
+	server = loop.run_until_complete(async_listener.start('127.0.0.1', 0))
+	thread = Thread(target=loop.run_forever, daemon=True)
+	thread.start()
+	try:
+		port = server.sockets[0].getsockname()[1]
+		connection = Connection(f'127.0.0.1:{port}', {'user_id': 1, 'username': 'user'}, compression='gzip')
+		assert connection.batch_size is None and connection.encoding == 'gzip'
+		connection.upload(b'')
+		connection.upload(b'\x08\x01')
+		response = requests.post(f'http://127.0.0.1:{port}/snapshot', data=b'x' * 100,
+		                         headers={'UserId': '1', 'Content-Type': 'application/protobuf'})
+		assert response.status_code == 413
+		bomb = encoding.encode(bytes(1000), 'gzip')  # Small, until it's decoded
+		assert len(bomb) < 64
+		response = requests.post(f'http://127.0.0.1:{port}/snapshot', data=bomb, headers={
+			'UserId': '1', 'Content-Type': 'application/protobuf', 'Content-Encoding': 'gzip'})
+		assert response.status_code == 413
+	finally:
+		asyncio.run_coroutine_threadsafe(close_server(server), loop).result()
+		loop.call_soon_threadsafe(loop.stop)
+		thread.join()
+		loop.close()
+	assert len(users) == 1
+	assert stored == [('1', b''), ('1', b'\x08\x01')]
+	assert published == ['1/1', '1/2']
+
+
+def test_async_listener_body_timeout(monkeypatch):
+	from MindReader.protocol import AsyncListener, async_listener
+	monkeypatch.setattr(async_listener, 'BODY_TIMEOUT', 0.2)
+	loop = asyncio.new_event_loop()
+	server = loop.run_until_complete(AsyncListener().start('127.0.0.1', 0))
+	thread = Thread(target=loop.run_forever, daemon=True)
+	thread.start()
+	try:
+		port = server.sockets[0].getsockname()[1]
+		with socket.create_connection(('127.0.0.1', port), timeout=5) as client:
+			client.sendall(b'POST /snapshot HTTP/1.1\r\nUserId: 1\r\nContent-Length: 10\r\n\r\nab')  # Trickles
+			answer = client.recv(1024)
+	finally:
+		asyncio.run_coroutine_threadsafe(close_server(server), loop).result()
+		loop.call_soon_threadsafe(loop.stop)
+		thread.join()
+		loop.close()
+	assert answer.startswith(b'HTTP/1.1 408 ')
+
+
+def test_stream_snapshot_to_disk(monkeypatch, tmp_path, snapshot_factory):
+	from MindReader.protocol import listener, encoding
+	from MindReader.server import store_snapshot
+	from MindReader.IOAccess.field_manifest import load_manifest
+	from MindReader.utils.protobuf import Snapshot, field_numbers, keep_fields
+	data = snapshot_factory().SerializeToString()
+	stored = []
+
+	def publish_snapshot(user_id, snapshot):
+		assert 'data' not in snapshot
+		stored.append(store_snapshot(user_id, snapshot, tmp_path, fields=['pose'], manifest=True))
+
+	monkeypatch.setattr(listener, 'stream_bodies', True)
+	monkeypatch.setattr(listener, 'handle_snapshot', publish_snapshot)
+	headers = {'UserId': '1', 'Content-Type': 'application/protobuf', 'Content-Encoding': 'gzip'}
+	body = encoding.encode(data, 'gzip')
+
+	with listener.app.test_client() as client:
+		assert client.post('/snapshot', data=body, headers=headers).status_code == 200
+		assert client.post('/snapshot', data=body[:len(body) // 2], headers=headers).status_code == 415
+
+	path, = stored
+	assert path.read_bytes() == keep_fields(data, field_numbers(Snapshot, {'pose', 'datetime'}))
+	assert set(load_manifest(path)) <= {'pose', 'datetime'}
+	assert list((tmp_path / '1').iterdir()) == [path.parent]  # Nothing left of the corrupted one
+	assert sorted(stored_file.name for stored_file in path.parent.iterdir()) == [path.name, path.name + '.manifest']
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_batch_with_malformed_snapshot(monkeypatch, tmp_path, stream):
+	from MindReader import server
+	from MindReader.protocol import listener
+	monkeypatch.setattr(listener, 'stream_bodies', stream)
+
+	class FakeMQ:
+		published = []
+
+		def publish_snapshot(self, path, wait=True):
+			self.published.append(path)
+
+	mq = FakeMQ()
+	monkeypatch.setattr(listener, 'handle_snapshots', lambda user_id, snapshots: server.handle_snapshots(
+		user_id, snapshots, tmp_path, mq, fields=['pose']))
+	with io.BytesIO() as body:
+		IOAccess.write(body, 'messages', [b'\x08\x01', b'\x12\xff', b'\x08\x02'])  # The second is truncated
+		body = body.getvalue()
+	headers = {'UserId': '1', 'Content-Type': 'application/protobuf', 'Idempotency-Key': f'malformed-batch-{stream}'}
+
+	with listener.app.test_client() as client:
+		for _ in range(2):  # The retry stores only the rejected one
+			response = client.post('/snapshots', data=body, headers=headers)
+			assert response.status_code == 200
+			assert [status['status'] for status in response.json] == [200, 400, 200]
+	assert len(mq.published) == 2
+	assert sorted(path.name for path in (tmp_path / '1').iterdir()) == sorted(
+		str(Path(path).parent.name) for path in mq.published)  # Nothing left of the malformed one
+
+
+def test_streamed_batch_limit(monkeypatch, tmp_path):
+	from MindReader.protocol import listener
+	stored = []
+	monkeypatch.setattr(listener, 'stream_bodies', True)
+	monkeypatch.setattr(listener, 'MAX_BATCH_SIZE', 2)
+	monkeypatch.setattr(listener, 'handle_snapshot', lambda user_id, snapshot: stored.append(b''.join(
+		snapshot['chunks'])))
+	headers = {'UserId': '1', 'Content-Type': 'application/protobuf'}
+
+	with listener.app.test_client() as client:
+		with io.BytesIO() as body:
+			IOAccess.write(body, 'messages', [b'first', b'second'])
+			response = client.post('/snapshots', data=body.getvalue()[:-1], headers=headers)
+		assert response.status_code == 400  # Truncated
+		with io.BytesIO() as body:
+			IOAccess.write(body, 'messages', [b'first', b'second', b'third'])
+			response = client.post('/snapshots', data=body.getvalue(), headers=headers)
+		assert response.status_code == 413
+
+
+def test_batch_with_unconfirmed_snapshot(monkeypatch, tmp_path):
+	from MindReader import server
+	from MindReader.protocol import listener
+
+	class FakeMQ:
+		CONFIRM_TIMEOUT = 1
+		published = []
+
+		def publish_snapshot(self, path, wait=True):
+			self.published.append(path)
+			confirmation = concurrent.futures.Future()
+			if len(self.published) == 2:  # The broker didn't take the second one
+				confirmation.set_exception(ConnectionError('The message queue isn\'t reachable'))
+			else:
+				confirmation.set_result(None)
+			return confirmation
+
+	mq = FakeMQ()
+	monkeypatch.setattr(listener, 'handle_snapshots', lambda user_id, snapshots: server.handle_snapshots(
+		user_id, snapshots, tmp_path, mq))
+	with io.BytesIO() as body:
+		IOAccess.write(body, 'messages', [b'\x08\x01', b'\x08\x02'])
+		body = body.getvalue()
+	headers = {'UserId': '1', 'Content-Type': 'application/protobuf', 'Idempotency-Key': 'unconfirmed-batch'}
+
+	with listener.app.test_client() as client:
+		response = client.post('/snapshots', data=body, headers=headers)
+		assert [status['status'] for status in response.json] == [200, 503]
+		response = client.post('/snapshots', data=body, headers=headers)  # Only the unconfirmed one is sent again
+		assert [status['status'] for status in response.json] == [200, 200]
+	assert len(mq.published) == 3
+
+
+@pytest.mark.parametrize('segmented', [False, True])
+def test_malformed_snapshot(monkeypatch, tmp_path, segmented):
+	from MindReader.protocol import listener
+	from MindReader.server import store_snapshot
+	segments = IOAccess.SegmentStore(tmp_path) if segmented else None
+
+	monkeypatch.setattr(listener, 'handle_snapshot', lambda user_id, snapshot: store_snapshot(
+		user_id, snapshot, tmp_path, fields=['pose'], segments=segments) and None)
+	headers = {'UserId': '1', 'Content-Type': 'application/protobuf'}
+
+	with listener.app.test_client() as client:
+		for body in [b'\x12\xff', b'\x08']:  # Truncated value, truncated varint
+			response = client.post('/snapshot', data=body, headers=headers)
+			assert response.status_code == 400
+			assert b'Truncated message' in response.data
+	assert list(tmp_path.iterdir()) == []  # Not even the user's directory
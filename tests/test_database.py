@@ -0,0 +1,79 @@
+import json
+
+import mongomock
+import pymongo
+import pytest
+
+from MindReader.Database.database_mongo import MongoDatabase
+
+SNAPSHOT = {'user_id': '1', 'timestamp': 5, 'snapshot_id': '2'}
+
+
+@pytest.fixture
+def database(monkeypatch):
+	database = object.__new__(MongoDatabase)
+	database.db = mongomock.MongoClient().db
+	snapshots = database.db.snapshots
+	bulk_write = snapshots.bulk_write
+
+	def strict_bulk_write(requests, ordered=True):
+		# Unlike mongomock, mongo can't set a field inside a string
+		errors = [{'index': index, 'code': MongoDatabase.PATH_NOT_VIABLE} for index, request in enumerate(requests)
+		          if any(key.startswith('result.') for key in request._doc.get('$set', {}))
+		          and isinstance((snapshots.find_one(request._filter) or {}).get('result'), str)]
+		if errors:
+			raise pymongo.errors.BulkWriteError({'writeErrors': errors})
+		return bulk_write(requests, ordered=ordered)
+
+	monkeypatch.setattr(snapshots, 'bulk_write', strict_bulk_write)
+	return database
+
+
+def test_save_to_legacy_string_results(database):
+	database.db.snapshots.insert_one({**SNAPSHOT, 'result': json.dumps({'pose': {'x': 1}})})
+	database.save_many([('feelings', {**SNAPSHOT, 'result': {'feelings': {'hunger': 1}}})])
+	assert database.db.snapshots.find_one({}, {'_id': 0})['result'] == {'pose': {'x': 1}, 'feelings': {'hunger': 1}}
+
+
+def test_get_legacy_string_result(database):
+	database.db.users.insert_one({'user_id': '1', 'username': 'user'})
+	database.db.snapshots.insert_one({**SNAPSHOT, 'result': json.dumps({'pose': {'x': 1}})})
+	user, snapshot, result = database.get_snapshot_result('1', '2', 'pose')
+	assert result == {'x': 1} and snapshot['result'] == {'pose': {'x': 1}}
+	assert database.get_snapshot_result('1', '2', 'feelings')[2] is None
+
+
+def test_ensure_indexes(database, monkeypatch):
+	database.db.users.insert_many([{'user_id': '1', 'username': 'user'}, {'user_id': '1', 'username': 'copy'}])
+	missing = database.ensure_indexes()
+	assert missing == [('users', MongoDatabase.INDEXES['users'][0][0])]  # Duplicates prevent the unique index
+	assert database.ensure_indexes() == missing
+
+	database.db.users.delete_one({'username': 'copy'})
+	assert database.ensure_indexes() == []
+
+	def coll_stats(command, collection):  # collStats isn't implemented by mongomock
+		count = database.db[collection].count_documents({})
+		return {'count': count, 'size': count * 100, 'storageSize': 4096,
+		        'indexSizes': {name: 10 for name in database.db[collection].index_information()}}
+
+	monkeypatch.setattr(database.db, 'command', coll_stats)
+	stats = database.stats()
+	assert stats.keys() == MongoDatabase.INDEXES.keys()
+	assert stats['users']['count'] == 1 and stats['snapshots']['count'] == 0
+	indexes = stats['snapshots']['indexes'].values()
+	assert len(indexes) == 1 + len(MongoDatabase.INDEXES['snapshots'])  # Including _id's index
+	assert sum(index['unique'] for index in indexes) == 1 and all(index['size'] == 10 for index in indexes)
+
+
+def test_migrate_results(database):
+	results = [{'pose': {'x': index}} for index in range(5)]
+	database.db.snapshots.insert_many([{**SNAPSHOT, 'snapshot_id': str(index), 'result': json.dumps(result)}
+	                                   for index, result in enumerate(results)])
+	database.db.snapshots.insert_one({**SNAPSHOT, 'snapshot_id': '5', 'result': {'feelings': {'hunger': 1}}})
+
+	assert database.migrate_results(batch_size=2) == 5
+	migrated = database.db.snapshots.find({}, {'_id': 0}).sort('snapshot_id')
+	assert [snapshot['result'] for snapshot in migrated] == results + [{'feelings': {'hunger': 1}}]
+	assert database.migrate_results(batch_size=2) == 0
+	assert database.db.snapshots.count_documents({'result': {'$type': 'string'}}) == 0
@@ -0,0 +1,123 @@
+import pytest
+
+from MindReader import IOAccess
+from MindReader.IOAccess import Drivers
+
+
+class FakeResponse:
+	status_code = 200
+	text = '["pose"]'
+
+
+class FakeSession:
+	def __init__(self):
+		self.requests = []
+
+	def get(self, url, headers, timeout=None):
+		self.requests.append(('GET', url))
+		return FakeResponse()
+
+	def post(self, url, data, headers, timeout=None):
+		self.requests.append(('POST', url, data))
+		return FakeResponse()
+
+
+@pytest.fixture
+def fake_session():
+	session = Drivers.configure_session(session=FakeSession())
+	yield session
+	Drivers.configure_session()
+
+
+def test_drivers_share_session(fake_session):
+	IOAccess.read_url('http://localhost:8000/fields', 'messages', driver_kwargs={'mode': 'r'}).close()
+	IOAccess.write_url('http://localhost:8000/snapshot', 'post', b'body', driver_kwargs={'mode': 'wb'})
+	assert fake_session.requests == [('GET', 'http://localhost:8000/fields'),
+	                                 ('POST', 'http://localhost:8000/snapshot', b'body')]
+
+
+def test_session_pool_size():
+	session = Drivers.configure_session(pool_size=32)
+	assert session.get_adapter('http://localhost')._pool_maxsize == 32
+	assert Drivers.shared_session() is session
+	Drivers.configure_session()
+
+
+def test_get_snapshots_follows_pages():
+	from click.testing import CliRunner
+	from MindReader import cli
+
+	class PagedSession(FakeSession):
+		pages = {None: ('[1, 2]', {cli.NEXT_CURSOR_HEADER: 'a'}), 'a': ('[3, 4]', {cli.NEXT_CURSOR_HEADER: 'b'}),
+		         'b': ('[5]', {})}
+
+		def get(self, url, headers, timeout=None):
+			self.requests.append(('GET', url))
+			response = FakeResponse()
+			response.text, response.headers = self.pages[url.split('&after=')[1] if '&after=' in url else None]
+			return response
+
+	session = Drivers.configure_session(session=PagedSession())
+	try:
+		result = CliRunner().invoke(cli.cli, ['get-snapshots', '1'])
+	finally:
+		Drivers.configure_session()
+	assert result.output.strip() == '[1, 2, 3, 4, 5]'
+	assert len(session.requests) == 3
+
+
+def test_connection_requests_time_out():
+	from MindReader.protocol import Connection
+
+	class TimedSession(FakeSession):
+		timeouts = []
+
+		def get(self, url, headers, timeout=None):
+			self.timeouts.append(timeout)
+			response = FakeResponse()
+			response.text = '{"max_batch": 1}'
+			return response
+
+		def post(self, url, data, headers, timeout=None):
+			self.timeouts.append(timeout)
+			response = FakeResponse()
+			response.headers, response.json = {}, lambda: ['pose']
+			return response
+
+	session = Drivers.configure_session(session=TimedSession())
+	try:
+		Connection('localhost:8000', {'user_id': 1, 'username': 'user'}).upload(b'\x08\x01')
+	finally:
+		Drivers.configure_session()
+	assert session.timeouts == [Connection.TIMEOUT] * 3  # Registration, configuration and upload
+
+
+def test_upload_retries_back_off(monkeypatch):
+	from MindReader.protocol import Connection
+	from MindReader.protocol import connection as connection_module
+
+	class FailingSession(FakeSession):
+		statuses = [503, 503, 200]
+
+		def get(self, url, headers, timeout=None):
+			response = FakeResponse()
+			response.text = '{"max_batch": 1}'
+			return response
+
+		def post(self, url, data, headers, timeout=None):
+			response = FakeResponse()
+			if url.endswith(Connection.UPLOAD_SNAPSHOT):
+				self.requests.append(headers[Connection.IDEMPOTENCY_HEADER])
+				response.status_code = self.statuses.pop(0)
+			response.headers, response.json, response.text = {}, lambda: ['pose'], ''
+			return response
+
+	delays = []
+	monkeypatch.setattr(connection_module.time, 'sleep', delays.append)
+	session = Drivers.configure_session(session=FailingSession())
+	try:
+		Connection('localhost:8000', {'user_id': 1, 'username': 'user'}).upload(b'\x08\x01')
+	finally:
+		Drivers.configure_session()
+	assert delays == [Connection.RETRY_DELAY, Connection.RETRY_DELAY * 2]
+	assert len(session.requests) == 3 and len(set(session.requests)) == 1  # The same key on every try
@@ -0,0 +1,239 @@
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pika
+import pytest
+
+from MindReader.MessageQueue import rabbitmq
+
+
+class FakeChannel:
+	def __init__(self):
+		self.is_open = True
+		self.published = []
+		self.committed = []
+
+	def tx_select(self):
+		pass
+
+	def tx_commit(self):
+		self.committed.append(list(self.published))
+
+	def queue_declare(self, *args, **kwargs):
+		pass
+
+	def exchange_declare(self, *args, **kwargs):
+		pass
+
+	def basic_publish(self, **kwargs):
+		self.published.append(kwargs['body'])
+
+
+class FakeConnection:
+	opened = []
+
+	def __init__(self, parameters):
+		self.is_open = True
+		self.lost = False  # Closed by the broker, which is found only on the next I/O
+		self.fake_channel = FakeChannel()
+		self.opened.append(self)
+
+	def channel(self):
+		return self.fake_channel
+
+	def close(self):
+		self.is_open = False
+
+	def process_data_events(self, time_limit=None):
+		if self.lost:
+			self.is_open = False
+			raise pika.exceptions.StreamLostError('Transport indicated EOF')
+
+	def call_later(self, delay, callback):
+		return callback
+
+	def remove_timeout(self, timer):
+		pass
+
+
+@pytest.fixture
+def fake_rabbitmq(monkeypatch):
+	FakeConnection.opened = []
+	monkeypatch.setattr(pika, 'BlockingConnection', FakeConnection)
+	monkeypatch.setattr(rabbitmq.RabbitMQ, 'RECONNECT_DELAY', 0)
+	return rabbitmq.RabbitMQ('localhost', pool_size=2)
+
+
+def test_publish_reuses_connection(fake_rabbitmq):
+	for i in range(5):
+		fake_rabbitmq.publish_snapshot(f'snapshot{i}')
+	# One for consuming, one for publishing
+	assert len(FakeConnection.opened) == 2
+	assert len(FakeConnection.opened[1].fake_channel.published) == 5
+	assert fake_rabbitmq.reconnects == 0
+
+
+def test_publish_reconnects(fake_rabbitmq):
+	fake_rabbitmq.publish_snapshot('first')
+	FakeConnection.opened[1].is_open = False
+	fake_rabbitmq.publish_snapshot('second')
+
+	assert len(FakeConnection.opened) == 3
+	assert FakeConnection.opened[2].fake_channel.published == ['second']
+	assert fake_rabbitmq.reconnects == 1
+
+
+def test_pool_is_bounded():
+	pool = rabbitmq.ChannelPool(None, 2)
+	pool._open = lambda: (FakeConnection(None), FakeChannel())
+	first, second = pool.acquire(), pool.acquire()
+	assert pool._opened == 2
+	pool.release(first)
+	assert pool.acquire() == first
+
+
+def test_pool_drops_stale_channel():
+	pool = rabbitmq.ChannelPool(None, 1)
+	pool._open = lambda: (FakeConnection(None), FakeChannel())
+	stale = pool.acquire()
+	pool.release(stale)
+	stale[0].lost = True  # Still is_open
+	fresh = pool.acquire()
+	assert fresh is not stale and pool.reconnects == 1
+
+
+def test_invalidate_wakes_waiter():
+	pool = rabbitmq.ChannelPool(None, 1)
+	pool._open = lambda: (FakeConnection(None), FakeChannel())
+	broken = pool.acquire()
+	acquired = []
+	waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+	waiter.start()
+	time.sleep(0.05)
+	assert not acquired  # The pool is full
+	pool.invalidate(broken)
+	waiter.join(timeout=1)
+	assert len(acquired) == 1 and acquired[0] != broken
+
+
+def test_batched_publish(monkeypatch):
+	FakeConnection.opened = []
+	monkeypatch.setattr(pika, 'BlockingConnection', FakeConnection)
+	mq = rabbitmq.RabbitMQ('localhost', confirm_batch=3, confirm_interval=1)
+
+	confirmations = [mq.publish_snapshot(f'snapshot{i}', wait=False) for i in range(3)]
+	confirmations[-1].result(timeout=1)
+	mq.publish_snapshot('last')
+	mq.close()
+
+	channel = FakeConnection.opened[1].fake_channel
+	assert all(confirmation.done() for confirmation in confirmations)
+	assert channel.committed == [['snapshot0', 'snapshot1', 'snapshot2'],
+	                             ['snapshot0', 'snapshot1', 'snapshot2', 'last']]
+
+
+def test_batch_publisher_survives_failed_batch(monkeypatch):
+	FakeConnection.opened = []
+	monkeypatch.setattr(pika, 'BlockingConnection', FakeConnection)
+	mq = rabbitmq.RabbitMQ('localhost', confirm_batch=1, confirm_interval=0)
+
+	def unserializable(channel):
+		raise TypeError('Not serializable')
+
+	failed = mq.batcher.publish(unserializable)
+	with pytest.raises(TypeError):
+		failed.result(timeout=1)
+	mq.publish_snapshot('next')  # The publishing thread is still alive
+	mq.close()
+	assert FakeConnection.opened[-1].fake_channel.committed == [['next']]
+
+
+def test_parsers_share_prefetch(fake_rabbitmq):
+	qos = []
+	fake_rabbitmq.channel.basic_qos = lambda **kwargs: qos.append(kwargs)
+	fake_rabbitmq.channel.queue_bind = fake_rabbitmq.channel.basic_consume = lambda **kwargs: None
+	for name in ('pose', 'feelings'):
+		fake_rabbitmq.run_parser(name, lambda path, result_name: None, start_consuming=False, prefetch=4)
+	assert qos == [{'prefetch_count': 4, 'global_qos': True}] * 2  # 4 un-acked snapshots on the channel, not 8
+
+
+def test_run_handler_in_executor():
+	class Connection:
+		def add_callback_threadsafe(self, callback):
+			callback()
+
+	channel = FakeChannel()
+	channel.connection = Connection()
+	results = []
+	with ProcessPoolExecutor(max_workers=1) as executor:
+		rabbitmq.RabbitMQ.run_handler(channel, 1, executor, results.append, pow, 2, 10)
+	assert results == [1024]
+
+
+def test_saver_buffer_batches():
+	class Saver:
+		def __init__(self):
+			self.users, self.batches = [], []
+
+		def save_user(self, user):
+			self.users.append(user)
+
+		def save_many(self, results):
+			self.batches.append(results)
+
+	class Channel:
+		connection = FakeConnection(None)
+		acked = []
+
+		def basic_ack(self, delivery_tag, multiple):
+			self.acked.append((delivery_tag, multiple))
+
+	saver, channel = Saver(), Channel()
+	buffer = rabbitmq.SaverBuffer(saver, 3, 1)
+	buffer.reset(channel)
+
+	user = {'user_id': 1, 'gender': 0, 'birthday': 0}
+	buffer.add(channel, 1, {'name': 'pose', 'save': {'result': 1}})
+	buffer.add(channel, 2, user)
+	assert saver.batches == [] and channel.acked == []
+
+	buffer.add(channel, 3, {'name': 'feelings', 'save': {'result': 2}})
+	assert saver.users == [user]
+	assert saver.batches == [[('pose', {'result': 1}), ('feelings', {'result': 2})]]
+	assert channel.acked == [(3, True)]
+
+
+def test_saver_buffer_drops_poison_messages():
+	class Saver:
+		saved = []
+
+		def save_many(self, results):
+			if any(name == 'poison' for name, _ in results):
+				raise ValueError('Can\'t be saved')
+			self.saved.extend(results)
+
+	class Channel:
+		connection = FakeConnection(None)
+
+		def __init__(self):
+			self.acked, self.nacked = [], []
+
+		def basic_ack(self, delivery_tag, multiple=False):
+			self.acked.append(delivery_tag)
+
+		def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+			self.nacked.append((delivery_tag, multiple, requeue))
+
+	messages = [{'name': 'pose', 'save': 1}, {'name': 'poison', 'save': 2}]
+	saver, channel = Saver(), Channel()
+	buffer = rabbitmq.SaverBuffer(saver, 2, 1)
+	buffer.reset(channel)
+	for tag, message in enumerate(messages, 1):
+		buffer.add(channel, tag, message)
+	assert channel.nacked == [(2, True, True)]  # Returned to the queue once
+
+	for tag, message in enumerate(messages, 3):
+		buffer.add(channel, tag, message, redelivered=True)
+	assert channel.acked == [3] and channel.nacked[1:] == [(4, False, False)]
+	assert saver.saved == [('pose', 1)]
@@ -1,11 +1,15 @@
 import io
 from pathlib import Path
 
+import matplotlib.pyplot as plt
+import numpy as np
 from PIL import Image
 import pytest
 
-from MindReader import parsers
-from MindReader.parsers import color_image
+from MindReader import parsers, IOAccess
+from MindReader.IOAccess.field_manifest import write_manifest
+from MindReader.parsers import color_image, depth_image
+from MindReader.parsers.manager import read_snapshot
 from MindReader.utils.protobuf import ColorImage
 
 RESULTS = {
@@ -56,4 +60,97 @@ def test_color_image(image_path, image_format, tmp_path):
 			im.save(compare, format=image_format)
 			assert abs(len(output.getvalue()) - len(image_data)) < 1000
 
+
+@pytest.mark.parametrize('image_format,options', [
+	('jpeg', {'QUALITY': 90, 'PROGRESSIVE': True}),
+	('webp', {'QUALITY': 50}),
+])
+def test_color_image_encoder(image_format, options, color_image_factory, monkeypatch):
+	monkeypatch.setattr(color_image, 'FORMAT', image_format)
+	for option, value in options.items():
+		monkeypatch.setattr(color_image, option, value)
+	ci = color_image_factory(20, 30)
+
+	with io.BytesIO() as output:
+		metadata = parsers.PARSERS['color_image'](output, ci)
+		assert metadata['encoded_size'] == len(output.getvalue())
+		output.seek(0)
+		assert Image.open(output).format == image_format.upper()
+	assert metadata['Content-Type'] == f'image/{image_format}'
+	assert metadata['encode_time'] > 0
+
+
+def test_heatmap_like_matplotlib(depth_image_factory):
+	image = depth_image_factory(15, 20)
+	values = np.array(image.data, dtype=np.float32).reshape(15, 20)
+	expected = plt.get_cmap('hot')(plt_normalize(values), bytes=True)[..., :3]
+	assert (depth_image.heatmap(depth_image.depth_values(image).reshape(15, 20)) == expected).all()
+
+
+def plt_normalize(values):
+	return (values - values.min()) / (values.max() - values.min())
+
+
+def test_parse_many(snapshot_factory, tmp_path):
+	snapshot = snapshot_factory()
+	snapshot_path = tmp_path / 'user' / '1' / 'snapshot.raw.protocol_protobuf'
+	snapshot_path.parent.mkdir(parents=True)
+	snapshot_path.write_bytes(snapshot.SerializeToString())
+
+	results = parsers.parse_many(snapshot_path, ['feelings', 'pose'])
+	assert results == {name: parsers.parse(snapshot_path, name) for name in ['feelings', 'pose']}
+	assert parsers.parse_many(snapshot_path, ['feelings', 'no-such-parser']) is None
+
+
+def test_parse_with_field_manifest(snapshot_factory, tmp_path):
+	snapshot = snapshot_factory()
+	snapshot_path = tmp_path / 'user' / '1' / 'snapshot.raw.protocol_protobuf'
+	snapshot_path.parent.mkdir(parents=True)
+	snapshot_path.write_bytes(snapshot.SerializeToString())
+	expected = parsers.parse(snapshot_path, 'pose')
+
+	write_manifest(snapshot_path, snapshot.SerializeToString())
+	read = read_snapshot(snapshot_path, ['pose'])
+	assert read.pose == snapshot.pose and read.datetime == snapshot.datetime
+	assert not read.color_image.data  # Wasn't read
+	assert parsers.parse(snapshot_path, 'pose') == expected
+
+
+def test_parse_segment_snapshot(snapshot_factory, tmp_path):
+	snapshot = snapshot_factory()
+	data = snapshot.SerializeToString()
+	store = IOAccess.SegmentStore(tmp_path, segment_size=2 * (IOAccess.segment_store.RECORD_HEADER.size + len(data)))
+	locators = [store.append('user', snapshot_id, data, 'protocol_protobuf') for snapshot_id in range(3)]
+	assert len({IOAccess.segment_store.parse_locator(locator)[0] for locator in locators}) == 2  # Rolled once
+
+	with IOAccess.open(locators[2], 'rb') as fd:
+		assert fd.read() == data
+	assert IOAccess.snapshot_identity(locators[2]) == ('user', '2')
+
+	parsed = parsers.parse(locators[1], 'pose')
+	assert parsed == parsers.parse_many(locators[1], ['pose'])['pose']
+
+
+def test_append_segment_chunks(tmp_path):
+	store = IOAccess.SegmentStore(tmp_path)
+
+	def malformed():
+		yield b'first'
+		raise ValueError('Truncated message')
+
+	with pytest.raises(ValueError):
+		store.append('user', 1, malformed(), 'protocol_protobuf')
+	assert list((tmp_path / 'user').iterdir()) == []  # The empty segment was removed
+	store.append('user', 2, b'second', 'protocol_protobuf')
+	with pytest.raises(ValueError):
+		store.append('user', 3, malformed(), 'protocol_protobuf')
+	locator = store.append('user', 4, iter([b'fou', b'rth']), 'protocol_protobuf')
+
+	with IOAccess.open(locator, 'rb') as fd:
+		assert fd.read() == b'fourth'
+	assert IOAccess.snapshot_identity(locator) == ('user', '4')
+	segment_path, offset, _ = IOAccess.segment_store.parse_locator(locator)
+	assert offset == 2 * IOAccess.segment_store.RECORD_HEADER.size + len(b'second')  # Nothing left of the third
+
+
 # For the rest I don't have any interesting tests
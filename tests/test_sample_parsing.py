@@ -1,9 +1,11 @@
+import io
 import itertools
 
 from google.protobuf.json_format import ParseDict
 
 from MindReader import IOAccess
-from MindReader.utils.protobuf import User
+from MindReader.utils.protobuf import LazyMessage, Snapshot, User
+from MindReader.utils.protobuf import field_numbers, keep_fields, drop_fields, extract_fields
 
 
 def test_sample(sample_factory, tmp_path):
@@ -18,3 +20,73 @@ def test_sample(sample_factory, tmp_path):
 	assert ParseDict(new_user_dict, new_user).SerializeToString() == user.SerializeToString()
 	for comp, source in zip(c, new_s):
 		assert comp.SerializeToString() == source.SerializeToString()
+
+
+def test_mmap_sample(sample_factory, tmp_path):
+	user, snapshots = sample_factory()
+	c, s = itertools.tee(snapshots)
+	with open(str(tmp_path / 'sample'), 'wb') as fd:
+		IOAccess.write(fd, 'sample', user, s)
+
+	new_user_dict, new_s = IOAccess.read_url(str(tmp_path / 'sample'), 'sample', version='mmap')
+	new_user = User()
+	assert ParseDict(new_user_dict, new_user).SerializeToString() == user.SerializeToString()
+	assert [source.SerializeToString() for source in new_s] == [comp.SerializeToString() for comp in c]
+
+
+def test_sample_index(sample_factory, tmp_path):
+	user, snapshots = sample_factory(20)
+	snapshots = list(snapshots)
+	for i, snapshot in enumerate(snapshots):
+		snapshot.datetime = 1000 + 10 * i
+	path = str(tmp_path / 'sample')
+	with open(path, 'wb') as fd:
+		IOAccess.write(fd, 'sample', user, snapshots)
+
+	index = IOAccess.build_index(path)
+	assert len(IOAccess.load_index(path)) == 20
+	expected = [snapshot.SerializeToString() for snapshot in snapshots[5:9]]
+	with open(path, 'rb') as fd:
+		_, selected = IOAccess.read(fd, 'sample', index=index, since=1045, stop=9)
+		assert [snapshot.SerializeToString() for snapshot in selected] == expected
+	_, selected = IOAccess.read_url(path, 'sample', version='mmap', index=index, since=1045, stop=9)
+	assert [snapshot.SerializeToString() for snapshot in selected] == expected
+
+	parts = index.split(3)
+	assert len(parts) == 3 and parts[0][0] == 0 and parts[-1][1] == 20
+	assert all(previous[1] == following[0] for previous, following in zip(parts, parts[1:]))
+	first, last = index.byte_range(*parts[1])
+	with open(path, 'rb') as fd:
+		fd.seek(first)
+		part = [snapshot.SerializeToString() for snapshot in map(Snapshot.FromString, IOAccess.read(
+			io.BytesIO(fd.read(last - first)), 'messages'))]
+	assert part == [snapshot.SerializeToString() for snapshot in snapshots[parts[1][0]:parts[1][1]]]
+
+
+def test_wire_fields(snapshot_factory):
+	snapshot = snapshot_factory()
+	data = snapshot.SerializeToString()
+	pose_only = Snapshot()
+	pose_only.CopyFrom(snapshot)
+	for field in ('color_image', 'depth_image', 'feelings'):
+		pose_only.ClearField(field)
+
+	numbers = field_numbers(Snapshot, ['datetime', 'pose'])
+	assert Snapshot.FromString(keep_fields(data, numbers)) == pose_only
+	assert Snapshot.FromString(drop_fields(data, field_numbers(Snapshot, ['color_image', 'depth_image', 'feelings']))) \
+	       == pose_only
+	extracted = extract_fields(data, field_numbers(Snapshot, ['datetime', 'color_image']))
+	assert extracted[1] == [snapshot.datetime]
+	assert bytes(extracted[3][0]) == snapshot.color_image.SerializeToString()
+
+	with io.BytesIO() as fd:
+		IOAccess.write(fd, 'snapshot', memoryview(data), version='protobuf', fields=['pose'])
+		assert Snapshot.FromString(fd.getvalue()) == pose_only
+
+
+def test_lazy_snapshot(snapshot_factory):
+	snapshot = snapshot_factory()
+	lazy = LazyMessage(Snapshot, snapshot.SerializeToString())
+	assert lazy.pose == snapshot.pose and lazy.datetime == snapshot.datetime
+	assert 'pose' in vars(lazy) and 'color_image' not in vars(lazy)  # Only the accessed fields are decoded
+	assert lazy.decode() == snapshot
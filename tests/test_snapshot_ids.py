@@ -0,0 +1,42 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from MindReader.utils.snapshot_id_generator import BlockAllocator, SnowflakeGenerator, COUNTER, LEGACY_COUNTER
+from MindReader.utils.snapshot_id_generator import lease_worker
+
+
+def allocate(path, amount):
+	allocator = BlockAllocator(path, block_size=10)
+	return [allocator() for _ in range(amount)]
+
+
+def test_block_allocators_dont_collide(tmp_path):
+	path = tmp_path / 'counter'
+	first, second = BlockAllocator(path, block_size=10), BlockAllocator(path, block_size=10)
+	ids = [first() for _ in range(5)] + [second() for _ in range(15)] + [first() for _ in range(10)]
+	assert len(set(ids)) == len(ids)
+	assert COUNTER.unpack(path.read_bytes()) == (40,)  # Only the boundaries are stored
+
+	with ProcessPoolExecutor(max_workers=4) as executor:
+		leased = [id_ for ids in executor.map(allocate, [path] * 4, [25] * 4) for id_ in ids]
+	assert len(set(leased + ids)) == len(leased) + len(ids)
+
+
+def test_legacy_counter(tmp_path):
+	path = tmp_path / 'counter'
+	path.write_bytes(LEGACY_COUNTER.pack(41))
+	assert BlockAllocator(path)() == 42
+
+
+def test_snowflake_ids_are_ordered(tmp_path):
+	generator = SnowflakeGenerator(workers_dir=tmp_path / 'workers')
+	ids = [generator() for _ in range(10000)]
+	assert ids == sorted(ids) and len(set(ids)) == len(ids)
+	assert SnowflakeGenerator(workers_dir=tmp_path / 'workers')() & 0x3ff000 != ids[0] & 0x3ff000
+
+
+def test_snowflake_workers_are_reclaimed(tmp_path):
+	worker, fd = lease_worker(tmp_path)
+	assert [lease_worker(tmp_path)[0] for _ in range(3)] == [1, 2, 3]  # Held until closed
+	os.close(fd)
+	assert lease_worker(tmp_path)[0] == worker  # Free again